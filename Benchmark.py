@@ -0,0 +1,246 @@
+''' Benchmarks splitting, mask decoding, block selection, dataset building, training and
+prediction on synthetic images, measuring time and peak memory of each case.
+
+    python Benchmark.py --output results.json
+    python Benchmark.py --quick --compare results.json --tolerance 0.25
+'''
+import cv2
+import numpy as np
+import logging as log
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import timeit
+try:
+    import queue as Queue
+except ImportError: # python 2
+    import Queue
+
+import ImageSplitting as Imaging
+import Labelling
+import LinearSVM
+import Training
+
+ImageSizes = [512, 1024, 2048, 4096, 8192]
+ImageCounts = [10, 100, 1000, 10000]
+QuickImageSizes = [512, 1024]
+QuickImageCounts = [10, 100]
+
+def syntheticImage(Size, Channels=3, Seed=0):
+    ''' random image of Size X Size pixels '''
+    shape = (Size, Size, Channels) if Channels > 1 else (Size, Size)
+    return np.random.RandomState(Seed).randint(0, 256, size=shape).astype(np.uint8)
+
+def syntheticMask(Size, Seed=0):
+    ''' colour coded mask with green rectangles on black '''
+    mask = np.zeros((Size, Size, 3), dtype=np.uint8)
+    randomState = np.random.RandomState(Seed)
+    for rectangle in range(16):
+        row, col = randomState.randint(0, Size, size=2)
+        height, width = randomState.randint(Size // 16, Size // 4 + 1, size=2)
+        mask[row:row + height, col:col + width] = (0, 255, 0)
+    return mask
+
+def syntheticTrainingFolder(FolderPath, ImageCount, ImageSize):
+    ''' writes ImageCount grayscale images split over label folders 0_NotGrass, 1_Grass '''
+    for index in range(ImageCount):
+        labelFolder = os.path.join(FolderPath, ['0_NotGrass', '1_Grass'][index % 2])
+        if not os.path.isdir(labelFolder):
+            os.makedirs(labelFolder)
+        image = syntheticImage(ImageSize, Channels=1, Seed=index)
+        if index % 2: image //= 2 # make classes separable
+        cv2.imwrite(os.path.join(labelFolder, '{}.png'.format(index)), image)
+
+# Each case prepares its data (not measured) and returns the function to measure.
+
+def caseSplitShifting(Size):
+    image = syntheticImage(Size)
+    return lambda: Imaging.SplitImageinBlocksByShifting(image, Training.DefaultSplittingBlock)
+
+def caseSplitStrided(Size):
+    image = syntheticImage(Size)
+    return lambda: Imaging.SplitImageInStridedBlocks(image, Training.DefaultSplittingBlock)
+
+def caseBinaryMask(Size):
+    mask = syntheticMask(Size)
+    return lambda: Labelling.getBinaryMaskFromColorCodedImage(mask)
+
+def caseSelectPerBlock(Size):
+    image, mask = syntheticImage(Size), Labelling.getBinaryMaskFromColorCodedImage(syntheticMask(Size))
+    def select():
+        imageBlocks = Imaging.iterateImageBlocks(
+            Imaging.SplitImageinBlocksByShifting(image, Training.DefaultSplittingBlock))
+        maskBlocks = Imaging.iterateImageBlocks(
+            Imaging.SplitImageinBlocksByShifting(mask, Training.DefaultSplittingBlock))
+        return sum(1 for block in Labelling.iterateImageBlocksBasedOnMask(imageBlocks, maskBlocks))
+    return select
+
+def caseSelectIntegral(Size):
+    mask = Labelling.getBinaryMaskFromColorCodedImage(syntheticMask(Size))
+    return lambda: Labelling.getBlockSelectionFromMask(mask, Training.DefaultSplittingBlock, EdgeMode='pad')
+
+def _trainingFolder(Count, ImageSize):
+    # reused between runs, the marker file is written once all images are
+    folder = os.path.join(tempfile.gettempdir(), 'ml-tools-benchmark-{}-{}'.format(Count, ImageSize))
+    completeMarker = folder + '.complete'
+    if not os.path.isfile(completeMarker):
+        if os.path.isdir(folder): # left incomplete by an interrupted run
+            shutil.rmtree(folder)
+        syntheticTrainingFolder(folder, Count, ImageSize)
+        open(completeMarker, 'w').close()
+    return folder
+
+def caseDatasetBuild(Count, ImageSize=512):
+    folder = _trainingFolder(Count, ImageSize)
+    return lambda: Training.prepareTrainingDataFromImageStrucuture(folder, Seed=0)
+
+def _trainingData(Count, ImageSize):
+    trainingData, labelData, labels = Training.prepareTrainingDataFromImageStrucuture(
+        _trainingFolder(Count, ImageSize), Seed=0)
+    return trainingData, np.float32(labelData)
+
+def caseTrain(Count, ImageSize=512):
+    trainingData, labelData = _trainingData(Count, ImageSize)
+    return lambda: Training.TrainNSaveSVM(trainingData, labelData, None)
+
+def casePredictSVM(Count, ImageSize=512):
+    trainingData, labelData = _trainingData(Count, ImageSize)
+    svmFileName = os.path.join(tempfile.mkdtemp(), 'svm_data.dat')
+    Training.TrainNSaveSVM(trainingData, labelData, svmFileName)
+    detector = Training.SVMDetector(svmFileName)
+    return lambda: detector.predictSamples(trainingData)
+
+def casePredictLinear(Count, ImageSize=512):
+    trainingData, labelData = _trainingData(Count, ImageSize)
+    randomState = np.random.RandomState(0)
+    model = LinearSVM.LinearSVMModel(randomState.randn(1, trainingData.shape[1]).astype(np.float32),
+                                     np.zeros(1, np.float32), np.float32([0, 1]), np.array([[0, 1]]))
+    return lambda: LinearSVM.ScoreLinearSVM(model, trainingData)
+
+# name: (case function, parameter name, uses image sizes (else image counts), needs cv2.SVM)
+BenchmarkCases = dict([
+    ('split/shifting', (caseSplitShifting, 'size', True, False)),
+    ('split/strided', (caseSplitStrided, 'size', True, False)),
+    ('mask/binary', (caseBinaryMask, 'size', True, False)),
+    ('select/perBlock', (caseSelectPerBlock, 'size', True, False)),
+    ('select/integral', (caseSelectIntegral, 'size', True, False)),
+    ('dataset/build', (caseDatasetBuild, 'images', False, False)),
+    ('train/svm', (caseTrain, 'images', False, True)),
+    ('predict/svm', (casePredictSVM, 'images', False, True)),
+    ('predict/linear', (casePredictLinear, 'images', False, False)),
+])
+
+def _peakMemoryKB():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak # bytes on mac os, KB elsewhere
+
+def _measureCase(CaseName, Parameter, Repeat, ResultQueue):
+    try:
+        caseFunc = BenchmarkCases[CaseName][0]
+        measuredFunc = caseFunc(Parameter)
+        memoryBefore = _peakMemoryKB()
+        timings = []
+        for repeat in range(Repeat):
+            startTime = timeit.default_timer()
+            measuredFunc()
+            timings.append(timeit.default_timer() - startTime)
+        ResultQueue.put(dict(seconds=min(timings), peakMemoryKB=max(0, _peakMemoryKB() - memoryBefore)))
+    except Exception as error:
+        ResultQueue.put(dict(error='{}: {}'.format(type(error).__name__, error)))
+
+def runCase(CaseName, Parameter, Repeat=3, Timeout=None):
+    ''' Measures a case in its own process, so its peak memory is not hidden by earlier cases.
+Returns result dict with seconds (best of Repeat) and peakMemoryKB (growth of peak
+resident memory while measuring), or error if the case raised, its process died (e.g.
+killed when out of memory) or it ran longer than Timeout seconds '''
+    resultQueue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_measureCase,
+                                      args=(CaseName, Parameter, Repeat, resultQueue))
+    process.start()
+    startTime = timeit.default_timer()
+    result = None
+    while result is None:
+        try:
+            result = resultQueue.get(timeout=1)
+        except Queue.Empty:
+            if not process.is_alive():
+                try: # result put just before exiting
+                    result = resultQueue.get(timeout=1)
+                except Queue.Empty:
+                    result = dict(error='process exited with code {}'.format(process.exitcode))
+            elif Timeout and timeit.default_timer() - startTime > Timeout:
+                process.terminate()
+                result = dict(error='timed out after {} seconds'.format(Timeout))
+    process.join()
+    result.update(name=CaseName, parameter=BenchmarkCases[CaseName][1], value=Parameter)
+    return result
+
+def runBenchmarks(CaseNames=None, Sizes=ImageSizes, Counts=ImageCounts, Repeat=3, Timeout=None):
+    ''' Runs the cases (default all) for each image size or image count, returns results '''
+    results = []
+    for caseName in CaseNames or sorted(BenchmarkCases):
+        caseFunc, parameterName, usesSizes, needsSvm = BenchmarkCases[caseName]
+        if needsSvm and not hasattr(cv2, 'SVM'):
+            log.warning('Benchmark: skipping {}, cv2.SVM not available'.format(caseName))
+            continue
+        for value in (Sizes if usesSizes else Counts):
+            result = runCase(caseName, value, Repeat, Timeout)
+            log.info('Benchmark: {}'.format(result))
+            results.append(result)
+    return results
+
+def _resultKey(result):
+    return '{}[{}={}]'.format(result['name'], result['parameter'], result['value'])
+
+def compareResults(Results, BaselineResults, Tolerance=0.25):
+    ''' Returns list of regressions, (key, metric, baseline value, value) for every
+result whose seconds or peakMemoryKB exceed its baseline by more than Tolerance '''
+    baseline = dict((_resultKey(result), result) for result in BaselineResults)
+    regressions = []
+    for result in Results:
+        baseResult = baseline.get(_resultKey(result))
+        if baseResult is None or 'error' in result or 'error' in baseResult:
+            continue
+        for metric, minimum in (('seconds', 1e-3), ('peakMemoryKB', 1024)):
+            # ignore changes below timer and page size noise
+            if result[metric] > max(baseResult[metric], minimum) * (1 + Tolerance):
+                regressions.append((_resultKey(result), metric, baseResult[metric], result[metric]))
+    return regressions
+
+def main(Arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--cases', nargs='*', choices=sorted(BenchmarkCases), help='cases to run (default all)')
+    parser.add_argument('--sizes', nargs='*', type=int, help='image sizes (default {})'.format(ImageSizes))
+    parser.add_argument('--images', nargs='*', type=int, help='image counts (default {})'.format(ImageCounts))
+    parser.add_argument('--quick', action='store_true', help='only the small sizes and counts')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--timeout', type=float, help='seconds after which a case fails (default none)')
+    parser.add_argument('--output', help='write results to this json file')
+    parser.add_argument('--compare', help='baseline json file to flag regressions against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown/growth ratio')
+    arguments = parser.parse_args(Arguments)
+    log.basicConfig(level=log.INFO)
+
+    sizes = arguments.sizes or (QuickImageSizes if arguments.quick else ImageSizes)
+    counts = arguments.images or (QuickImageCounts if arguments.quick else ImageCounts)
+    results = runBenchmarks(arguments.cases, sizes, counts, arguments.repeat, arguments.timeout)
+    if arguments.output:
+        with open(arguments.output, 'w') as outputFile:
+            json.dump(dict(numpy=np.__version__, opencv=cv2.__version__, results=results),
+                      outputFile, indent=2, sort_keys=True)
+    if arguments.compare:
+        with open(arguments.compare) as baselineFile:
+            baselineResults = json.load(baselineFile)['results']
+        regressions = compareResults(results, baselineResults, arguments.tolerance)
+        for key, metric, baseValue, value in regressions:
+            log.error('Regression: {} {} {} -> {}'.format(key, metric, baseValue, value))
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
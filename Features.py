@@ -0,0 +1,116 @@
+import numpy as np
+import logging as log
+import functools
+
+import Instrumentation
+
+try:
+    basestring
+except NameError: # python 3
+    basestring = str
+
+# Feature extractors turn a batch of grayscale blocks (blocks X blockHeight X blockWidth)
+# into a feature matrix (blocks X features), working on the whole batch at once.
+
+def rawFeatures(Blocks):
+    ''' all pixel values of each block '''
+    return Blocks.reshape(len(Blocks), -1)
+
+def histogramFeatures(Blocks, Bins=32):
+    ''' normalized intensity histogram (Bins) of each block '''
+    pixels = Blocks.reshape(len(Blocks), -1)
+    binIndices = np.clip(pixels.astype(np.intp) * Bins // 256, 0, Bins - 1)
+    binIndices += (np.arange(len(Blocks)) * Bins)[:, np.newaxis] # histogram per block
+    histograms = np.bincount(binIndices.ravel(), minlength=len(Blocks) * Bins)
+    return histograms.reshape(len(Blocks), Bins) / float(pixels.shape[1])
+
+def downsampleFeatures(Blocks, Factor=5):
+    ''' block averages Factor X Factor pixels, dropping edge pixels not filling a whole area '''
+    blockCount, blockHeight, blockWidth = Blocks.shape
+    rows, cols = blockHeight // Factor, blockWidth // Factor
+    areas = Blocks[:, :rows * Factor, :cols * Factor].reshape(blockCount, rows, Factor, cols, Factor)
+    return areas.mean(axis=(2, 4), dtype=np.float64).reshape(blockCount, rows * cols)
+
+def pyramidFeatures(Blocks, Factors=(7, 14, 35)):
+    ''' downsampled blocks at each of Factors joined together '''
+    return np.hstack([downsampleFeatures(Blocks, factor) for factor in Factors])
+
+def hogFeatures(Blocks, CellSize=10, Bins=9):
+    ''' histogram of oriented gradients: unsigned gradient orientations (Bins over 180
+    degrees) weighted by gradient magnitude in each CellSize X CellSize cell, normalized
+    per block '''
+    blockCount, blockHeight, blockWidth = Blocks.shape
+    if blockHeight < CellSize or blockWidth < CellSize:
+        raise ValueError('Invalid Argument: blocks {}x{} should not be smaller than CellSize {}'
+                         .format(blockHeight, blockWidth, CellSize))
+    Blocks = Blocks.astype(np.float32)
+    gradientRows, gradientCols = np.zeros_like(Blocks), np.zeros_like(Blocks)
+    gradientRows[:, 1:-1] = Blocks[:, 2:] - Blocks[:, :-2]
+    gradientCols[:, :, 1:-1] = Blocks[:, :, 2:] - Blocks[:, :, :-2]
+    magnitudes = np.hypot(gradientRows, gradientCols)
+    orientations = np.arctan2(gradientRows, gradientCols) % np.pi
+    binIndices = np.minimum((orientations * (Bins / np.pi)).astype(np.intp), Bins - 1)
+    rows, cols = blockHeight // CellSize, blockWidth // CellSize
+    cellRows = np.minimum(np.arange(blockHeight) // CellSize, rows - 1)
+    cellCols = np.minimum(np.arange(blockWidth) // CellSize, cols - 1)
+    cellIndices = cellRows[:, np.newaxis] * cols + cellCols[np.newaxis, :]
+    featureIndices = ((np.arange(blockCount) * rows * cols)[:, np.newaxis, np.newaxis]
+                      + cellIndices) * Bins + binIndices
+    histograms = np.bincount(featureIndices.ravel(), weights=magnitudes.ravel(),
+                             minlength=blockCount * rows * cols * Bins)
+    histograms = histograms.reshape(blockCount, rows * cols * Bins)
+    norms = np.sqrt((histograms ** 2).sum(axis=1, keepdims=True)) + 1e-6
+    return histograms / norms
+
+FeatureExtractors = dict(raw=rawFeatures, histogram=histogramFeatures,
+                         downsample=downsampleFeatures, pyramid=pyramidFeatures, hog=hogFeatures)
+
+def getFeatureExtractorName(FeatureExtractor, FeatureKey=None):
+    ''' name of FeatureExtractor identifying its features e.g. in tile cache keys: a name
+    in FeatureExtractors, the name of a function in FeatureExtractors, or of a
+    functools.partial of one including its arguments. Other functions need FeatureKey,
+    naming the function and its parameters '''
+    if FeatureKey is not None:
+        return FeatureKey
+    if isinstance(FeatureExtractor, basestring):
+        return FeatureExtractor
+    for name, func in FeatureExtractors.items():
+        if FeatureExtractor is func:
+            return name
+    if isinstance(FeatureExtractor, functools.partial):
+        return '{}{}'.format(getFeatureExtractorName(FeatureExtractor.func),
+                             (FeatureExtractor.args, sorted((FeatureExtractor.keywords or {}).items())))
+    raise ValueError('Invalid Argument: FeatureKey required for FeatureExtractor {} not in FeatureExtractors'
+                     .format(FeatureExtractor))
+
+def _getFeatureFunc(FeatureExtractor):
+    if not callable(FeatureExtractor):
+        if FeatureExtractor not in FeatureExtractors:
+            raise ValueError('Invalid Argument: FeatureExtractor "{}" should be one of {} or a function'
+                             .format(FeatureExtractor, sorted(FeatureExtractors)))
+        FeatureExtractor = FeatureExtractors[FeatureExtractor]
+    return FeatureExtractor
+
+def extractFeatures(Blocks, FeatureExtractor='raw', DataType=np.float32):
+    ''' Returns feature matrix (blocks X features) of DataType for Blocks, a stack of
+    blocks or blocks of an image (rows X cols X blockHeight X blockWidth) '''
+    Blocks = np.asarray(Blocks)
+    blockCount = int(np.prod(Blocks.shape[:-2]))
+    if FeatureExtractor == 'raw': # flatten (strided) blocks with a single copy
+        features = np.empty((blockCount, Blocks.shape[-2] * Blocks.shape[-1]), dtype=DataType)
+        np.copyto(features.reshape(Blocks.shape), Blocks, casting='unsafe')
+        return features
+    stackedBlocks = Blocks.reshape((blockCount,) + Blocks.shape[-2:])
+    if blockCount == 0: # e.g. image smaller than a block, features of one blank block give the shape
+        return extractFeatures(np.zeros((1,) + Blocks.shape[-2:], dtype=Blocks.dtype),
+                               FeatureExtractor, DataType)[:0]
+    with Instrumentation.stageTimer('features'):
+        features = _getFeatureFunc(FeatureExtractor)(stackedBlocks)
+    log.debug('extracted features: {} of {} blocks'.format(features.shape, len(stackedBlocks)))
+    return np.asarray(features, dtype=DataType)
+
+def getFeatureCount(FeatureExtractor, SplitBlock):
+    ''' number of features FeatureExtractor creates from a block of SplitBlock size '''
+    BlockWidth, BlockHeight = SplitBlock[:2]
+    return extractFeatures(np.zeros((1, BlockHeight, BlockWidth), dtype=np.uint8),
+                           FeatureExtractor).shape[1]
@@ -2,102 +2,473 @@ import cv2
 import numpy as np
 import logging as log
 import os
+import struct
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
-from collections import namedtuple
+import Instrumentation
+
+from numpy.lib.stride_tricks import as_strided
+from collections import namedtuple, OrderedDict, deque
+try:
+    from collections.abc import Mapping, ItemsView
+except ImportError: # python 2
+    from collections import Mapping, ItemsView
 SplittingBlock = namedtuple('SplittingBlock','blockWidth, blockHeight, OverlapHorizontal, OverlapVertical')
 
 def SplitImageinBlocksByShifting(Image, SplitBlock):
     ''' Splits an image into blocks of size BlockWidth X BlockHeight pixels, 
 blocks are created by traversing first from left to right and then top to bottom '''
-    if not SplitBlock  or type(SplitBlock) != SplittingBlock:
-        raise ValueError("Error: Invalid Argument - SplitBlock")
-    BlockWidth, BlockHeight, OverlapHorizontal, OverlapVertical = SplitBlock
-    if OverlapHorizontal >= BlockWidth or OverlapVertical >= BlockHeight:
-        raise ValueError("Invalid Argument: Vertical and/or Horizontal Overlap Values." 
-                         " Ensure Overlaps are more than Block Height/Width ")
+    BlockWidth, BlockHeight, OverlapHorizontal, OverlapVertical = _validateSplittingBlock(SplitBlock)
     imageBlocks = []
     imageHeight = Image.shape[0]
     imageWidth = Image.shape[1]
+    debugEnabled = Instrumentation.isDebugEnabled()
     row = 0
     while row < imageHeight:
         col = 0 
         imageBlocksInRow = []
         while col < imageWidth:
             imageBlock = Image[row:row+BlockHeight, col:col+BlockWidth]
-            log.debug('Image Block At:({}, {}); Shape:{}.'.
-                      format(row,col, imageBlock.shape))
+            if debugEnabled:
+                log.debug('Image Block At:({}, {}); Shape:{}.'.
+                          format(row,col, imageBlock.shape))
             imageBlocksInRow.append(imageBlock)
             col = col + BlockWidth - OverlapHorizontal
         imageBlocks.append(imageBlocksInRow)
         row = row + BlockHeight - OverlapVertical
+    Instrumentation.addCount('tiles', sum(len(imageBlocksInRow) for imageBlocksInRow in imageBlocks))
     return imageBlocks
 
+BlockEdgeModes = ('drop', 'pad', 'shift')
+
+def getBlockOrigins(Length, BlockSize, Overlap, EdgeMode='drop'):
+    ''' Returns 1-D array of block start positions along an axis of Length pixels.
+EdgeMode decides the last block: 'drop' keeps only complete blocks, 'pad' keeps
+ragged blocks (to be zero padded) and 'shift' moves the last block back to end at Length '''
+    if EdgeMode not in BlockEdgeModes:
+        raise ValueError('Invalid Argument: EdgeMode "{}" should be one of {}'
+                         .format(EdgeMode, BlockEdgeModes))
+    step = BlockSize - Overlap
+    if EdgeMode == 'pad':
+        return np.arange(0, Length, step)
+    if Length < BlockSize:
+        return np.arange(0) # no complete block fits along this axis
+    origins = np.arange(0, Length - BlockSize + 1, step)
+    if EdgeMode == 'shift' and origins[-1] + BlockSize < Length:
+        origins = np.append(origins, Length - BlockSize)
+    return origins
+
+def getOriginsGrid(rowOrigins, colOrigins):
+    ''' Returns (row, col) origins of blocks as array (rows X cols X 2) '''
+    origins = np.empty((len(rowOrigins), len(colOrigins), 2), dtype=np.intp)
+    origins[..., 0] = np.asarray(rowOrigins)[:, np.newaxis]
+    origins[..., 1] = np.asarray(colOrigins)[np.newaxis, :]
+    return origins
+
+def _validateSplittingBlock(SplitBlock):
+    if not SplitBlock  or type(SplitBlock) != SplittingBlock:
+        raise ValueError("Error: Invalid Argument - SplitBlock")
+    BlockWidth, BlockHeight, OverlapHorizontal, OverlapVertical = SplitBlock
+    if OverlapHorizontal >= BlockWidth or OverlapVertical >= BlockHeight:
+        raise ValueError("Invalid Argument: Vertical and/or Horizontal Overlap Values."
+                         " Ensure Overlaps are more than Block Height/Width ")
+    return SplitBlock
+
+def _isEquallySpaced(origins):
+    return len(origins) < 3 or (np.diff(origins) == origins[1] - origins[0]).all()
+
+def SplitImageAtOrigins(Image, rowOrigins, colOrigins, BlockHeight, BlockWidth):
+    ''' Returns blocks (rows X cols X BlockHeight X BlockWidth[X channels]) of Image
+whose top left pixels are at rowOrigins X colOrigins, e.g. from getBlockOrigins().
+Blocks reaching past Image are padded with zeros. Equally spaced origins give a
+read-only strided view over Image, otherwise the blocks are gathered (copied) from
+a stride-1 window view '''
+    rowOrigins, colOrigins = np.asarray(rowOrigins), np.asarray(colOrigins)
+    extraDims = Image.shape[2:]
+    if len(rowOrigins) == 0 or len(colOrigins) == 0:
+        return np.zeros((len(rowOrigins), len(colOrigins), BlockHeight, BlockWidth)
+                        + extraDims, dtype=Image.dtype)
+    padRows = max(0, rowOrigins[-1] + BlockHeight - Image.shape[0])
+    padCols = max(0, colOrigins[-1] + BlockWidth - Image.shape[1])
+    if padRows or padCols: # ragged edge blocks, pad with zeros (copies the image)
+        Image = np.pad(Image, [(0, padRows), (0, padCols)] + [(0, 0)] * len(extraDims),
+                       mode='constant')
+    rowStride, colStride = Image.strides[:2]
+    if _isEquallySpaced(rowOrigins) and _isEquallySpaced(colOrigins):
+        rowStep = rowOrigins[1] - rowOrigins[0] if len(rowOrigins) > 1 else 0
+        colStep = colOrigins[1] - colOrigins[0] if len(colOrigins) > 1 else 0
+        start = Image[rowOrigins[0]:, colOrigins[0]:]
+        return as_strided(start,
+                          shape=(len(rowOrigins), len(colOrigins), BlockHeight, BlockWidth) + extraDims,
+                          strides=(rowStep * rowStride, colStep * colStride) + Image.strides,
+                          writeable=False)
+    windows = as_strided(Image,
+                         shape=(Image.shape[0] - BlockHeight + 1, Image.shape[1] - BlockWidth + 1,
+                                BlockHeight, BlockWidth) + extraDims,
+                         strides=(rowStride, colStride) + Image.strides,
+                         writeable=False)
+    return windows[rowOrigins[:, np.newaxis], colOrigins[np.newaxis, :]]
+
+def SplitImageInStridedBlocks(Image, SplitBlock, EdgeMode='drop'):
+    ''' Splits an image into blocks like SplitImageinBlocksByShifting() but returns one
+array of blocks (rows X cols X BlockHeight X BlockWidth[X channels]) along with block
+origins (rows X cols X 2) holding (row, col) of each block's top left pixel.
+Blocks are a read-only view sharing Image's buffer, except with EdgeMode 'pad' (when
+blocks are ragged) or 'shift' (when the last block is shifted) which need a copy. '''
+    BlockWidth, BlockHeight, OverlapHorizontal, OverlapVertical = _validateSplittingBlock(SplitBlock)
+    rowOrigins = getBlockOrigins(Image.shape[0], BlockHeight, OverlapVertical, EdgeMode)
+    colOrigins = getBlockOrigins(Image.shape[1], BlockWidth, OverlapHorizontal, EdgeMode)
+    imageBlocks = SplitImageAtOrigins(Image, rowOrigins, colOrigins, BlockHeight, BlockWidth)
+    Instrumentation.addCount('tiles', len(rowOrigins) * len(colOrigins))
+    return imageBlocks, getOriginsGrid(rowOrigins, colOrigins)
+
 def CreateImageFromBlocks(ImageBlocks, BlankImage, SplitBlock):
     ''' Utility to recreate image inside BlankImage from ImageBlocks by joining them. 
  Note: BlankImage must be sufficiently large enough to hold ImageBlocks'''
     BlockWidth, BlockHeight, OverlapHorizontal, OverlapVertical = SplitBlock
+    debugEnabled = Instrumentation.isDebugEnabled()
     row = 0
     for imageBlocksInRow in ImageBlocks:
         col = 0
         for thisImageBlock in imageBlocksInRow:
-            log.debug('copying imageBlock:{0} to BlankImage:{1} at row,col:{2},{3}'.
-                     format(thisImageBlock.shape, BlankImage.shape, row,col))
+            if debugEnabled:
+                log.debug('copying imageBlock:{0} to BlankImage:{1} at row,col:{2},{3}'.
+                          format(thisImageBlock.shape, BlankImage.shape, row,col))
             BlankImage[row:row+BlockHeight, col:col+BlockWidth] = thisImageBlock
             col = col + BlockWidth - OverlapHorizontal
         row = row + BlockHeight - OverlapVertical
     return BlankImage
     
+BlockAccumulations = ('average', 'vote')
+
+def _sumOverBlocks(BlockValues, Origins, ImageShape, BlockHeight, BlockWidth):
+    ''' per pixel sum of values of the blocks covering it, adding each block value
+at its 4 corners of a difference image and integrating it '''
+    imageHeight, imageWidth = ImageShape[:2]
+    rows0, cols0 = Origins[..., 0].ravel(), Origins[..., 1].ravel()
+    rows1 = np.minimum(rows0 + BlockHeight, imageHeight)
+    cols1 = np.minimum(cols0 + BlockWidth, imageWidth)
+    BlockValues = np.asarray(BlockValues, dtype=np.float64).ravel()
+    differences = np.zeros((imageHeight + 1, imageWidth + 1), dtype=np.float64)
+    for rows, cols, sign in ((rows0, cols0, 1), (rows0, cols1, -1),
+                             (rows1, cols0, -1), (rows1, cols1, 1)):
+        np.add.at(differences, (rows, cols), sign * BlockValues)
+    return differences.cumsum(axis=0).cumsum(axis=1)[:imageHeight, :imageWidth]
+
+def CreateImageFromBlockValues(BlockValues, Origins, ImageShape, SplitBlock, Accumulate='average'):
+    ''' Creates image (float64) of ImageShape where each pixel holds the values of the
+blocks covering it: their 'average' (e.g. of confidences), or their most voted value
+('vote', of integer class labels only, ties going to the smaller value). BlockValues
+(rows X cols) and Origins (rows X cols X 2) are as given by SplitImageInStridedBlocks().
+Pixels not covered by any block are NaN '''
+    if Accumulate not in BlockAccumulations:
+        raise ValueError('Invalid Argument: Accumulate "{}" should be one of {}'
+                         .format(Accumulate, BlockAccumulations))
+    BlockWidth, BlockHeight = SplitBlock[:2]
+    BlockValues = np.asarray(BlockValues)
+    coverage = _sumOverBlocks(np.ones(BlockValues.shape), Origins, ImageShape, BlockHeight, BlockWidth)
+    uncovered = coverage < 0.5 # sums are exact integers up to float rounding
+    if Accumulate == 'average':
+        image = _sumOverBlocks(BlockValues, Origins, ImageShape, BlockHeight, BlockWidth)
+        image /= np.maximum(coverage, 1)
+    else:
+        if not np.array_equal(BlockValues, np.round(BlockValues)):
+            raise ValueError("Invalid Argument: Accumulate 'vote' needs integer class labels as BlockValues,"
+                             " use 'average' for scores")
+        # keeps only the most voted value so far, not one vote image per value
+        image, mostVotes = np.zeros(ImageShape[:2]), np.zeros(ImageShape[:2])
+        for value in np.unique(BlockValues): # ascending, so ties keep the smaller value
+            votes = _sumOverBlocks(BlockValues == value, Origins, ImageShape, BlockHeight, BlockWidth)
+            moreVotes = votes > mostVotes + 0.5 # sums are exact integers up to float rounding
+            image[moreVotes] = value
+            mostVotes[moreVotes] = votes[moreVotes]
+    image[uncovered] = np.nan
+    return image
+
 def iterateImageBlocks(ImageBlocks):
     '''Iterator returning next image block from the sequence created by 
-SplitImageinBlocksByShifting() in order from topleft block to bottomright'''
+SplitImageinBlocksByShifting() (or blocks array from SplitImageInStridedBlocks())
+in order from topleft block to bottomright'''
     if ImageBlocks is None: raise ValueError("argument empty: ImageBlocks")
-    linearBlocks = []
+    debugEnabled = Instrumentation.isDebugEnabled()
     for row, imageBlocksInRow in enumerate(ImageBlocks):
         for col, imageBlock in enumerate(imageBlocksInRow):
-            log.debug('Iterate Image Block: At:({}, {}); Shape:{}.'.
-                      format(row,col,imageBlock.shape))
+            if debugEnabled:
+                log.debug('Iterate Image Block: At:({}, {}); Shape:{}.'.
+                          format(row,col,imageBlock.shape))
             yield imageBlock
 
 def loadImageFromFile(Filename):
-    image =  cv2.imread(Filename) # load as is
+    with Instrumentation.stageTimer('decode'):
+        image =  cv2.imread(Filename) # load as is
     if image is None:
         raise ValueError('Invalid imagePath: image not found "{}"'.format(Filename))
+    Instrumentation.addCount('images')
+    Instrumentation.addCount('bytesDecoded', image.nbytes)
     return image
 
+_jpegFrameMarkers = set(range(0xC0, 0xD0)) - set([0xC4, 0xC8, 0xCC])
+
+def getImageSizeFromHeader(Filename):
+    ''' Returns (height, width) of a png, jpeg or bmp image by reading its header only,
+or None if the size can not be found from the header '''
+    with open(Filename, 'rb') as imageFile:
+        header = imageFile.read(26)
+        if header[:8] == b'\x89PNG\r\n\x1a\n' and header[12:16] == b'IHDR':
+            width, height = struct.unpack('>II', header[16:24])
+            return height, width
+        if header[:2] == b'BM' and len(header) >= 26:
+            width, height = struct.unpack('<ii', header[18:26])
+            return abs(height), width
+        if header[:2] == b'\xff\xd8':
+            imageFile.seek(2)
+            while True:
+                marker = imageFile.read(4)
+                if len(marker) < 4 or marker[:1] != b'\xff':
+                    return None
+                markerType = struct.unpack('>B', marker[1:2])[0]
+                segmentLength = struct.unpack('>H', marker[2:4])[0]
+                if markerType in _jpegFrameMarkers:
+                    height, width = struct.unpack('>xHH', imageFile.read(5))
+                    return height, width
+                imageFile.seek(segmentLength - 2, os.SEEK_CUR)
+    return None
+
+ImageFileInfo = namedtuple('ImageFileInfo', 'size, mtime')
+
+def _scanFolder(FolderPath):
+    ''' yields (name, path, ImageFileInfo or None for sub-folders) for each entry of
+FolderPath, using os.scandir() where available to avoid extra stat calls '''
+    if hasattr(os, 'scandir'):
+        for entry in os.scandir(FolderPath):
+            if entry.is_dir():
+                yield entry.name, entry.path, None
+            else:
+                entryStat = entry.stat()
+                yield entry.name, entry.path, ImageFileInfo(entryStat.st_size, entryStat.st_mtime)
+    else:
+        for name in os.listdir(FolderPath):
+            path = os.path.join(FolderPath, name)
+            if os.path.isdir(path):
+                yield name, path, None
+            else:
+                entryStat = os.stat(path)
+                yield name, path, ImageFileInfo(entryStat.st_size, entryStat.st_mtime)
+
+def ImageStructureIndexFolder(FolderPath, relativepaths=False):
+    '''Creates index of FolderPath, a dictionary like ImageStructure but with
+ImageFileInfo (size, mtime) of each image as value, without loading any image '''
+    imageIndex = dict()
+    if not os.path.isdir(FolderPath): # like os.walk(), missing folder is empty
+        return imageIndex
+    for name, path, fileInfo in _scanFolder(FolderPath):
+        keyName = name if relativepaths else path
+        imageIndex[keyName] = (ImageStructureIndexFolder(path, relativepaths)
+                               if fileInfo is None else fileInfo)
+    return imageIndex
+
+def _mapStructureLeaves(ImageStructure, LeafFunc):
+    return dict((key, _mapStructureLeaves(value, LeafFunc) if isinstance(value, Mapping) else LeafFunc(value))
+                for key, value in ImageStructure.viewitems())
+
 def ImageStructureCreateFromFolder(FolderPath, relativepaths=False):
     '''Creates ImageStructure, a dictionary matching the structure of FolderPath containing sub-folders as dictionaries and images as key/value pairs '''
-    imageStructure = dict()
-    for root, dirs, files in os.walk(FolderPath, topdown=True):
-        for fileName in files:
-            keyName = fileName if relativepaths else os.path.join(root,fileName)
-            imageStructure[keyName] = None
-        for d in dirs:
-            keyName = d if relativepaths else os.path.join(root,d)
-            imageStructure[keyName] = ImageStructureCreateFromFolder(os.path.join(root,d), relativepaths)
-        break # don't recurse
-    return imageStructure
+    return _mapStructureLeaves(ImageStructureIndexFolder(FolderPath, relativepaths),
+                               lambda fileInfo: None)
+
+class LRUImageCache(object):
+    ''' Thread safe cache of decoded images, evicting least recently used images
+to hold at most MaxBytes of image data. Counts hits, misses and evictions '''
+    def __init__(self, MaxBytes, LoadFunc=loadImageFromFile):
+        self.maxBytes = MaxBytes
+        self.loadFunc = LoadFunc
+        self.currentBytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self._images = OrderedDict() # least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, Filename):
+        with self._lock:
+            if Filename in self._images:
+                self.hits += 1
+                image = self._images.pop(Filename)
+                self._images[Filename] = image # mark as most recently used
+                return image
+            self.misses += 1
+        image = self.loadFunc(Filename) # decode outside the lock
+        with self._lock:
+            if Filename not in self._images and image.nbytes <= self.maxBytes:
+                self._images[Filename] = image
+                self.currentBytes += image.nbytes
+                while self.currentBytes > self.maxBytes:
+                    evictedName, evictedImage = self._images.popitem(last=False)
+                    self.currentBytes -= evictedImage.nbytes
+                    self.evictions += 1
+                    log.debug('LRUImageCache: evicted {}'.format(evictedName))
+        return image
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self.currentBytes = 0
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    images=len(self._images), bytes=self.currentBytes, maxBytes=self.maxBytes)
+
+class LazyImageStructure(Mapping):
+    ''' ImageStructure of FolderPath (or of an existing Index from
+ImageStructureIndexFolder()) where images are decoded on first access and held by
+ImageCache, an LRUImageCache (default budget 1 GB) shared with sub-folders.
+Values assigned to image keys (e.g. by ImageStructureApplyFunc()) replace the image '''
+    def __init__(self, FolderPath=None, ImageCache=None, Index=None):
+        if Index is None:
+            if FolderPath is None: raise ValueError('Invalid Argument: FolderPath or Index required')
+            Index = ImageStructureIndexFolder(FolderPath)
+        self.index = Index
+        self.imageCache = ImageCache if ImageCache is not None else LRUImageCache(2**30)
+        self._values = dict() # assigned values of image keys
+        self._subStructures = dict() # sub-folders keep their assigned values
+
+    def __getitem__(self, key):
+        value = self.index[key]
+        if isinstance(value, Mapping):
+            if key not in self._subStructures:
+                self._subStructures[key] = LazyImageStructure(ImageCache=self.imageCache, Index=value)
+            return self._subStructures[key]
+        if key in self._values:
+            return self._values[key]
+        return self.imageCache.get(key)
+
+    def __setitem__(self, key, value):
+        if self.isSubStructure(key):
+            raise ValueError('Invalid Argument: {} is a sub-folder'.format(key))
+        self._values[key] = value
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def viewitems(self):
+        return ItemsView(self)
+
+    def isSubStructure(self, key):
+        ''' Returns True if key is a sub-folder, without decoding any image '''
+        return isinstance(self.index[key], Mapping)
+
+    def fileInfo(self, key):
+        ''' Returns ImageFileInfo of image key without decoding it '''
+        return self.index[key]
+
+    def iterImageFiles(self):
+        ''' Yields (image path, ImageFileInfo) of all images in all sub-folders '''
+        for key, value in self.index.viewitems():
+            if isinstance(value, Mapping):
+                for imageFile in self[key].iterImageFiles():
+                    yield imageFile
+            else:
+                yield key, value
+
+    def flattened(self):
+        ''' Returns a flat LazyImageStructure of all images in all sub-folders sharing
+the ImageCache and the assigned values, without decoding any image '''
+        flatStructure = LazyImageStructure(ImageCache=self.imageCache, Index=dict(self.iterImageFiles()))
+        for key in self:
+            if self.isSubStructure(key):
+                flatStructure._values.update(self[key].flattened()._values)
+            elif key in self._values:
+                flatStructure._values[key] = self._values[key]
+        return flatStructure
+
+def _isSubStructure(ImageStructure, key):
+    ''' True if key of ImageStructure is a sub-folder, decoding no lazily loaded image '''
+    if isinstance(ImageStructure, LazyImageStructure):
+        return ImageStructure.isSubStructure(key)
+    return isinstance(ImageStructure[key], Mapping)
 
 def ImageStructureApplyFunc(ImageStructure, ImageProcessingFunc, UseKey=False):
     ''' Applies a function to each image in the ImageStructure inplace '''
-    for key,value in ImageStructure.viewitems(): # could just use keys
-        if type(ImageStructure[key]) is not dict:
-            input = key if UseKey else value
+    for key in list(ImageStructure):
+        if not _isSubStructure(ImageStructure, key):
+            input = key if UseKey else ImageStructure[key]
             newValue = ImageProcessingFunc(input)
             ImageStructure[key] = newValue
-            log.debug('Applied ImageProcessingFunc() to {} new value= {}.'.format(input, newValue))
+            if Instrumentation.isDebugEnabled(): # formatting whole images is costly
+                log.debug('Applied ImageProcessingFunc() to {} new value= {}.'.format(input, newValue))
         else:
             ImageStructureApplyFunc(ImageStructure[key], ImageProcessingFunc, UseKey)
     return ImageStructure
 
+def _iterStructureLeaves(ImageStructure):
+    ''' yields (dictionary, key) of every image in the ImageStructure '''
+    for key in ImageStructure:
+        if _isSubStructure(ImageStructure, key):
+            for leaf in _iterStructureLeaves(ImageStructure[key]):
+                yield leaf
+        else:
+            yield ImageStructure, key
+
+def _applyFuncSafely(args):
+    ImageProcessingFunc, input = args
+    try:
+        return True, ImageProcessingFunc(input)
+    except Exception as error:
+        return False, error
+
+def ImageStructureApplyFuncConcurrently(ImageStructure, ImageProcessingFunc, UseKey=False,
+                                        Workers=4, UseProcesses=False, MaxInFlight=None):
+    ''' Applies a function to each image in the ImageStructure inplace like
+ImageStructureApplyFunc() using a pool of Workers threads (or processes if UseProcesses,
+then ImageProcessingFunc must be picklable) with at most MaxInFlight (default
+2 X Workers) images submitted at a time. A failing image keeps its value and does
+not stop the others. Returns (ImageStructure, failures dict of key: exception) '''
+    MaxInFlight = MaxInFlight or 2 * Workers
+    failures = dict()
+    pending = deque()
+
+    def collect(imageStructure, key, asyncResult):
+        try:
+            succeeded, newValue = asyncResult.get()
+        except Exception as error: # e.g. result could not be pickled
+            succeeded, newValue = False, error
+        if succeeded:
+            imageStructure[key] = newValue
+        else:
+            failures[key] = newValue
+            log.warning('ImageProcessingFunc() failed for {}: {}'.format(key, newValue))
+
+    pool = multiprocessing.Pool(Workers) if UseProcesses else ThreadPool(Workers)
+    try:
+        for imageStructure, key in list(_iterStructureLeaves(ImageStructure)):
+            input = key if UseKey else imageStructure[key]
+            pending.append((imageStructure, key,
+                            pool.apply_async(_applyFuncSafely, ((ImageProcessingFunc, input),))))
+            if len(pending) >= MaxInFlight:
+                collect(*pending.popleft())
+        while pending:
+            collect(*pending.popleft())
+    finally:
+        pool.terminate()
+        pool.join()
+    return ImageStructure, failures
+
 def getFlattenedStructure(ImageStructure, flatStructure=None):
     ''' creates or updates new flat structure of images as key/value pairs 
-where key is image path and value is image array '''
-    if flatStructure is None: flatStructure = dict()
+where key is image path and value is image array. A LazyImageStructure is
+flattened into a LazyImageStructure without decoding its images '''
+    if flatStructure is None:
+        if isinstance(ImageStructure, LazyImageStructure):
+            return ImageStructure.flattened()
+        flatStructure = dict()
     elif type(flatStructure) is not dict:
         raise ValueError('Invalid Argument: flatStructure. Should be dict')
 
-    for key,value in ImageStructure.viewitems(): # could just use keys
-        if type(ImageStructure[key]) is not dict:
+    for key in ImageStructure:
+        if not _isSubStructure(ImageStructure, key):
             flatStructure[key] = ImageStructure[key]
         else:
             getFlattenedStructure(ImageStructure[key], flatStructure)
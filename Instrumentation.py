@@ -0,0 +1,69 @@
+import logging as log
+import threading
+import timeit
+
+from collections import namedtuple
+from contextlib import contextmanager
+
+# Stage timers and counters of the splitting / training / detection pipeline, shared
+# by all threads of a process. Work done in worker processes is counted there only.
+
+StageTiming = namedtuple('StageTiming', 'calls, seconds')
+
+_statsLock = threading.Lock()
+_stageTimings = dict()
+_counters = dict()
+_profilingHook = [None]
+
+def isDebugEnabled():
+    ''' True if log.debug() output is enabled, to skip building debug messages otherwise '''
+    return log.getLogger().isEnabledFor(log.DEBUG)
+
+def addCount(Name, Count=1):
+    ''' Adds Count to counter Name, e.g. images, tiles, selectedTiles, bytesDecoded '''
+    with _statsLock:
+        _counters[Name] = _counters.get(Name, 0) + Count
+
+def addStageTime(Stage, Seconds):
+    ''' Adds one call taking Seconds to timer of Stage and passes it to the profiling hook '''
+    with _statsLock:
+        calls, seconds = _stageTimings.get(Stage, (0, 0.0))
+        _stageTimings[Stage] = StageTiming(calls + 1, seconds + Seconds)
+        hook = _profilingHook[0]
+    if hook is not None:
+        hook(Stage, Seconds)
+
+@contextmanager
+def stageTimer(Stage):
+    ''' Times the enclosed code as one call of Stage '''
+    startTime = timeit.default_timer()
+    try:
+        yield
+    finally:
+        addStageTime(Stage, timeit.default_timer() - startTime)
+
+def setProfilingHook(Hook):
+    ''' Hook(stage, seconds) is called after every timed stage (from the thread running
+it), None removes the hook. Returns the previous hook '''
+    with _statsLock:
+        previousHook, _profilingHook[0] = _profilingHook[0], Hook
+    return previousHook
+
+def getStats():
+    ''' Returns dict with 'stages' (stage: StageTiming) and 'counters' (name: count) '''
+    with _statsLock:
+        return dict(stages=dict(_stageTimings), counters=dict(_counters))
+
+def resetStats():
+    ''' Clears all stage timers and counters '''
+    with _statsLock:
+        _stageTimings.clear()
+        _counters.clear()
+
+def formatStats(Stats=None):
+    ''' Returns readable report of Stats (default current stats), slowest stage first '''
+    Stats = Stats or getStats()
+    lines = ['{:<16} {:>8} calls {:>10.3f} s'.format(stage, timing.calls, timing.seconds)
+             for stage, timing in sorted(Stats['stages'].items(), key=lambda item: -item[1].seconds)]
+    lines += ['{:<16} {:>8}'.format(name, count) for name, count in sorted(Stats['counters'].items())]
+    return '\n'.join(lines)
@@ -2,6 +2,9 @@ import cv2
 import numpy as np
 import logging as log
 
+import ImageSplitting as Imaging
+import Instrumentation
+
 def IsImageBlockSatisfyingSelectionPercentage(
         Image, SelectionMask, InvertMask=False, SelectionPercentage = 10):
     ''' Returns True if SelectionMask (a binary mask) is True for more than 10% 
@@ -19,14 +22,39 @@ def IsImageBlockSatisfyingSelectionPercentage(
 
 def getBinaryMaskFromColorCodedImage(maskImage, hexColor='#00ff00'):
     ''' gets binary Mask from an rgb image using hexColor (default green) '''
-    if len(maskImage.shape) != 3: raise ValueError('Expected rgb numpy array')
-    imgRows,imgCols,imgChannels = maskImage.shape;
-    rgbPixelsDiff = (maskImage == np.asarray(hex_to_rgb(hexColor)))
-    rgbPixelsDiff.shape = (imgRows*imgCols, imgChannels) # flatten for easy iteration & query
-    diffListTrueAll = [True if ((rgbDiff == True).all()) else False for rgbDiff in rgbPixelsDiff]
-    maskTrueAll = np.asarray(diffListTrueAll)
-    maskTrueAll.shape = imgRows, imgCols # binary mask is like a gray image with binary values
-    return maskTrueAll
+    return getLabelMapFromColorCodedImage(maskImage, [hexColor]) == 0
+
+def packColorKeys(maskImage):
+    ''' packs 3 colour channels of every pixel into a single uint32 key '''
+    if len(maskImage.shape) != 3 or maskImage.shape[2] != 3:
+        raise ValueError('Expected rgb numpy array')
+    channels = maskImage.astype(np.uint32, copy=False)
+    keys = channels[..., 0] << 16
+    keys |= channels[..., 1] << 8
+    keys |= channels[..., 2]
+    return keys
+
+def getLabelMapFromColorCodedImage(maskImage, palette, returnMasks=False):
+    ''' decodes colour coded maskImage using palette, a sequence of hex colours
+    e.g. ['#00ff00', '#0000ff'] for grass, water. Returns label map (int32) holding
+    index of the matching palette colour for each pixel and -1 where none matches.
+    With returnMasks=True also returns boolean masks (colours X rows X cols) where
+    masks[i] is the binary mask of palette[i] '''
+    if len(palette) == 0: raise ValueError('Invalid Argument: palette is empty')
+    # palette colours are compared in the channel order of maskImage
+    paletteKeys = packColorKeys(np.array([hex_to_rgb(hexColor) for hexColor in palette],
+                                         dtype=np.uint32)[np.newaxis])[0]
+    order = np.argsort(paletteKeys, kind='mergesort')
+    sortedKeys = paletteKeys[order]
+    pixelKeys = packColorKeys(maskImage)
+    positions = np.searchsorted(sortedKeys, pixelKeys)
+    np.minimum(positions, len(sortedKeys) - 1, out=positions)
+    labelMap = order[positions].astype(np.int32)
+    labelMap[sortedKeys[positions] != pixelKeys] = -1
+    if not returnMasks:
+        return labelMap
+    masks = labelMap[np.newaxis] == np.arange(len(palette))[:, np.newaxis, np.newaxis]
+    return labelMap, masks
 
 def hex_to_rgb(value):
     ''' convert color in hexadecimal triplet back to its rgb triplet '''
@@ -40,15 +68,83 @@ def rgb_to_hex(rgb):
 
 def iterateImageBlocksBasedOnMask(imageBlocksIterator, maskBlocksIterator, selectionPercentage=10):
     ''' iterate image blocks selected by mask blocks satisfying selection percentage '''
+    debugEnabled = Instrumentation.isDebugEnabled()
     for iBlock, mBlock in zip(imageBlocksIterator, maskBlocksIterator):
         if IsImageBlockSatisfyingSelectionPercentage(iBlock, mBlock, False, selectionPercentage):
             IsSelected = True
         else: IsSelected = False
         
-        log.debug('Image Block ({}); maskBlock ({}); Selected: {}'.
-                    format(iBlock.shape, mBlock.shape, IsSelected))
+        if debugEnabled:
+            log.debug('Image Block ({}); maskBlock ({}); Selected: {}'.
+                        format(iBlock.shape, mBlock.shape, IsSelected))
 
         if IsSelected:
+            Instrumentation.addCount('selectedTiles')
             yield iBlock
 
+def getIntegralImage(SelectionMask):
+    ''' returns summed-area table (rows+1 X cols+1) of a binary mask, or of each mask
+    in a stack of masks (masks X rows X cols), such that integral[r, c] holds number
+    of nonzero pixels in SelectionMask[:r, :c] (e.g. of a 0/255 mask) '''
+    integral = np.zeros(SelectionMask.shape[:-2] +
+                        (SelectionMask.shape[-2] + 1, SelectionMask.shape[-1] + 1), dtype=np.int64)
+    np.cumsum(SelectionMask != 0, axis=-2, dtype=np.int64, out=integral[..., 1:, 1:])
+    np.cumsum(integral[..., 1:, 1:], axis=-1, out=integral[..., 1:, 1:])
+    return integral
+
+def getBlockCoverage(integral, rowOrigins, colOrigins, BlockHeight, BlockWidth):
+    ''' Returns selected pixel count ([masks X] rows X cols) and pixel area (rows X cols)
+    of the blocks at rowOrigins X colOrigins, clipped to the image for ragged blocks,
+    using integral, the summed-area table from getIntegralImage() '''
+    rows, cols = integral.shape[-2] - 1, integral.shape[-1] - 1
+    r0, c0 = np.asarray(rowOrigins)[:, np.newaxis], np.asarray(colOrigins)[np.newaxis, :]
+    r1, c1 = np.minimum(r0 + BlockHeight, rows), np.minimum(c0 + BlockWidth, cols)
+    selectedPixels = (integral[..., r1, c1] - integral[..., r0, c1]
+                      - integral[..., r1, c0] + integral[..., r0, c0])
+    return selectedPixels, (r1 - r0) * (c1 - c0)
 
+def getBlockSelectionFromCoverage(selectedPixels, totalPixels, SelectionPercentage=10, InvertMask=False):
+    ''' Returns boolean selection of blocks from their coverage given by getBlockCoverage(),
+    applying SelectionPercentage and InvertMask (scalar or one per mask) like
+    IsImageBlockSatisfyingSelectionPercentage() to all blocks at once '''
+    perMask = (Ellipsis,) + (np.newaxis,) * 2 # broadcast per mask values over blocks
+    InvertMask = np.asarray(InvertMask, dtype=bool)[perMask]
+    SelectionPercentage = np.asarray(SelectionPercentage)[perMask]
+    allowedPixels = np.where(InvertMask, totalPixels - selectedPixels, selectedPixels)
+    # round half away from zero as int(round()) does for these non negative values
+    allowedPixelsPercent = np.floor(allowedPixels * 100.0 / totalPixels + 0.5)
+    return allowedPixelsPercent >= SelectionPercentage
+
+def getBlockSelectionFromMask(SelectionMask, SplitBlock, SelectionPercentage=10,
+                              InvertMask=False, EdgeMode='drop'):
+    ''' Selects all blocks of an image split by SplitBlock at once using one
+    summed-area table of SelectionMask, a binary mask or stack of class masks
+    (classes X rows X cols) e.g. from getLabelMapFromColorCodedImage().
+    SelectionPercentage and InvertMask apply as in IsImageBlockSatisfyingSelectionPercentage()
+    and may be given per class. Ragged blocks (EdgeMode 'pad') are judged on their
+    pixels inside the image. Returns boolean selection ([classes X] rows X cols)
+    and block origins (rows X cols X 2) matching SplitImageInStridedBlocks() '''
+    BlockWidth, BlockHeight, OverlapHorizontal, OverlapVertical = Imaging._validateSplittingBlock(SplitBlock)
+    rowOrigins = Imaging.getBlockOrigins(SelectionMask.shape[-2], BlockHeight, OverlapVertical, EdgeMode)
+    colOrigins = Imaging.getBlockOrigins(SelectionMask.shape[-1], BlockWidth, OverlapHorizontal, EdgeMode)
+    origins = Imaging.getOriginsGrid(rowOrigins, colOrigins)
+    selectedPixels, totalPixels = getBlockCoverage(getIntegralImage(SelectionMask),
+                                                    rowOrigins, colOrigins, BlockHeight, BlockWidth)
+    selected = getBlockSelectionFromCoverage(selectedPixels, totalPixels, SelectionPercentage, InvertMask)
+    selectedCount = np.count_nonzero(selected)
+    Instrumentation.addCount('selectedTiles', selectedCount)
+    log.debug('Block selection: {} of {} blocks'.format(selectedCount, selected.size))
+    return selected, origins
+
+def iterateImageBlocksSelectedByMask(Image, SelectionMask, SplitBlock, SelectionPercentage=10,
+                                     InvertMask=False, EdgeMode='drop'):
+    ''' iterate image blocks selected by mask like iterateImageBlocksBasedOnMask() but
+    judging all blocks at once with getBlockSelectionFromMask() '''
+    if SelectionMask.shape != Image.shape[:2]:
+        raise ValueError("Invalid Argument: SelectionMask shape/size {} should be same as Image {}"
+                         .format(SelectionMask.shape, Image.shape[:2]))
+    imageBlocks, origins = Imaging.SplitImageInStridedBlocks(Image, SplitBlock, EdgeMode)
+    selected, origins = getBlockSelectionFromMask(SelectionMask, SplitBlock, SelectionPercentage,
+                                                  InvertMask, EdgeMode)
+    for row, col in zip(*np.nonzero(selected)):
+        yield imageBlocks[row, col]
@@ -0,0 +1,92 @@
+import numpy as np
+import logging as log
+import os
+import tempfile
+import xml.etree.ElementTree as ElementTree
+
+from collections import namedtuple
+
+# Linear SVMs trained by Training.TrainNSaveSVM() reduce to one weight vector and
+# bias per pair of classes, scored here with plain NumPy instead of cv2.SVM.
+
+class LinearSVMModel(namedtuple('LinearSVMModel', 'weights, biases, classLabels, classPairs')):
+    ''' weights (pairs X features) and biases (pairs) of the decision function of
+each pair of classes (classPairs, indices into classLabels). Like cv2.SVM, a positive
+margin of pair (i, j) votes for class i, otherwise for class j '''
+    def predict_all(self, samples):
+        ''' same as cv2.SVM.predict_all(), so the model can be used by Training.SVMDetector '''
+        predictedLabels, margins = ScoreLinearSVM(self, samples)
+        return predictedLabels.reshape(-1, 1)
+
+def _numbers(element, dtype=np.float64):
+    return np.array(''.join(element.itertext()).split(), dtype=dtype)
+
+def ReadLinearSVM(SvmDataFileName):
+    ''' Returns LinearSVMModel read from a linear C_SVC model saved (as xml) by cv2.SVM.save() '''
+    storage = ElementTree.parse(SvmDataFileName).getroot()
+    svmElement = next((element for element in storage
+                       if element.get('type_id') == 'opencv-ml-svm'), None)
+    if svmElement is None:
+        raise ValueError('Invalid SVM file: no opencv-ml-svm found in "{}"'.format(SvmDataFileName))
+    svmType = svmElement.findtext('svm_type').strip()
+    kernelType = svmElement.find('kernel').findtext('type').strip()
+    if svmType not in ('C_SVC', 'NU_SVC') or kernelType != 'LINEAR':
+        raise ValueError('Unsupported SVM: {} with {} kernel, expected linear classifier'
+                         .format(svmType, kernelType))
+    if svmElement.find('var_idx') is not None:
+        raise ValueError('Unsupported SVM: trained on a subset of variables (var_idx)')
+    classLabels = _numbers(svmElement.find('class_labels').find('data'))
+    supportVectors = np.array([_numbers(vector) for vector in svmElement.find('support_vectors')])
+    classPairs = [(i, j) for i in range(len(classLabels)) for j in range(i + 1, len(classLabels))]
+    decisionFunctions = list(svmElement.find('decision_functions'))
+    if len(decisionFunctions) != len(classPairs):
+        raise ValueError('Invalid SVM file: {} decision functions for {} classes'
+                         .format(len(decisionFunctions), len(classLabels)))
+    weights = np.empty((len(classPairs), supportVectors.shape[1]), dtype=np.float32)
+    biases = np.empty(len(classPairs), dtype=np.float32)
+    for pair, decisionFunction in enumerate(decisionFunctions):
+        alpha = _numbers(decisionFunction.find('alpha'))
+        indexElement = decisionFunction.find('index')
+        index = (_numbers(indexElement, np.intp) if indexElement is not None
+                 else np.arange(len(alpha)))
+        # linear kernel: sum of alpha[k] * <sv[k], x> - rho == <w, x> + b
+        weights[pair] = alpha.dot(supportVectors[index])
+        biases[pair] = -float(decisionFunction.findtext('rho'))
+    log.debug('read linear SVM: classes {}, features {}'.format(classLabels, weights.shape[1]))
+    return LinearSVMModel(weights, biases, classLabels.astype(np.float32), np.array(classPairs, dtype=np.intp))
+
+def ExportLinearSVM(Svm, NpzFileName):
+    ''' Exports linear SVM, a trained cv2.SVM or its saved (.dat) file name, to a compact
+.npz file. Returns the exported LinearSVMModel '''
+    if not hasattr(Svm, 'save'):
+        model = ReadLinearSVM(Svm)
+    else:
+        fileHandle, svmFileName = tempfile.mkstemp(suffix='.xml')
+        os.close(fileHandle)
+        try:
+            Svm.save(svmFileName)
+            model = ReadLinearSVM(svmFileName)
+        finally:
+            os.remove(svmFileName)
+    np.savez_compressed(NpzFileName, **model._asdict())
+    return model
+
+def LoadLinearSVM(NpzFileName):
+    ''' Loads LinearSVMModel exported by ExportLinearSVM() '''
+    with np.load(NpzFileName) as npzFile:
+        return LinearSVMModel(*[npzFile[field] for field in LinearSVMModel._fields])
+
+def ScoreLinearSVM(Model, Samples):
+    ''' Classifies all Samples (a matrix of flattened blocks) with one matrix product.
+Returns predicted labels and signed margins (samples X class pairs), which for two
+classes are positive for Model.classLabels[0] and negative for Model.classLabels[1] '''
+    Samples = np.asarray(Samples, dtype=Model.weights.dtype)
+    margins = Samples.dot(Model.weights.T)
+    margins += Model.biases
+    winners = np.where(margins > 0, Model.classPairs[:, 0], Model.classPairs[:, 1])
+    if len(Model.classPairs) == 1:
+        return Model.classLabels[winners[:, 0]], margins
+    votes = np.zeros((len(Samples), len(Model.classLabels)), dtype=np.intp)
+    for pair in range(len(Model.classPairs)):
+        votes[np.arange(len(Samples)), winners[:, pair]] += 1
+    return Model.classLabels[votes.argmax(axis=1)], margins
@@ -0,0 +1,118 @@
+import numpy as np
+import logging as log
+import itertools
+import os
+import shutil
+import tempfile
+import timeit
+
+import Training
+
+# k-fold cross validation of SVM parameter combinations on a pool of worker processes.
+# The training matrix is saved once with np.save and memory mapped by every worker, so
+# it is not pickled to the workers. Each worker still copies the training part of its
+# fold, (Folds-1)/Folds of the matrix, into memory to train on it, so peak memory grows
+# with Workers by that much.
+
+def getParameterCombinations(ParamGrid):
+    ''' Returns list of parameter dicts, one per combination of the values listed in
+    ParamGrid (dict of parameter name: list of values) '''
+    names = sorted(ParamGrid)
+    return [dict(zip(names, values)) for values in itertools.product(*[ParamGrid[name] for name in names])]
+
+def getStratifiedFolds(LabelData, Folds=5, Seed=None):
+    ''' Returns fold number (0 to Folds-1) of every sample, dealing the samples of each
+    class in random (Seed) order over the folds so each fold keeps the class balance '''
+    LabelData = np.asarray(LabelData).ravel()
+    if Folds < 2 or Folds > len(LabelData):
+        raise ValueError('Invalid Argument: Folds should be from 2 to the number of samples')
+    randomState = np.random.RandomState(Seed)
+    folds = np.empty(len(LabelData), dtype=np.intp)
+    start = 0
+    for label in np.unique(LabelData):
+        samples = randomState.permutation(np.flatnonzero(LabelData == label))
+        folds[samples] = (start + np.arange(len(samples))) % Folds
+        start += len(samples) # continue dealing where the previous class ended
+    return folds
+
+def trainSvm(TrainingData, LabelData, SvmParams):
+    ''' default TrainFunc of crossValidateSVM(), trains cv2.SVM with SvmParams '''
+    return Training.TrainNSaveSVM(np.ascontiguousarray(TrainingData, dtype=np.float32),
+                                  np.float32(LabelData), None, SvmParams)
+
+def _crossValidationTask(args):
+    dataFolder, combination, params, fold, TrainFunc = args
+    trainingData = np.load(os.path.join(dataFolder, 'data.npy'), mmap_mode='r')
+    labelData = np.load(os.path.join(dataFolder, 'labels.npy'))
+    folds = np.load(os.path.join(dataFolder, 'folds.npy'))
+    trainRows, testRows = np.flatnonzero(folds != fold), np.flatnonzero(folds == fold)
+    startTime = timeit.default_timer()
+    try: # e.g. cv2.error for a training part of a single class, fails this combination only
+        model = TrainFunc(trainingData[trainRows], labelData[trainRows], params)
+        trainSeconds = timeit.default_timer() - startTime
+        predicted = np.asarray(model.predict_all(np.ascontiguousarray(trainingData[testRows], dtype=np.float32)))
+    except Exception as error:
+        failure = '{}: {}'.format(type(error).__name__, error)
+        return combination, fold, np.nan, timeit.default_timer() - startTime, failure
+    accuracy = np.mean(predicted.ravel() == labelData[testRows])
+    return combination, fold, accuracy, trainSeconds, None
+
+def crossValidateSVM(TrainingData, LabelData, ParamGrid, Folds=5, Seed=None, Workers=None,
+                     BestSvmFileName=None, TrainFunc=trainSvm):
+    ''' Runs Folds-fold cross validation of every parameter combination of ParamGrid
+    (dict of SvmParams name: list of values, e.g. dict(C=[0.1, 1, 10],
+    kernel_type=[cv2.SVM_LINEAR, cv2.SVM_RBF])) on Workers processes, by default
+    (None) serially in this process. Each worker holds the training part of its fold in
+    memory, so choose Workers by the memory available. Returns results table, a list
+    (one row per combination, best first) of dicts with params, meanAccuracy,
+    stdAccuracy, foldAccuracies, trainSeconds (summed over folds) and error, the first
+    error raised training or predicting a fold (else None). Failed combinations have NaN
+    accuracies and come last. With BestSvmFileName the best combination is retrained on
+    all data and saved. TrainFunc(trainingData, labelData, params) must return a model
+    with predict_all() and be picklable (a module level function) '''
+    combinations = getParameterCombinations(ParamGrid)
+    LabelData = np.asarray(LabelData, dtype=np.float64).ravel()
+    dataFolder = tempfile.mkdtemp(prefix='crossvalidation')
+    try:
+        np.save(os.path.join(dataFolder, 'data.npy'), TrainingData)
+        np.save(os.path.join(dataFolder, 'labels.npy'), LabelData)
+        np.save(os.path.join(dataFolder, 'folds.npy'), getStratifiedFolds(LabelData, Folds, Seed))
+        tasks = [(dataFolder, combination, params, fold, TrainFunc)
+                 for combination, params in enumerate(combinations) for fold in range(Folds)]
+        accuracies = np.zeros((len(combinations), Folds))
+        trainSeconds = np.zeros(len(combinations))
+        errors = [None] * len(combinations)
+        for combination, fold, accuracy, seconds, error in Training.imapOrdered(_crossValidationTask, tasks,
+                                                                                 Workers, UseProcesses=True):
+            accuracies[combination, fold] = accuracy
+            trainSeconds[combination] += seconds
+            if error is not None:
+                log.warning('cross validation: {} fold {} failed: {}'.format(combinations[combination],
+                                                                             fold, error))
+                errors[combination] = errors[combination] or 'fold {}: {}'.format(fold, error)
+            log.debug('cross validation: {} fold {}: accuracy {:.4f}'.format(combinations[combination],
+                                                                             fold, accuracy))
+    finally:
+        shutil.rmtree(dataFolder)
+    results = [dict(params=params, meanAccuracy=accuracies[combination].mean(),
+                    stdAccuracy=accuracies[combination].std(),
+                    foldAccuracies=list(accuracies[combination]), trainSeconds=trainSeconds[combination],
+                    error=errors[combination])
+               for combination, params in enumerate(combinations)]
+    # stable, ties keep grid order and failed (NaN) combinations come last
+    results.sort(key=lambda result: (result['error'] is not None, -result['meanAccuracy']))
+    log.debug('best parameters {} with accuracy {:.4f}'.format(results[0]['params'], results[0]['meanAccuracy']))
+    if BestSvmFileName:
+        if results[0]['error'] is not None:
+            raise ValueError('Invalid Argument: no parameter combination could be trained, best model not saved')
+        TrainFunc(TrainingData, LabelData, results[0]['params']).save(BestSvmFileName)
+    return results
+
+def formatResultsTable(Results):
+    ''' Returns readable table of crossValidateSVM() results '''
+    lines = ['{:>9} {:>9} {:>9}  params'.format('accuracy', 'std', 'seconds')]
+    lines += ['{:9.4f} {:9.4f} {:9.2f}  {}{}'.format(result['meanAccuracy'], result['stdAccuracy'],
+                                                     result['trainSeconds'], result['params'],
+                                                     '  failed: ' + result['error'] if result.get('error') else '')
+              for result in Results]
+    return '\n'.join(lines)
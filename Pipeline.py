@@ -0,0 +1,171 @@
+import logging as log
+import sys
+import threading
+import timeit
+
+from collections import namedtuple
+try:
+    import queue as Queue
+except ImportError: # python 2
+    import Queue
+
+# Pipelined executor running each stage (e.g. read bytes -> decode -> tile -> features)
+# on its own threads, connected by bounded queues, so reading the next images overlaps
+# decoding and computing the current ones. Full queues block the stage before them
+# (backpressure), bounding the items in flight. Threads suit stages releasing the GIL
+# (file I/O, cv2, most numpy); use worker processes inside a stage for pure python work.
+
+PipelineStage = namedtuple('PipelineStage', 'name, func, workers')
+
+# _reraise(excInfo) raises the exception of sys.exc_info() excInfo with its original traceback
+if sys.version_info[0] < 3:
+    exec('def _reraise(excInfo):\n    raise excInfo[0], excInfo[1], excInfo[2]')
+else:
+    def _reraise(excInfo):
+        raise excInfo[1].with_traceback(excInfo[2])
+
+class _Failure(object):
+    ''' exception raised by a stage for an item, passed on to be raised by run() '''
+    def __init__(self, excInfo):
+        self.excInfo = excInfo
+
+_endOfItems = object()
+
+class Pipeline(object):
+    ''' Runs items through Stages, a list of PipelineStage(name, func, workers) where
+    func(item) returns the item passed to the next stage. Each stage reads from a queue
+    of at most QueueSize items, and results waiting for earlier items to be reordered
+    are bounded likewise '''
+    def __init__(self, Stages, QueueSize=8):
+        if not Stages: raise ValueError('Invalid Argument: Stages should not be empty')
+        if QueueSize < 1: raise ValueError('Invalid Argument: QueueSize should be positive')
+        self.stages = [PipelineStage(*stage) for stage in Stages]
+        for stage in self.stages:
+            if stage.workers < 1:
+                raise ValueError('Invalid Argument: stage "{}" workers should be positive'.format(stage.name))
+        self.queueSize = QueueSize
+        self._statsLock = threading.Lock()
+        self._resetStats()
+
+    def _resetStats(self):
+        with self._statsLock:
+            self._stats = [dict(items=0, busySeconds=0.0, queued=0, maxQueued=0, queueSamples=0)
+                           for stage in self.stages]
+
+    def stats(self):
+        ''' Returns per stage dicts (in stage order) of the current or last run: name,
+        workers, items processed, busySeconds (summed over workers), and occupancy of the
+        stage's input queue seen at every put: meanQueued, maxQueued and queueSize (a
+        full queue blocked the stage before, a mostly empty one starves its stage) '''
+        with self._statsLock:
+            return [dict(name=stage.name, workers=stage.workers, items=stats['items'],
+                         busySeconds=stats['busySeconds'], maxQueued=stats['maxQueued'],
+                         meanQueued=stats['queued'] / float(max(stats['queueSamples'], 1)),
+                         queueSize=self.queueSize)
+                    for stage, stats in zip(self.stages, self._stats)]
+
+    def _put(self, stageIndex, queue, entry, stopEvent):
+        ''' blocking put giving up when the run is stopped, samples queue occupancy '''
+        if stageIndex < len(self.stages) and entry is not _endOfItems:
+            queued = queue.qsize()
+            with self._statsLock:
+                stats = self._stats[stageIndex]
+                stats['queued'] += queued
+                stats['queueSamples'] += 1
+                stats['maxQueued'] = max(stats['maxQueued'], queued)
+        while not stopEvent.is_set():
+            try:
+                queue.put(entry, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _get(self, queue, stopEvent):
+        while not stopEvent.is_set():
+            try:
+                return queue.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+        return _endOfItems
+
+    def _feed(self, Items, queues, inFlight, stopEvent):
+        fed = 0
+        try:
+            for item in Items:
+                # waits while too many items are held back in run() for reordering
+                if not self._put(len(self.stages), inFlight, None, stopEvent):
+                    return
+                if not self._put(0, queues[0], (fed, item), stopEvent):
+                    return
+                fed += 1
+        except Exception: # raised by run() after the items fed before
+            if self._put(len(self.stages), inFlight, None, stopEvent):
+                self._put(0, queues[0], (fed, _Failure(sys.exc_info())), stopEvent)
+        for worker in range(self.stages[0].workers):
+            self._put(0, queues[0], _endOfItems, stopEvent)
+
+    def _work(self, stageIndex, queues, finishedWorkers, stopEvent):
+        stage, stats = self.stages[stageIndex], self._stats[stageIndex]
+        inputQueue, outputQueue = queues[stageIndex], queues[stageIndex + 1]
+        while True:
+            entry = self._get(inputQueue, stopEvent)
+            if entry is _endOfItems:
+                break
+            index, item = entry
+            if not isinstance(item, _Failure):
+                startTime = timeit.default_timer()
+                try:
+                    item = stage.func(item)
+                except Exception:
+                    item = _Failure(sys.exc_info())
+                with self._statsLock:
+                    stats['items'] += 1
+                    stats['busySeconds'] += timeit.default_timer() - startTime
+            if not self._put(stageIndex + 1, outputQueue, (index, item), stopEvent):
+                return
+        with self._statsLock: # last worker of the stage ends the next stage
+            finishedWorkers[stageIndex] += 1
+            lastWorker = finishedWorkers[stageIndex] == stage.workers
+        if lastWorker:
+            nextWorkers = self.stages[stageIndex + 1].workers if stageIndex + 1 < len(self.stages) else 1
+            for worker in range(nextWorkers):
+                self._put(stageIndex + 1, outputQueue, _endOfItems, stopEvent)
+
+    def run(self, Items):
+        ''' Yields results of the last stage for Items in the order of Items. An exception
+        raised by a stage for an item is raised here when that item's turn comes.
+        Closing the generator early stops all stages '''
+        self._resetStats()
+        queues = [Queue.Queue(self.queueSize) for stage in self.stages] + [Queue.Queue(self.queueSize)]
+        # items fed but not yet yielded: queued, being processed or waiting in pending
+        inFlight = Queue.Queue(sum(stage.workers for stage in self.stages) + len(queues) * self.queueSize)
+        stopEvent = threading.Event()
+        finishedWorkers = [0] * len(self.stages)
+        threads = [threading.Thread(target=self._feed, args=(Items, queues, inFlight, stopEvent))]
+        for stageIndex, stage in enumerate(self.stages):
+            threads += [threading.Thread(target=self._work, args=(stageIndex, queues, finishedWorkers, stopEvent))
+                        for worker in range(stage.workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            pending, nextIndex = dict(), 0 # results arriving out of order wait here
+            while True:
+                entry = queues[-1].get()
+                if entry is _endOfItems:
+                    break
+                index, item = entry
+                pending[index] = item
+                while nextIndex in pending:
+                    item = pending.pop(nextIndex)
+                    nextIndex += 1
+                    inFlight.get_nowait()
+                    if isinstance(item, _Failure):
+                        _reraise(item.excInfo) # traceback points into the failed stage
+                    yield item
+        finally:
+            stopEvent.set()
+            for thread in threads:
+                thread.join()
+            log.debug('Pipeline stats: {}'.format(self.stats()))
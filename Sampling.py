@@ -0,0 +1,97 @@
+import numpy as np
+import logging as log
+
+# Class balanced sampling of tiles while they are produced: each class keeps a
+# reservoir of at most its cap of tiles, so tiles beyond the caps are never stored.
+
+def getClassCaps(ClassCounts, MaxSamplesPerClass=None, MaxTotalSamples=None, ClassRatios=None):
+    ''' Returns dict of maximum number of tiles kept per class (label), given number of
+    tiles of each class in ClassCounts. MaxSamplesPerClass caps each class (an int, or a
+    dict per class). MaxTotalSamples caps all classes together, sharing it in proportion
+    to ClassRatios (dict of class: weight, unlisted classes are dropped) or else to their
+    ClassCounts; the share a class can not use (having fewer tiles or a lower
+    MaxSamplesPerClass) goes to the other classes in the same proportions. ClassRatios
+    alone keep as many tiles as the classes allow in these proportions '''
+    ClassCounts = dict((str(label), count) for label, count in ClassCounts.items())
+    if isinstance(MaxSamplesPerClass, dict):
+        MaxSamplesPerClass = dict((str(label), cap) for label, cap in MaxSamplesPerClass.items())
+        limits = dict((label, min(count, MaxSamplesPerClass.get(label, count)))
+                      for label, count in ClassCounts.items())
+    elif MaxSamplesPerClass is not None:
+        limits = dict((label, min(count, MaxSamplesPerClass)) for label, count in ClassCounts.items())
+    else:
+        limits = ClassCounts
+    if ClassRatios is None and MaxTotalSamples is None:
+        return limits
+    if ClassRatios is None:
+        ClassRatios = dict((label, count) for label, count in ClassCounts.items() if count)
+    ClassRatios = dict((str(label), float(ratio)) for label, ratio in ClassRatios.items())
+    if not ClassRatios or min(ClassRatios.values()) <= 0:
+        raise ValueError('Invalid Argument: ClassRatios should have positive ratios')
+    caps = dict((label, 0) for label in ClassCounts)
+    if MaxTotalSamples is None:
+        ratioSum = sum(ClassRatios.values())
+        # largest total reachable in these proportions
+        total = min(ClassCounts.get(label, 0) / ratio for label, ratio in ClassRatios.items()) * ratioSum
+        caps.update((label, int(total * ClassRatios.get(label, 0) / ratioSum + 1e-9)) for label in ClassCounts)
+        return dict((label, min(cap, limits[label])) for label, cap in caps.items())
+    # share the budget by ratio, classes short of their share are filled and their
+    # leftover shared again among the classes still under their limit
+    budget = MaxTotalSamples
+    openLabels = set(label for label in ClassRatios if limits.get(label, 0) > 0)
+    while openLabels and budget > 0:
+        ratioSum = sum(ClassRatios[label] for label in openLabels)
+        shares = dict((label, budget * ClassRatios[label] / ratioSum) for label in openLabels)
+        filledLabels = [label for label in openLabels if shares[label] >= limits[label]]
+        if not filledLabels:
+            caps.update((label, int(share + 1e-9)) for label, share in shares.items())
+            break
+        for label in filledLabels:
+            caps[label] = limits[label]
+            budget -= limits[label]
+            openLabels.remove(label)
+    return caps
+
+class ReservoirSampler(object):
+    ''' Keeps a uniform random sample of at most Caps[label] tiles of each class out of
+    all tiles offered (reservoir sampling), reproducible with Seed. Samples are stored
+    in rows of one matrix of sum(Caps) rows, each class having its own range of rows '''
+    def __init__(self, Caps, Seed=None):
+        self.caps = dict((str(label), int(cap)) for label, cap in Caps.items())
+        self.offsets, offset = dict(), 0
+        for label in sorted(self.caps):
+            self.offsets[label] = offset
+            offset += self.caps[label]
+        self.rows = offset
+        self.seen = dict((label, 0) for label in self.caps)
+        self.sequence = np.zeros(self.rows, dtype=np.int64) # offer order of tile in each row
+        self.offered = 0
+        self._random = np.random.RandomState(Seed)
+
+    def offer(self, Label, Count):
+        ''' Offers next Count tiles of class Label. Returns numbers (0 to Count-1) of the
+        tiles to keep and the rows to store them in, replacing tiles kept before.
+        Tiles not returned are dropped '''
+        Label = str(Label)
+        cap, seen = self.caps.get(Label, 0), self.seen.get(Label, 0)
+        positions = seen + np.arange(Count, dtype=np.int64)
+        # tile at position p replaces a random one of the cap kept ones with probability cap / (p + 1)
+        randomSlots = (self._random.random_sample(Count) * (positions + 1)).astype(np.int64)
+        slots = np.where(positions < cap, positions, randomSlots)
+        tiles = np.flatnonzero(slots < cap)
+        slots = slots[tiles]
+        # of tiles replacing the same slot only the last one stays
+        uniqueSlots, lastIndices = np.unique(slots[::-1], return_index=True)
+        tiles = tiles[len(tiles) - 1 - lastIndices]
+        rows = self.offsets.get(Label, 0) + uniqueSlots
+        self.sequence[rows] = self.offered + tiles
+        self.seen[Label] = seen + Count
+        self.offered += Count
+        return tiles, rows
+
+    def getSampleRows(self):
+        ''' Returns rows holding kept tiles, in the order the tiles were offered '''
+        rows = np.concatenate([np.arange(self.offsets[label], self.offsets[label] + min(cap, self.seen[label]))
+                               for label, cap in sorted(self.caps.items())] or [np.zeros(0, dtype=np.int64)])
+        log.debug('Sampling: kept {} of {} tiles'.format(len(rows), self.offered))
+        return rows[np.argsort(self.sequence[rows], kind='mergesort')]
@@ -0,0 +1,125 @@
+import numpy as np
+import logging as log
+import os
+
+import ImageSplitting as Imaging
+import Instrumentation
+import Labelling
+
+# Images larger than memory are processed in horizontal strips (bands) of whole block
+# rows. Block origins are computed for the whole image and then cut into strips, so
+# consecutive strips overlap by the blocks' vertical overlap and give exactly the
+# blocks of SplitImageInStridedBlocks() on the whole image.
+
+class ArrayImageSource(object):
+    ''' Image source over an array, e.g. a np.memmap or .npy file loaded with mmap_mode,
+    reading only the pages of the rows asked for '''
+    def __init__(self, Array):
+        self.array = Array
+        self.shape = Array.shape
+        self.dtype = Array.dtype
+
+    def readRows(self, RowStart, RowStop):
+        ''' Returns rows RowStart to RowStop (excluded) of the image '''
+        return self.array[RowStart:RowStop]
+
+class RegionImageSource(object):
+    ''' Image source decoding rows on demand with ReadRows(rowStart, rowStop), e.g. a
+    windowed reader of a tiled TIFF, for images of Shape (rows X cols [X channels]) '''
+    def __init__(self, Shape, ReadRows, DataType=np.uint8):
+        self.shape = tuple(Shape)
+        self.dtype = np.dtype(DataType)
+        self._readRows = ReadRows
+
+    def readRows(self, RowStart, RowStop):
+        ''' Returns rows RowStart to RowStop (excluded) of the image '''
+        rows = np.asarray(self._readRows(RowStart, RowStop), dtype=self.dtype)
+        if rows.shape != (RowStop - RowStart,) + self.shape[1:]:
+            raise ValueError('Invalid image region: rows {} to {} read with shape {}, expected {}'
+                             .format(RowStart, RowStop, rows.shape, (RowStop - RowStart,) + self.shape[1:]))
+        Instrumentation.addCount('bytesDecoded', rows.nbytes)
+        return rows
+
+def openImageSource(Filename, Shape=None, DataType=np.uint8, Offset=0, DecodeWhole=False):
+    ''' Returns image source of Filename: .npy files are memory mapped, with Shape
+    (rows X cols [X channels]) the file holds raw pixels of DataType from byte Offset
+    and is memory mapped too. Other files can only be decoded whole by cv2.imread()
+    as OpenCV can not decode regions, which defeats strip processing, so they raise
+    ValueError unless DecodeWhole; use RegionImageSource with a region reader instead '''
+    if os.path.splitext(Filename)[1].lower() == '.npy':
+        return ArrayImageSource(np.load(Filename, mmap_mode='r'))
+    if Shape is not None:
+        return ArrayImageSource(np.memmap(Filename, dtype=DataType, mode='r', offset=Offset,
+                                          shape=tuple(Shape)))
+    if not DecodeWhole:
+        raise ValueError('Invalid Argument: "{}" can only be decoded whole, give Shape of raw pixels,'
+                         ' use a RegionImageSource or DecodeWhole'.format(Filename))
+    log.warning('openImageSource: decoding whole image {}'.format(Filename))
+    size = Imaging.getImageSizeFromHeader(Filename)
+    if size is None:
+        raise ValueError('Invalid Argument: size of "{}" not found in its header, give Shape'
+                         .format(Filename))
+    decoded = []
+    def readRows(RowStart, RowStop):
+        if not decoded:
+            decoded.append(Imaging.loadImageFromFile(Filename))
+        return decoded[0][RowStart:RowStop]
+    channels = 3 # cv2.imread() default loads BGR
+    return RegionImageSource(tuple(size) + (channels,), readRows)
+
+def _asImageSource(Image):
+    return Image if hasattr(Image, 'readRows') else ArrayImageSource(Image)
+
+def getStripRowOrigins(ImageHeight, SplitBlock, BlockRowsPerStrip=8, EdgeMode='drop'):
+    ''' Returns list of block row origins (whole image coordinates) of each strip,
+    BlockRowsPerStrip block rows per strip '''
+    if BlockRowsPerStrip < 1: raise ValueError('Invalid Argument: BlockRowsPerStrip should be positive')
+    BlockWidth, BlockHeight, OverlapHorizontal, OverlapVertical = Imaging._validateSplittingBlock(SplitBlock)
+    rowOrigins = Imaging.getBlockOrigins(ImageHeight, BlockHeight, OverlapVertical, EdgeMode)
+    return [rowOrigins[start:start + BlockRowsPerStrip]
+            for start in range(0, len(rowOrigins), BlockRowsPerStrip)]
+
+def iterateImageStrips(Image, SplitBlock, BlockRowsPerStrip=8, EdgeMode='drop'):
+    ''' Yields (strip, stripRowStart, rowOrigins) for the strips of Image (an image
+    source, memmap or array), rowOrigins being block row origins in whole image coordinates.
+    Only one strip of rows is read at a time '''
+    source = _asImageSource(Image)
+    BlockHeight = SplitBlock[1]
+    for rowOrigins in getStripRowOrigins(source.shape[0], SplitBlock, BlockRowsPerStrip, EdgeMode):
+        stripRowStart = rowOrigins[0]
+        stripRowStop = min(rowOrigins[-1] + BlockHeight, source.shape[0])
+        yield source.readRows(stripRowStart, stripRowStop), stripRowStart, rowOrigins
+
+def iterateStripBlocks(Image, SplitBlock, BlockRowsPerStrip=8, EdgeMode='drop', SelectionMask=None,
+                       SelectionPercentage=10, InvertMask=False, StripFunc=None):
+    ''' Yields (blocks, origins, selected) per strip of Image (an image source, memmap or
+    array): blocks (rows X cols X blockHeight X blockWidth [X channels]) and origins
+    (rows X cols X 2, whole image coordinates) as SplitImageInStridedBlocks() gives for
+    these block rows. With SelectionMask (binary mask or class masks, array or memmap)
+    selected holds the blocks' selection like Labelling.getBlockSelectionFromMask(),
+    else None. StripFunc(strip) is applied to each strip before splitting, e.g. to
+    convert it to grayscale '''
+    BlockWidth, BlockHeight, OverlapHorizontal, OverlapVertical = Imaging._validateSplittingBlock(SplitBlock)
+    source = _asImageSource(Image)
+    if SelectionMask is not None and SelectionMask.shape[-2:] != source.shape[:2]:
+        raise ValueError("Invalid Argument: SelectionMask shape/size {} should be same as Image {}"
+                         .format(SelectionMask.shape[-2:], source.shape[:2]))
+    colOrigins = Imaging.getBlockOrigins(source.shape[1], BlockWidth, OverlapHorizontal, EdgeMode)
+    for strip, stripRowStart, rowOrigins in iterateImageStrips(source, SplitBlock, BlockRowsPerStrip, EdgeMode):
+        stripRowOrigins = rowOrigins - stripRowStart
+        stripRows = len(strip)
+        if StripFunc is not None:
+            strip = StripFunc(strip)
+        blocks = Imaging.SplitImageAtOrigins(strip, stripRowOrigins, colOrigins, BlockHeight, BlockWidth)
+        Instrumentation.addCount('tiles', len(rowOrigins) * len(colOrigins))
+        selected = None
+        if SelectionMask is not None:
+            stripMask = np.asarray(SelectionMask[..., stripRowStart:stripRowStart + stripRows, :])
+            selectedPixels, totalPixels = Labelling.getBlockCoverage(Labelling.getIntegralImage(stripMask),
+                                                                     stripRowOrigins, colOrigins,
+                                                                     BlockHeight, BlockWidth)
+            selected = Labelling.getBlockSelectionFromCoverage(selectedPixels, totalPixels,
+                                                               SelectionPercentage, InvertMask)
+            Instrumentation.addCount('selectedTiles', np.count_nonzero(selected))
+        log.debug('strip at row {}: {} blocks'.format(stripRowStart, blocks.shape[:2]))
+        yield blocks, Imaging.getOriginsGrid(rowOrigins, colOrigins), selected
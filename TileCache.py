@@ -0,0 +1,88 @@
+import numpy as np
+import logging as log
+import os
+import hashlib
+
+# On-disk cache of image block matrices (one .npy file per image) keyed by image
+# file path, size, modification time, splitting block, data type and features.
+# Each image folder and block/feature setting has its own subfolder of the cache, so
+# evicting the stale entries of one build leaves those of other folders and settings.
+
+CacheFormat = 2 # block matrices keep the block grid (rows X cols X features)
+
+def getTileCacheKey(imgFileName, SplitBlock, DataType, FeatureName='raw'):
+    ''' Returns cache key of an image's block (feature) matrix, changing whenever the
+image file or the way its blocks and features are created changes '''
+    fileStat = os.stat(imgFileName)
+    keySource = repr((os.path.abspath(imgFileName), fileStat.st_size, fileStat.st_mtime,
+                      tuple(SplitBlock), np.dtype(DataType).str, FeatureName, CacheFormat))
+    return hashlib.sha1(keySource.encode('utf-8')).hexdigest()
+
+def getTileCacheFolder(CacheFolder, FolderPath, SplitBlock, DataType, FeatureName='raw'):
+    ''' Returns subfolder of CacheFolder holding block matrices of the images under
+FolderPath split and turned into features this way '''
+    scopeSource = repr((os.path.abspath(FolderPath), tuple(SplitBlock), np.dtype(DataType).str, FeatureName))
+    return os.path.join(CacheFolder, hashlib.sha1(scopeSource.encode('utf-8')).hexdigest())
+
+def _cacheFileName(CacheFolder, Key):
+    return os.path.join(CacheFolder, Key + '.npy')
+
+def loadCachedBlocks(CacheFolder, Key):
+    ''' Returns cached block matrix memory mapped read-only, None if not cached '''
+    cacheFileName = _cacheFileName(CacheFolder, Key)
+    if not os.path.isfile(cacheFileName):
+        return None
+    try:
+        return np.load(cacheFileName, mmap_mode='r')
+    except (IOError, ValueError) as error:
+        log.warning('TileCache: ignoring unreadable cache file {}: {}'.format(cacheFileName, error))
+        return None
+
+def getCachedBlockCount(CacheFolder, Key):
+    ''' Returns number of blocks of a cached block matrix reading only its .npy header,
+None if not cached. Lets a build size its matrices without opening every cache file '''
+    cacheFileName = _cacheFileName(CacheFolder, Key)
+    if not os.path.isfile(cacheFileName):
+        return None
+    try:
+        with open(cacheFileName, 'rb') as cacheFile:
+            version = np.lib.format.read_magic(cacheFile)
+            readHeader = (np.lib.format.read_array_header_1_0 if version == (1, 0)
+                          else np.lib.format.read_array_header_2_0)
+            shape, fortranOrder, dtype = readHeader(cacheFile)
+    except (IOError, ValueError) as error:
+        log.warning('TileCache: ignoring unreadable cache file {}: {}'.format(cacheFileName, error))
+        return None
+    return int(np.prod(shape[:-1])) if len(shape) else 0
+
+def storeCachedBlocks(CacheFolder, Key, BlockMatrix):
+    ''' Saves block matrix to the cache, replacing the cache file in one step so
+concurrent readers never see a partially written file '''
+    if not os.path.isdir(CacheFolder):
+        try:
+            os.makedirs(CacheFolder)
+        except OSError: # created meanwhile by another worker
+            if not os.path.isdir(CacheFolder): raise
+    cacheFileName = _cacheFileName(CacheFolder, Key)
+    tempFileName = '{}.{}.tmp'.format(cacheFileName, os.getpid())
+    with open(tempFileName, 'wb') as tempFile:
+        np.save(tempFile, BlockMatrix)
+    try:
+        os.rename(tempFileName, cacheFileName)
+    except OSError: # already cached by another worker
+        os.remove(tempFileName)
+
+def evictCachedBlocks(CacheFolder, KeepKeys):
+    ''' Removes cached block matrices of CacheFolder (a folder of getTileCacheFolder())
+whose key is not in KeepKeys, returns their count '''
+    if not os.path.isdir(CacheFolder):
+        return 0
+    KeepKeys = set(KeepKeys)
+    evicted = 0
+    for fileName in os.listdir(CacheFolder):
+        key, extension = os.path.splitext(fileName)
+        if extension == '.npy' and key not in KeepKeys:
+            os.remove(os.path.join(CacheFolder, fileName))
+            evicted += 1
+    log.debug('TileCache: evicted {} stale files from {}'.format(evicted, CacheFolder))
+    return evicted
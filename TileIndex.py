@@ -0,0 +1,125 @@
+import numpy as np
+import logging as log
+
+import ImageSplitting as Imaging
+
+# Index of tiles (image blocks), one record per row of a sample matrix, keeping where
+# each tile came from. Image paths are stored once in a path table and referenced by id.
+
+TileRecord = np.dtype([('imageId', np.int32), ('y', np.int32), ('x', np.int32),
+                       ('h', np.uint16), ('w', np.uint16), ('label', np.int32)])
+
+def _encodePath(Path):
+    ''' UTF-8 bytes of Path, byte string paths are taken as UTF-8 already '''
+    return Path if isinstance(Path, bytes) else Path.encode('utf-8')
+
+def _decodePath(EncodedPath):
+    ''' native str of UTF-8 EncodedPath (bytes on python 2) '''
+    return EncodedPath if str is bytes else EncodedPath.decode('utf-8')
+
+def makeTileRecords(ImageId, Origins, BlockHeight, BlockWidth, Label=-1):
+    ''' Returns TileRecord array of tiles of image ImageId at Origins ([rows X cols X] 2,
+    e.g. from Imaging.SplitImageInStridedBlocks()) in row major order '''
+    Origins = np.asarray(Origins).reshape(-1, 2)
+    tiles = np.zeros(len(Origins), dtype=TileRecord)
+    tiles['imageId'] = ImageId
+    tiles['y'], tiles['x'] = Origins[:, 0], Origins[:, 1]
+    tiles['h'], tiles['w'] = BlockHeight, BlockWidth
+    tiles['label'] = Label
+    return tiles
+
+class TileIndex(object):
+    ''' Structured array tiles (of TileRecord) and path table paths (imageId: path).
+    Tiles are added image by image in the order of the sample matrix rows '''
+    def __init__(self, Tiles=None, Paths=()):
+        self.paths = list(Paths)
+        self._pathIds = dict((path, imageId) for imageId, path in enumerate(self.paths))
+        self._tileChunks = [np.asarray(Tiles, dtype=TileRecord)] if Tiles is not None else []
+
+    @property
+    def tiles(self):
+        if len(self._tileChunks) != 1: # join tiles added since last access
+            self._tileChunks = [np.concatenate(self._tileChunks) if self._tileChunks
+                                else np.zeros(0, dtype=TileRecord)]
+        return self._tileChunks[0]
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self._tileChunks)
+
+    def internPath(self, ImagePath):
+        ''' Returns imageId of ImagePath, adding it to the path table if new '''
+        imageId = self._pathIds.get(ImagePath)
+        if imageId is None:
+            imageId = self._pathIds[ImagePath] = len(self.paths)
+            self.paths.append(ImagePath)
+        return imageId
+
+    def addImageTiles(self, ImagePath, Origins, BlockHeight, BlockWidth, Label=-1):
+        ''' Adds tiles of an image at Origins like makeTileRecords(), returns their records '''
+        tiles = makeTileRecords(self.internPath(ImagePath), Origins, BlockHeight, BlockWidth, Label)
+        self._tileChunks.append(tiles)
+        return tiles
+
+    def query(self, ImagePath=None, Label=None, Region=None):
+        ''' Returns row numbers (into the sample matrix) of tiles matching all given
+        conditions: from ImagePath, with Label, overlapping Region (top, left, bottom, right) '''
+        tiles = self.tiles
+        matches = np.ones(len(tiles), dtype=bool)
+        if ImagePath is not None:
+            matches &= tiles['imageId'] == self._pathIds.get(ImagePath, -1)
+        if Label is not None:
+            matches &= tiles['label'] == Label
+        if Region is not None:
+            top, left, bottom, right = Region
+            matches &= ((tiles['y'] < bottom) & (tiles['y'] + tiles['h'] > top) &
+                        (tiles['x'] < right) & (tiles['x'] + tiles['w'] > left))
+        return np.flatnonzero(matches)
+
+    def imagePaths(self, Rows=None):
+        ''' Returns list of image paths of tiles at Rows (default all tiles) '''
+        imageIds = self.tiles['imageId'] if Rows is None else self.tiles['imageId'][Rows]
+        return [self.paths[imageId] for imageId in imageIds]
+
+    def getImageBlocks(self, Samples, ImagePath):
+        ''' Returns blocks of ImagePath (nested rows X cols list) from Samples, the matrix
+        of raw (pixel) features indexed by this index, and their SplittingBlock, to be
+        joined by Imaging.CreateImageFromBlocks() '''
+        rows = self.query(ImagePath)
+        tiles = self.tiles[rows]
+        if len(tiles) == 0:
+            raise ValueError('Invalid Argument: no tiles of image "{}"'.format(ImagePath))
+        rowOrigins, colOrigins = np.unique(tiles['y']), np.unique(tiles['x'])
+        blockHeight, blockWidth = int(tiles['h'][0]), int(tiles['w'][0])
+        if (len(tiles) != len(rowOrigins) * len(colOrigins) or rowOrigins[0] or colOrigins[0] or
+                not Imaging._isEquallySpaced(rowOrigins) or not Imaging._isEquallySpaced(colOrigins)):
+            raise ValueError('Invalid Argument: tiles of image "{}" are not a grid starting at (0, 0)'
+                             .format(ImagePath))
+        rowStep = rowOrigins[1] - rowOrigins[0] if len(rowOrigins) > 1 else blockHeight
+        colStep = colOrigins[1] - colOrigins[0] if len(colOrigins) > 1 else blockWidth
+        splitBlock = Imaging.SplittingBlock(blockWidth, blockHeight, blockWidth - colStep, blockHeight - rowStep)
+        order = np.lexsort((tiles['x'], tiles['y']))
+        blocks = np.asarray(Samples)[rows[order]].reshape(len(rowOrigins), len(colOrigins),
+                                                          blockHeight, blockWidth)
+        return [list(blocksInRow) for blocksInRow in blocks], splitBlock
+
+    def reconstructImage(self, Samples, ImagePath, DataType=np.uint8):
+        ''' Returns the part of ImagePath covered by its tiles, joined from Samples
+        without loading or re-tiling the image '''
+        imageBlocks, splitBlock = self.getImageBlocks(Samples, ImagePath)
+        tiles = self.tiles[self.query(ImagePath)]
+        blankImage = np.zeros(((tiles['y'] + tiles['h']).max(), (tiles['x'] + tiles['w']).max()),
+                              dtype=DataType)
+        return Imaging.CreateImageFromBlocks(imageBlocks, blankImage, splitBlock)
+
+    def save(self, NpzFileName):
+        ''' Saves the index to a compressed .npz file, see LoadTileIndex() '''
+        # paths are saved as a fixed width array of UTF-8 bytes, loadable without pickle
+        np.savez_compressed(NpzFileName, tiles=self.tiles,
+                            paths=np.array([_encodePath(path) for path in self.paths], dtype=bytes))
+        log.debug('saved tile index of {} tiles, {} images'.format(len(self), len(self.paths)))
+
+def LoadTileIndex(NpzFileName):
+    ''' Loads TileIndex saved by TileIndex.save(), paths are native strings (UTF-8 bytes
+    on python 2) '''
+    with np.load(NpzFileName) as npzFile:
+        return TileIndex(npzFile['tiles'], [_decodePath(path) for path in npzFile['paths'].tolist()])
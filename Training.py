@@ -3,91 +3,555 @@ import numpy as np
 import logging as log
 import os
 import random
+import threading
+import timeit
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 import ImageSplitting as Imaging
+import Instrumentation
+import Pipeline
+import Sampling
+import StripProcessing
+import TileCache
+import TileIndex
+import Features
 
 
-def prepareTrainingDataFromImageStrucuture(FolderPath):
-    ''' Returns tuple containing trainingData matrix, label matrix, labels dict '''
+DefaultSplittingBlock = Imaging.SplittingBlock(blockWidth=70, blockHeight=70,
+                                               OverlapHorizontal=20, OverlapVertical=20)
+
+def getLabelFromImagePath(imgFileName):
+    ''' Returns (labelNo, labelText) of an image using its parent folder name '''
+    parentFolderName = os.path.split(os.path.dirname(imgFileName))[1]
+    # expecting folder name as label name in form labelNo_labelText
+    # e.g. for label names e.g. 0_NotGrass, 1_Grass, etc
+    labelNo, labelText = parentFolderName.split("_")
+    return labelNo, labelText
+
+def countImageBlocks(imgFileName, SplitBlock=DefaultSplittingBlock):
+    ''' Returns number of complete blocks in an image, reading only the image header
+when possible. Returns 0 for images which can not be read '''
+    imageSize = Imaging.getImageSizeFromHeader(imgFileName)
+    if imageSize is None:
+        img = cv2.imread(imgFileName, 0)
+        if img is None: return 0
+        imageSize = img.shape
+    BlockWidth, BlockHeight, OverlapHorizontal, OverlapVertical = SplitBlock
+    return (len(Imaging.getBlockOrigins(imageSize[0], BlockHeight, OverlapVertical)) *
+            len(Imaging.getBlockOrigins(imageSize[1], BlockWidth, OverlapHorizontal)))
+
+def readImageFile(imgFileName):
+    ''' Returns contents of an image file or None if it can not be read '''
+    try:
+        with Instrumentation.stageTimer('read'):
+            with open(imgFileName, 'rb') as imageFile:
+                return imageFile.read()
+    except IOError:
+        return None
+
+def decodeImage(imageBytes, Flags=0):
+    ''' Decodes image file contents like cv2.imread() with Flags, by default to grayscale.
+Returns None if imageBytes is None or can not be decoded '''
+    if not imageBytes:
+        return None
+    with Instrumentation.stageTimer('decode'):
+        img = cv2.imdecode(np.frombuffer(imageBytes, dtype=np.uint8), Flags)
+    if img is not None:
+        Instrumentation.addCount('images')
+        Instrumentation.addCount('bytesDecoded', img.nbytes)
+    return img
+
+def _splitImageBlocks(img, SplitBlock):
+    if img is None:
+        return None
+    with Instrumentation.stageTimer('split'):
+        imgBlocks, origins = Imaging.SplitImageInStridedBlocks(img, SplitBlock)
+    return imgBlocks
+
+def loadImageBlocks(imgFileName, SplitBlock=DefaultSplittingBlock):
+    ''' Returns complete blocks (rows X cols X blockHeight X blockWidth) of the
+grayscale image or None if the image can not be loaded '''
+    return _splitImageBlocks(decodeImage(readImageFile(imgFileName)), SplitBlock)
+
+def getImageBlockOrigins(imgBlocks, SplitBlock=DefaultSplittingBlock):
+    ''' Returns origins (rows X cols X 2) of an image's complete blocks from the block grid
+of imgBlocks, its blocks (rows X cols X blockHeight X blockWidth) or its block (feature)
+matrix (rows X cols X features) as loaded by prepareTrainingDataFromImageStrucuture() '''
+    if imgBlocks.ndim < 3:
+        raise ValueError('Invalid Argument: imgBlocks of shape {} has no block grid (rows X cols X ...)'
+                         .format(imgBlocks.shape))
+    BlockWidth, BlockHeight, OverlapHorizontal, OverlapVertical = SplitBlock
+    return Imaging.getOriginsGrid(np.arange(imgBlocks.shape[0]) * (BlockHeight - OverlapVertical),
+                                  np.arange(imgBlocks.shape[1]) * (BlockWidth - OverlapHorizontal))
+
+def _countImageBlocksTask(args):
+    imgFileName, SplitBlock = args[:2]
+    return countImageBlocks(imgFileName, SplitBlock)
+
+# image loading tasks get (imgFileName, SplitBlock, DataType, CacheFolder, CacheKey,
+# FeatureExtractor), split into read, decode, tile and features steps to be pipelined
+
+def _readImageTask(task):
+    return task, readImageFile(task[0])
+
+def _decodeImageTask(args):
+    task, imageBytes = args
+    return task, decodeImage(imageBytes)
+
+def _tileImageTask(args):
+    task, img = args
+    return task, _splitImageBlocks(img, task[1])
+
+def _featureImageTask(args):
+    task, imgBlocks = args
+    imgFileName, SplitBlock, DataType, CacheFolder, CacheKey, FeatureExtractor = task
+    if imgBlocks is None or (FeatureExtractor == 'raw' and not CacheFolder):
+        return imgBlocks # raw blocks are flattened straight into trainingData
+    blockMatrix = Features.extractFeatures(imgBlocks, FeatureExtractor, DataType)
+    # keeps the block grid (rows X cols X features), giving block origins without the image
+    blockMatrix = blockMatrix.reshape(imgBlocks.shape[:2] + blockMatrix.shape[-1:])
+    if CacheFolder:
+        TileCache.storeCachedBlocks(CacheFolder, CacheKey, blockMatrix)
+    return blockMatrix
+
+def _loadImageBlocksTask(task):
+    return _featureImageTask(_tileImageTask(_decodeImageTask(_readImageTask(task))))
+
+def createImageLoadingPipeline(ReadWorkers=4, DecodeWorkers=2, TileWorkers=1, FeatureWorkers=1,
+                               QueueSize=8):
+    ''' Returns Pipeline.Pipeline reading, decoding, tiling images and extracting (and
+caching) their block features for prepareTrainingDataFromImageStrucuture(Pipelined=...),
+whose stats() show the occupancy of each stage's queue. More ReadWorkers hide latency
+of network storage, more FeatureWorkers the cost of heavy FeatureExtractors '''
+    return Pipeline.Pipeline([('read', _readImageTask, ReadWorkers),
+                              ('decode', _decodeImageTask, DecodeWorkers),
+                              ('tile', _tileImageTask, TileWorkers),
+                              ('features', _featureImageTask, FeatureWorkers)], QueueSize)
+
+def imapOrdered(Func, Items, Workers=None, UseProcesses=False):
+    ''' Yields Func(item) for each of Items in order. With Workers > 1 items are
+processed by a pool of threads (or processes if UseProcesses, then Func must be
+picklable i.e. a module level function) '''
+    if not Workers or Workers <= 1:
+        for item in Items:
+            yield Func(item)
+        return
+    pool = multiprocessing.Pool(Workers) if UseProcesses else ThreadPool(Workers)
+    try:
+        for result in pool.imap(Func, Items):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+def listTrainingImages(FolderPath, Seed=None):
+    ''' Returns image file names of all images under FolderPath shuffled using Seed '''
+    with Instrumentation.stageTimer('list'):
+        imageStructure = Imaging.LazyImageStructure(FolderPath) # lists without decoding
+        flatStructure = Imaging.getFlattenedStructure(imageStructure)
+        imageFilenames = sorted(flatStructure)
+        random.Random(Seed).shuffle(imageFilenames)
+    if Instrumentation.isDebugEnabled(): # listings of large folders are costly to format
+        log.debug('Image Structure: {}'.format(imageStructure.index))
+        log.debug('flattened image structure: {}'.format(flatStructure.index))
+        log.debug('image list shuffled: {}'.format(imageFilenames))
+    return imageFilenames
+
+def prepareTrainingDataFromImageStrucuture(FolderPath, DataType=np.float32,
+                                           SplitBlock=DefaultSplittingBlock, Seed=None,
+                                           Workers=None, UseProcesses=False, CacheFolder=None,
+                                           FeatureExtractor='raw', Pipelined=None, ReturnTileIndex=False,
+                                           MaxSamplesPerClass=None, MaxTotalSamples=None, ClassRatios=None,
+                                           FeatureKey=None):
+    ''' Returns tuple containing trainingData matrix, label matrix, labels dict.
+Every complete image block becomes one row of trainingData (of DataType) holding its
+features from FeatureExtractor (see Features.FeatureExtractors), by default its pixels.
+FeatureKey names a custom FeatureExtractor and its parameters in cache keys, see
+Features.getFeatureExtractorName(). Images are shuffled using Seed (random if None). Images are loaded and split by
+Workers threads (or processes if UseProcesses), giving the same result as serial.
+With Pipelined (True or a pipeline from createImageLoadingPipeline()) images are
+instead read, decoded, tiled and their features extracted by pipeline stages overlapping I/O and compute, whose
+threads are set by the pipeline and not by Workers and UseProcesses.
+With CacheFolder, block matrices of unchanged images are copied from the cache one
+image at a time (memory mapped), new or changed images are added to it and deleted
+images are evicted. Entries of other folders or settings sharing CacheFolder are kept.
+With ReturnTileIndex, a TileIndex.TileIndex recording image, position and label of
+each row of trainingData is returned as fourth item.
+MaxSamplesPerClass (an int or dict of labelNo: cap), MaxTotalSamples (of all classes,
+shared in proportion to ClassRatios or else to the classes' blocks) and ClassRatios (dict
+of labelNo: weight) limit the blocks kept per class, see Sampling.getClassCaps(). Blocks
+are then sampled (reservoir sampling seeded by Seed) as images are loaded, and kept
+in the same order as without limits '''
     log.debug('Call: prepareTrainingDataFromImageStrucuture()')
-    trainingData = None
+    if Pipelined and (UseProcesses or (Workers and Workers > 1)):
+        raise ValueError('Invalid Argument: Workers and UseProcesses can not be used with Pipelined, '
+                         'set stage workers with createImageLoadingPipeline()')
+    startTime = timeit.default_timer()
+    debugEnabled = Instrumentation.isDebugEnabled()
     labels = dict()
-    labelData = []
-    imageStructure = Imaging.ImageStructureCreateFromFolder(FolderPath)
-    log.debug('Image Structure: {}'.format(imageStructure))
-    flatStructure = Imaging.getFlattenedStructure(imageStructure).viewitems()
-    log.debug('flattened image structure: {}'.format(flatStructure))
-    imageFilenames = [k for k,v in flatStructure]
-    random.shuffle(imageFilenames)
-    log.debug('image list shuffled: {}'.format(imageFilenames))
-    blockWidth, blockHeight = 70,70
-    splittingBlock = Imaging.SplittingBlock(blockWidth, blockHeight,
-                                            OverlapHorizontal=20, OverlapVertical=20)
-    log.debug('image splitting: {}'.format(splittingBlock))
-    for imgFileName in imageFilenames:
-        img = cv2.imread(imgFileName,0) # data = grayscale pixel values
-        # changing to float type early for training requirement
-        if img is None:
+    tileIndex = TileIndex.TileIndex() if ReturnTileIndex else None
+    imageFilenames = listTrainingImages(FolderPath, Seed)
+    log.debug('image splitting: {}'.format(SplitBlock))
+    if CacheFolder:
+        featureName = Features.getFeatureExtractorName(FeatureExtractor, FeatureKey)
+        # this folder's and settings' own part of the cache, evicted on its own
+        CacheFolder = TileCache.getTileCacheFolder(CacheFolder, FolderPath, SplitBlock, DataType, featureName)
+        cacheKeys = [TileCache.getTileCacheKey(imgFileName, SplitBlock, DataType, featureName)
+                     for imgFileName in imageFilenames]
+        # only block counts from the .npy headers, cache files are opened while stacking
+        cachedCounts = [TileCache.getCachedBlockCount(CacheFolder, key) for key in cacheKeys]
+    else:
+        cacheKeys = cachedCounts = [None] * len(imageFilenames)
+    # images not found in cache are loaded (and cached) by workers
+    imageTasks = [(imgFileName, SplitBlock, DataType, CacheFolder, key, FeatureExtractor)
+                  for imgFileName, key, count in zip(imageFilenames, cacheKeys, cachedCounts)
+                  if count is None]
+    log.debug('images cached: {}, to load: {}'.format(len(imageFilenames) - len(imageTasks),
+                                                     len(imageTasks)))
+    # size the matrices once from image headers to avoid growing them per image
+    with Instrumentation.stageTimer('count'):
+        blockCounts = imapOrdered(_countImageBlocksTask, imageTasks, Workers, UseProcesses)
+        imageBlockCounts = [count if count is not None else next(blockCounts)
+                            for count in cachedCounts]
+        blockCounts.close()
+    sampler = None
+    if MaxSamplesPerClass is not None or MaxTotalSamples is not None or ClassRatios is not None:
+        classCounts = dict()
+        for imgFileName, blockCount in zip(imageFilenames, imageBlockCounts):
+            labelNo = getLabelFromImagePath(imgFileName)[0]
+            classCounts[labelNo] = classCounts.get(labelNo, 0) + blockCount
+        classCaps = Sampling.getClassCaps(classCounts, MaxSamplesPerClass, MaxTotalSamples, ClassRatios)
+        sampler = Sampling.ReservoirSampler(classCaps, Seed)
+        log.debug('class blocks: {}, kept at most: {}'.format(classCounts, sampler.caps))
+        tileRecords = np.zeros(sampler.rows, dtype=TileIndex.TileRecord) if tileIndex is not None else None
+    totalBlocks = sampler.rows if sampler is not None else sum(imageBlockCounts)
+    featureCount = Features.getFeatureCount(FeatureExtractor, SplitBlock)
+    trainingData = np.empty((totalBlocks, featureCount), dtype=DataType)
+    labelData = np.empty(totalBlocks, dtype=np.float)
+    stacked = 0
+    if Pipelined:
+        pipeline = Pipelined if isinstance(Pipelined, Pipeline.Pipeline) else createImageLoadingPipeline()
+        loadedImageBlocks = pipeline.run(imageTasks)
+    else:
+        loadedImageBlocks = imapOrdered(_loadImageBlocksTask, imageTasks, Workers, UseProcesses)
+    for imgFileName, key, cachedCount in zip(imageFilenames, cacheKeys, cachedCounts):
+        imgBlocks = None # closes previous image's cache file before opening the next
+        if cachedCount is None:
+            imgBlocks = next(loadedImageBlocks)
+        else: # open (memory map) one cache file at a time
+            imgBlocks = TileCache.loadCachedBlocks(CacheFolder, key)
+            if imgBlocks is None: # removed since counted
+                imgBlocks = _loadImageBlocksTask((imgFileName, SplitBlock, DataType, CacheFolder,
+                                                  key, FeatureExtractor))
+        if imgBlocks is None:
             log.warning("Training: Unable to load Image {}".format(imgFileName))
             continue
-        log.debug('loaded image: {}; shape: {}'.format(imgFileName, img.shape))
-        # split image into smaller blocks 
-        imgBlockStructure = Imaging.SplitImageinBlocksByShifting(img,splittingBlock)
-        log.debug('image:{}, BlockStructure: {}'.
-                  format(imgFileName, [imgblock.shape for imgblock in Imaging.iterateImageBlocks(imgBlockStructure)]))
-        # 1. Select blocks of same size,
-        # 2. Flatten them to 1D matrices
-        # 3. Stack them in one array
-        # TODO replace deprecated vstack with stack
-        imgBlockStack = np.vstack(
-            [np.array(imgBlock.flatten(), dtype=np.float) for imgBlock
-             in Imaging.iterateImageBlocks(imgBlockStructure)
-             if imgBlock.shape == (blockWidth,blockHeight)]
-            )
-        if imgBlockStack is None or len(imgBlockStack) == 0:
-            continue 
-        log.debug('image:{}, Blocks: stacked: {}, shape:{} '.format(imgFileName, len(imgBlockStack), imgBlockStack[0].shape))
-
-        # append new image blocks to trainingData
-        if trainingData is None: trainingData = imgBlockStack
-        else: trainingData = np.vstack([trainingData,imgBlockStack])
-
-        # create Label for current image using its parent folder name
-        parentFolderName = os.path.split(os.path.dirname(imgFileName))[1]
-        # expecting folder name as label name in form labelNo_labelText
-        # e.g. for label names e.g. 0_NotGrass, 1_Grass, etc
-        labelNo, labelText = parentFolderName.split("_") 
+        blockCount = imgBlocks.size // featureCount
+        if debugEnabled:
+            log.debug('image:{}, Blocks: {}'.format(imgFileName, imgBlocks.shape))
+        if blockCount == 0:
+            continue
+        labelNo, labelText = getLabelFromImagePath(imgFileName)
         if not labels.has_key(labelNo):
             labels[labelNo] = labelText
-        labelData.extend([labelNo for index in range(len(imgBlockStack))])
+        if sampler is not None:
+            # copy only the sampled blocks to their reservoir rows
+            tiles, rows = sampler.offer(labelNo, blockCount)
+            tilePositions = np.unravel_index(tiles, imgBlocks.shape[:2])
+            trainingData[rows] = imgBlocks[tilePositions].reshape(len(tiles), featureCount)
+            labelData[rows] = float(labelNo)
+            if tileRecords is not None:
+                origins = getImageBlockOrigins(imgBlocks, SplitBlock).reshape(-1, 2)
+                tileRecords[rows] = TileIndex.makeTileRecords(tileIndex.internPath(imgFileName), origins[tiles],
+                                                              SplitBlock[1], SplitBlock[0], int(labelNo))
+            continue
+        if stacked + blockCount > len(trainingData): # image size differs from its header
+            trainingData, labelData = _growTrainingData(trainingData, labelData,
+                                                        stacked + blockCount)
+        # flatten raw blocks (or copy feature matrix) straight into their rows of trainingData
+        np.copyto(trainingData[stacked:stacked + blockCount].reshape(imgBlocks.shape),
+                  imgBlocks, casting='unsafe')
 
-    labelData = np.array(labelData, dtype=np.float)
+        # Label of current image comes from its parent folder name
+        labelData[stacked:stacked + blockCount] = float(labelNo)
+        if tileIndex is not None:
+            tileIndex.addImageTiles(imgFileName, getImageBlockOrigins(imgBlocks, SplitBlock),
+                                    SplitBlock[1], SplitBlock[0], int(labelNo))
+        stacked += blockCount
+    loadedImageBlocks.close() # stop workers
+
+    if CacheFolder:
+        TileCache.evictCachedBlocks(CacheFolder, cacheKeys)
+    if sampler is not None:
+        sampleRows = sampler.getSampleRows()
+        trainingData, labelData = trainingData[sampleRows], labelData[sampleRows]
+        if tileIndex is not None:
+            tileIndex = TileIndex.TileIndex(tileRecords[sampleRows], tileIndex.paths)
+    else:
+        trainingData, labelData = trainingData[:stacked], labelData[:stacked]
+    Instrumentation.addStageTime('prepare', timeit.default_timer() - startTime)
     log.debug('trainData.shape {}'.format(trainingData.shape))
+    if tileIndex is not None:
+        return (trainingData, labelData, labels, tileIndex)
     return (trainingData, labelData, labels)
 
-def TrainNSaveSVM(TrainingData, LabelData, SvmDataFileName='svm_data.dat'):
-    ''' Trains and saves SVM into (.dat) file. Pass None in Filename to avoid saving.'''
+def _growTrainingData(trainingData, labelData, minimumRows):
+    rows = max(minimumRows, len(trainingData) * 3 // 2)
+    grownData = np.empty((rows,) + trainingData.shape[1:], dtype=trainingData.dtype)
+    grownData[:len(trainingData)] = trainingData
+    grownLabels = np.empty(rows, dtype=labelData.dtype)
+    grownLabels[:len(labelData)] = labelData
+    return grownData, grownLabels
+
+def iterateSampleBatches(LabelledBlocks, BatchSize=1024, DataType=np.float32, FeatureExtractor='raw'):
+    ''' Yields (samples, labels) batches of at most BatchSize blocks from LabelledBlocks,
+an iterable of (block, label) pairs e.g. made from blocks of Imaging.iterateImageBlocks()
+or Labelling.iterateImageBlocksBasedOnMask(). Features of a batch are extracted at once '''
+    if BatchSize < 1: raise ValueError('Invalid Argument: BatchSize should be positive')
+    blocks = labelValues = None
+    batched = 0
+    for block, label in LabelledBlocks:
+        if blocks is None:
+            blocks = np.empty((BatchSize,) + block.shape, dtype=block.dtype)
+            labelValues = np.empty(BatchSize, dtype=np.float)
+        blocks[batched] = block
+        labelValues[batched] = label
+        batched += 1
+        if batched == BatchSize:
+            yield Features.extractFeatures(blocks, FeatureExtractor, DataType), labelValues
+            blocks = labelValues = None
+            batched = 0
+    if batched:
+        yield Features.extractFeatures(blocks[:batched], FeatureExtractor, DataType), labelValues[:batched]
+
+def iterateLabelledImageBlocks(ImageFilenames, SplitBlock=DefaultSplittingBlock):
+    ''' Yields (block, label) for every complete block of each image in order,
+label coming from the image's parent folder name '''
+    for imgFileName in ImageFilenames:
+        imgBlocks = loadImageBlocks(imgFileName, SplitBlock)
+        if imgBlocks is None:
+            log.warning("Training: Unable to load Image {}".format(imgFileName))
+            continue
+        labelNo, labelText = getLabelFromImagePath(imgFileName)
+        label = float(labelNo)
+        for block in Imaging.iterateImageBlocks(imgBlocks):
+            yield block, label
+
+def iterateTrainingDataBatches(FolderPath, BatchSize=1024, DataType=np.float32,
+                               SplitBlock=DefaultSplittingBlock, Seed=None, FeatureExtractor='raw'):
+    ''' Streaming counterpart of prepareTrainingDataFromImageStrucuture() yielding
+(samples, labels) batches, so memory is bounded by BatchSize and not by the dataset.
+Same Seed gives the rows of prepareTrainingDataFromImageStrucuture() in same order '''
+    imageFilenames = listTrainingImages(FolderPath, Seed)
+    return iterateSampleBatches(iterateLabelledImageBlocks(imageFilenames, SplitBlock),
+                                BatchSize, DataType, FeatureExtractor)
+
+def TrainNSaveSVM(TrainingData, LabelData, SvmDataFileName='svm_data.dat', SvmParams=None):
+    ''' Trains and saves SVM into (.dat) file. Pass None in Filename to avoid saving.
+SvmParams (e.g. dict(C=10, kernel_type=cv2.SVM_RBF, gamma=0.01)) override the default
+linear C_SVC parameters. Returns the trained SVM '''
     svm_params = dict( kernel_type = cv2.SVM_LINEAR,
                         svm_type = cv2.SVM_C_SVC)
+    svm_params.update(SvmParams or {})
     svm = cv2.SVM()
-    svm.train(TrainingData,LabelData,params=svm_params)
+    with Instrumentation.stageTimer('train'):
+        svm.train(TrainingData,LabelData,params=svm_params)
     if SvmDataFileName: # if None, do not save
         svm.save(SvmDataFileName) 
+    return svm
 
-def LoadNDetectSVM(SvmDataFileName, FolderPath):
+def LoadNDetectSVM(SvmDataFileName, FolderPath, CacheFolder=None, BatchSize=None,
+                   FeatureExtractor='raw', Pipelined=None, FeatureKey=None):
     ''' Prepare data from Folderpath, use SVM from SvmDataFileName for detection
-Returns actual and detected values for trained classes'''
-    samples, labelValues, labels = prepareTrainingDataFromImageStrucuture(
-        FolderPath)
+Returns actual and detected values for trained classes.
+With BatchSize, data is streamed and detected batch by batch instead of at once,
+without CacheFolder, Pipelined and FeatureKey (streamed blocks are not cached or pipelined).
+FeatureExtractor must be the one used to prepare the SVM's training data.
+Without BatchSize, Pipelined and FeatureKey are passed on to
+prepareTrainingDataFromImageStrucuture() '''
+    if BatchSize and (CacheFolder or Pipelined or FeatureKey is not None):
+        raise ValueError('Invalid Argument: CacheFolder, Pipelined and FeatureKey can not be used with BatchSize')
     svm = cv2.SVM()
     log.debug("loading SVM .DAT file '{}'...".format(SvmDataFileName))
     svm.load(SvmDataFileName) 
     log.debug('loaded SVM .DAT file successfully.')
-    detectedValues = svm.predict_all(np.float32(samples)) 
+    if BatchSize:
+        labelBatches, detectedBatches = [np.empty(0)], [np.empty(0, dtype=np.float32)]
+        for samples, labelValues in iterateTrainingDataBatches(
+                FolderPath, BatchSize, FeatureExtractor=FeatureExtractor):
+            detectedBatches.append(svm.predict_all(samples).reshape(-1))
+            labelBatches.append(labelValues)
+        labelValues = np.concatenate(labelBatches)
+        detectedValues = np.concatenate(detectedBatches)
+    else:
+        samples, labelValues, labels = prepareTrainingDataFromImageStrucuture(
+            FolderPath, CacheFolder=CacheFolder, FeatureExtractor=FeatureExtractor, Pipelined=Pipelined,
+            FeatureKey=FeatureKey)
+        detectedValues = svm.predict_all(np.asarray(samples, dtype=np.float32))
     # ensure 1-D row matrix
     detectedValues.shape = 1, detectedValues.size # ensure row matrix
     labelValues.shape = 1, labelValues.size # ensure row matrix
-    log.debug('labelValues{}: {}\n detectedValues{}: {}'
-              .format(labelValues.shape, labelValues,
-                      detectedValues.shape, detectedValues))
+    if Instrumentation.isDebugEnabled(): # formatting all values is costly
+        log.debug('labelValues{}: {}\n detectedValues{}: {}'
+                  .format(labelValues.shape, labelValues,
+                          detectedValues.shape, detectedValues))
     return labelValues, detectedValues
+
+def _toGrayscale(Image):
+    # blocks are trained on grayscale images, see loadImageBlocks()
+    return cv2.cvtColor(Image, cv2.COLOR_BGR2GRAY) if Image.ndim == 3 else Image
+
+def predictImageBlocks(svm, Image, SplitBlock=DefaultSplittingBlock, EdgeMode='shift',
+                       FeatureExtractor='raw'):
+    ''' Predicts all blocks of Image with one call to svm.predict_all().
+Returns predicted values (rows X cols) and block origins (rows X cols X 2) '''
+    imgBlocks, origins = Imaging.SplitImageInStridedBlocks(_toGrayscale(Image), SplitBlock, EdgeMode)
+    if imgBlocks.size == 0:
+        return np.zeros(imgBlocks.shape[:2], dtype=np.float32), origins
+    samples = Features.extractFeatures(imgBlocks, FeatureExtractor, np.float32)
+    with Instrumentation.stageTimer('predict'):
+        detectedValues = svm.predict_all(samples)
+    return detectedValues.reshape(imgBlocks.shape[:2]), origins
+
+def DetectImageSVM(SvmDataFileName, Image, SplitBlock=DefaultSplittingBlock, Accumulate='vote',
+                   FeatureExtractor='raw'):
+    ''' Classifies every pixel of Image (grayscale or BGR) using SVM from SvmDataFileName.
+Image is split into blocks, all blocks are predicted at once, and the predicted values
+are joined into a class map of Image size by vote (or average) of overlapping blocks '''
+    svm = cv2.SVM()
+    log.debug("loading SVM .DAT file '{}'...".format(SvmDataFileName))
+    svm.load(SvmDataFileName)
+    detectedValues, origins = predictImageBlocks(svm, Image, SplitBlock,
+                                                 FeatureExtractor=FeatureExtractor)
+    return Imaging.CreateImageFromBlockValues(detectedValues, origins, Image.shape,
+                                              SplitBlock, Accumulate)
+
+class SVMDetector(object):
+    ''' Long lived detector loading SVM saved by TrainNSaveSVM() once and predicting
+in memory blocks or whole images in batches of BatchSize blocks. Can be shared by
+threads (predictions are serialized). Alternatively Svm gives an already loaded
+model, any object with predict_all(samples). Blocks are turned into samples by
+FeatureExtractor, which must be the one used to prepare the SVM's training data '''
+    def __init__(self, SvmDataFileName=None, SplitBlock=DefaultSplittingBlock, BatchSize=4096, Svm=None,
+                 FeatureExtractor='raw'):
+        if Svm is None:
+            if not SvmDataFileName: raise ValueError('Invalid Argument: SvmDataFileName or Svm required')
+            Svm = cv2.SVM()
+            log.debug("loading SVM .DAT file '{}'...".format(SvmDataFileName))
+            Svm.load(SvmDataFileName)
+        self.svm = Svm
+        self.splitBlock = SplitBlock
+        self.batchSize = BatchSize
+        self.featureExtractor = FeatureExtractor
+        self.calls = self.predictedSamples = 0
+        self.totalSeconds = self.lastSeconds = 0.0
+        self._lock = threading.Lock()
+
+    def predictSamples(self, Samples):
+        ''' Returns predicted values of Samples, a matrix of flattened blocks '''
+        Samples = np.asarray(Samples)
+        detectedValues = np.empty(len(Samples), dtype=np.float32)
+        with self._lock:
+            startTime = timeit.default_timer()
+            for start in range(0, len(Samples), self.batchSize):
+                batch = np.ascontiguousarray(Samples[start:start + self.batchSize], dtype=np.float32)
+                detectedValues[start:start + len(batch)] = self.svm.predict_all(batch).reshape(-1)
+            self.lastSeconds = timeit.default_timer() - startTime
+            self.totalSeconds += self.lastSeconds
+            self.calls += 1
+            self.predictedSamples += len(Samples)
+        Instrumentation.addStageTime('predict', self.lastSeconds)
+        return detectedValues
+
+    def predictBlocks(self, Blocks):
+        ''' Returns predicted values of a single block (blockHeight X blockWidth), a stack
+of blocks (blocks X blockHeight X blockWidth) or blocks of an image (rows X cols X
+blockHeight X blockWidth), shaped like Blocks without the block dimensions '''
+        Blocks = np.asarray(Blocks)
+        BlockWidth, BlockHeight = self.splitBlock[:2]
+        if Blocks.shape[-2:] != (BlockHeight, BlockWidth):
+            raise ValueError('Invalid Argument: Blocks shape {} should end with block size {}'
+                             .format(Blocks.shape, (BlockHeight, BlockWidth)))
+        samples = Features.extractFeatures(Blocks, self.featureExtractor, np.float32)
+        return self.predictSamples(samples).reshape(Blocks.shape[:-2])
+
+    def predictImage(self, Image, EdgeMode='shift'):
+        ''' Returns predicted values (rows X cols) of all blocks of Image and their
+origins (rows X cols X 2) '''
+        imgBlocks, origins = Imaging.SplitImageInStridedBlocks(_toGrayscale(Image), self.splitBlock, EdgeMode)
+        return self.predictBlocks(imgBlocks), origins
+
+    def predictImageStrips(self, Image, BlockRowsPerStrip=8, EdgeMode='shift', SelectionMask=None,
+                           SelectionPercentage=10):
+        ''' Like predictImage() for images larger than memory: Image (an image source of
+StripProcessing, memmap or array) is read, split and predicted strip by strip of
+BlockRowsPerStrip block rows. With SelectionMask only selected blocks are predicted,
+others get NaN. Returns predicted values (rows X cols) and origins (rows X cols X 2) '''
+        stripValues, stripOrigins = [], []
+        for blocks, origins, selected in StripProcessing.iterateStripBlocks(
+                Image, self.splitBlock, BlockRowsPerStrip, EdgeMode, SelectionMask,
+                SelectionPercentage, StripFunc=lambda strip: _toGrayscale(np.asarray(strip))):
+            if selected is None:
+                values = self.predictBlocks(blocks)
+            else:
+                selected = selected.reshape((-1,) + blocks.shape[:2]).any(axis=0) # any class
+                values = np.full(blocks.shape[:2], np.nan, dtype=np.float32)
+                if selected.any():
+                    values[selected] = self.predictBlocks(blocks[selected])
+            stripValues.append(values)
+            stripOrigins.append(origins)
+        if not stripValues:
+            return np.zeros((0, 0), dtype=np.float32), np.zeros((0, 0, 2), dtype=np.intp)
+        return np.vstack(stripValues), np.vstack(stripOrigins)
+
+    def createPipeline(self, ReadWorkers=4, DecodeWorkers=2, EdgeMode='shift', QueueSize=8):
+        ''' Returns Pipeline.Pipeline reading, decoding and predicting images for
+predictImageFiles(Pipelined=...) '''
+        return Pipeline.Pipeline([('read', _readImageTask, ReadWorkers),
+                                  ('decode', _decodeImageTask, DecodeWorkers),
+                                  ('predict', lambda args: self._predictImageTask(args, EdgeMode), 1)],
+                                 QueueSize)
+
+    def _predictImageTask(self, args, EdgeMode):
+        task, img = args
+        if img is None:
+            log.warning("Detection: Unable to load Image {}".format(task[0]))
+            return None
+        detectedValues, origins = self.predictImage(img, EdgeMode)
+        return task[0], detectedValues, origins
+
+    def predictImageFiles(self, ImageFilenames, EdgeMode='shift', Pipelined=None):
+        ''' Yields (image file name, predicted values, origins) like predictImage() for
+each image file in order, skipping images which can not be loaded. With Pipelined
+(True or a pipeline from createPipeline()) the next images are read and decoded
+while the current one is predicted '''
+        tasks = ((imgFileName,) for imgFileName in ImageFilenames)
+        if Pipelined:
+            pipeline = Pipelined if isinstance(Pipelined, Pipeline.Pipeline) else self.createPipeline(EdgeMode=EdgeMode)
+            results = pipeline.run(tasks)
+        else:
+            results = (self._predictImageTask(_decodeImageTask(_readImageTask(task)), EdgeMode) for task in tasks)
+        for result in results:
+            if result is not None:
+                yield result
+
+    def detectImage(self, Image, Accumulate='vote'):
+        ''' Returns class map of Image size like DetectImageSVM() '''
+        detectedValues, origins = self.predictImage(Image)
+        return Imaging.CreateImageFromBlockValues(detectedValues, origins, Image.shape,
+                                                  self.splitBlock, Accumulate)
+
+    def warmUp(self, Repeat=1):
+        ''' Runs predictions on blank blocks so first requests do not pay set up costs '''
+        BlockWidth, BlockHeight = self.splitBlock[:2]
+        for repeat in range(Repeat):
+            self.predictBlocks(np.zeros((1, BlockHeight, BlockWidth), dtype=np.float32))
+
+    def stats(self):
+        ''' Returns prediction call and latency counters '''
+        with self._lock:
+            return dict(calls=self.calls, samples=self.predictedSamples,
+                        totalSeconds=self.totalSeconds, lastSeconds=self.lastSeconds,
+                        averageSeconds=self.totalSeconds / self.calls if self.calls else 0.0)
+
@@ -0,0 +1,64 @@
+import unittest
+import logging as log
+import os
+import shutil
+import tempfile
+import time
+
+log.basicConfig() # by default only log messages for error and critical conditions
+log.getLogger().setLevel(log.INFO) # uncomment for more verbose log messages
+#log.getLogger().setLevel(log.DEBUG) # uncomment for even more verbose log messages
+
+import Benchmark
+
+def caseCrash(Size):
+    os._exit(3) # like a process killed when out of memory
+
+def caseHang(Size):
+    time.sleep(60)
+
+class Test_Benchmark(unittest.TestCase):
+    def test_RunCaseMeasuresTimeAndMemory(self):
+        result = Benchmark.runCase('split/strided', 512, Repeat=1)
+        self.assertNotIn('error', result)
+        self.assertEqual((result['name'], result['parameter'], result['value']), ('split/strided', 'size', 512))
+        self.assertGreater(result['seconds'], 0)
+        self.assertGreaterEqual(result['peakMemoryKB'], 0)
+
+    def test_RunCaseReportsDeadOrHangingProcess(self):
+        # cases are run by forked processes, which see cases added here
+        Benchmark.BenchmarkCases['test/crash'] = (caseCrash, 'size', True, False)
+        Benchmark.BenchmarkCases['test/hang'] = (caseHang, 'size', True, False)
+        try:
+            result = Benchmark.runCase('test/crash', 512, Repeat=1)
+            self.assertEqual(result['error'], 'process exited with code 3')
+            result = Benchmark.runCase('test/hang', 512, Repeat=1, Timeout=1)
+            self.assertIn('timed out', result['error'])
+        finally:
+            del Benchmark.BenchmarkCases['test/crash'], Benchmark.BenchmarkCases['test/hang']
+
+    def test_IncompleteTrainingFolderIsRegenerated(self):
+        folder = os.path.join(tempfile.gettempdir(), 'ml-tools-benchmark-4-80')
+        try:
+            Benchmark.syntheticTrainingFolder(folder, 1, 80) # as left by an interrupted run
+            self.assertEqual(Benchmark._trainingFolder(4, 80), folder)
+            self.assertEqual(sum(len(files) for path, dirs, files in os.walk(folder)), 4)
+            os.remove(os.path.join(folder, '1_Grass', '3.png')) # complete folders are reused
+            Benchmark._trainingFolder(4, 80)
+            self.assertEqual(sum(len(files) for path, dirs, files in os.walk(folder)), 3)
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+            if os.path.isfile(folder + '.complete'): os.remove(folder + '.complete')
+
+    def test_CompareResultsFlagsRegressions(self):
+        baseline = [dict(name='mask/binary', parameter='size', value=512, seconds=1.0, peakMemoryKB=10000),
+                    dict(name='mask/binary', parameter='size', value=1024, seconds=4.0, peakMemoryKB=40000)]
+        results = [dict(name='mask/binary', parameter='size', value=512, seconds=1.1, peakMemoryKB=20000),
+                   dict(name='mask/binary', parameter='size', value=1024, seconds=6.0, peakMemoryKB=40000),
+                   dict(name='split/strided', parameter='size', value=512, seconds=9.0, peakMemoryKB=0)]
+        regressions = Benchmark.compareResults(results, baseline, Tolerance=0.25)
+        self.assertEqual(regressions, [('mask/binary[size=512]', 'peakMemoryKB', 10000, 20000),
+                                       ('mask/binary[size=1024]', 'seconds', 4.0, 6.0)])
+
+if __name__ == '__main__':
+    unittest.main()
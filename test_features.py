@@ -0,0 +1,60 @@
+import unittest
+import logging as log
+import numpy as np
+import functools
+
+log.basicConfig() # by default only log messages for error and critical conditions
+log.getLogger().setLevel(log.INFO) # uncomment for more verbose log messages
+#log.getLogger().setLevel(log.DEBUG) # uncomment for even more verbose log messages
+
+import ImageSplitting as Imaging
+import Features
+
+class Test_Features(unittest.TestCase):
+    def setUp(self):
+        image = np.random.RandomState(4).randint(0, 256, size=(190, 260)).astype(np.uint8)
+        self.splittingBlock = Imaging.SplittingBlock(blockWidth=70, blockHeight=70,
+                                                     OverlapHorizontal=20, OverlapVertical=20)
+        self.imageBlocks, origins = Imaging.SplitImageInStridedBlocks(image, self.splittingBlock)
+        self.blocks = [block for block in Imaging.iterateImageBlocks(self.imageBlocks)]
+
+    def test_RawFeaturesAreFlattenedBlocks(self):
+        features = Features.extractFeatures(self.imageBlocks)
+        self.assertEqual(features.dtype, np.float32)
+        self.assertTrue(np.array_equal(features, np.float32([block.ravel() for block in self.blocks])))
+
+    def test_BatchFeaturesMatchPerBlockFeatures(self):
+        for name in ['histogram', 'downsample', 'pyramid', 'hog']:
+            features = Features.extractFeatures(self.imageBlocks, name)
+            self.assertEqual(features.shape, (len(self.blocks),
+                                              Features.getFeatureCount(name, self.splittingBlock)))
+            self.assertLess(features.shape[1], 70 * 70 // 10) # at least 10 times smaller
+            for block, blockFeatures in zip(self.blocks, features):
+                self.assertTrue(np.allclose(Features.extractFeatures(block[np.newaxis], name),
+                                            blockFeatures, atol=1e-5))
+
+    def test_HistogramAndDownsampleValues(self):
+        block = self.blocks[0]
+        histogram = Features.extractFeatures(block[np.newaxis], 'histogram')[0]
+        self.assertTrue(np.allclose(histogram, np.histogram(block, bins=32, range=(0, 256))[0] / 4900.0))
+        downsampled = Features.extractFeatures(block[np.newaxis], 'downsample')[0]
+        self.assertAlmostEqual(downsampled[0], block[:5, :5].mean(), places=4)
+        self.assertAlmostEqual(downsampled[-1], block[65:, 65:].mean(), places=4)
+
+    def test_HogFeaturesFollowGradientOrientation(self):
+        ramp = np.tile(np.arange(70, dtype=np.uint8) * 3, (70, 1)) # left to right gradient
+        hog = Features.extractFeatures(ramp[np.newaxis], 'hog').reshape(49, 9)
+        self.assertTrue((hog[:, 0] > 0).all() and (hog[:, 1:] == 0).all())
+        self.assertRaises(ValueError, Features.extractFeatures, self.imageBlocks, 'sift')
+        self.assertRaises(ValueError, Features.extractFeatures, np.zeros((2, 8, 70)), 'hog')
+
+    def test_FeatureExtractorNamesIncludeParameters(self):
+        self.assertEqual(Features.getFeatureExtractorName(u'hog'), u'hog')
+        self.assertEqual(Features.getFeatureExtractorName(Features.histogramFeatures), 'histogram')
+        names = [Features.getFeatureExtractorName(functools.partial(Features.histogramFeatures, Bins=bins))
+                 for bins in (16, 64)]
+        self.assertEqual(len(set(names)), 2)
+        self.assertTrue(all(name.startswith('histogram') for name in names))
+        # custom functions are named by FeatureKey only, lambdas would share a name
+        self.assertRaises(ValueError, Features.getFeatureExtractorName, lambda blocks: blocks)
+        self.assertEqual(Features.getFeatureExtractorName(lambda blocks: blocks, 'mean3'), 'mean3')
@@ -4,6 +4,7 @@ import cv2
 import numpy as np
 
 import os
+import shutil
 
 log.basicConfig() # by default only log messages for error and critical conditions
 log.getLogger().setLevel(log.INFO) # uncomment for more verbose log messages
@@ -53,6 +54,48 @@ class Test_ImageSplitting(unittest.TestCase):
                                                     splittingBlock)
         self.assertTrue((recreatedImage == original_image).all())
 
+    def test_StridedBlocksMatchShiftedBlocks_WithoutCopying(self):
+        original_image = data.loadImageFromFile('test/UnequallySplitting_Image.png')
+        splittingBlock = data.SplittingBlock(blockWidth=10, blockHeight=10,
+                                             OverlapHorizontal=3, OverlapVertical=2)
+        imageBlocks = data.SplitImageinBlocksByShifting(original_image, splittingBlock)
+        completeBlocks = [block for block in data.iterateImageBlocks(imageBlocks)
+                          if block.shape[:2] == (10, 10)]
+        stridedBlocks, origins = data.SplitImageInStridedBlocks(original_image, splittingBlock)
+        self.assertEqual(stridedBlocks.shape[2:], (10, 10) + original_image.shape[2:])
+        self.assertEqual(origins.shape, stridedBlocks.shape[:2] + (2,))
+        self.assertTrue(np.shares_memory(stridedBlocks, original_image))
+        self.assertEqual(len(completeBlocks), stridedBlocks.shape[0] * stridedBlocks.shape[1])
+        for block, stridedBlock, (row, col) in zip(
+                completeBlocks, data.iterateImageBlocks(stridedBlocks), origins.reshape(-1, 2)):
+            self.assertTrue(np.array_equal(block, stridedBlock))
+            self.assertTrue(np.array_equal(original_image[row:row+10, col:col+10], stridedBlock))
+
+    def test_StridedBlocksEdgeModes(self):
+        image = np.arange(25 * 23).reshape(25, 23)
+        splittingBlock = data.SplittingBlock(blockWidth=10, blockHeight=10,
+                                             OverlapHorizontal=0, OverlapVertical=0)
+        dropped, origins = data.SplitImageInStridedBlocks(image, splittingBlock, EdgeMode='drop')
+        self.assertEqual(dropped.shape, (2, 2, 10, 10))
+        padded, origins = data.SplitImageInStridedBlocks(image, splittingBlock, EdgeMode='pad')
+        self.assertEqual(padded.shape, (3, 3, 10, 10))
+        self.assertTrue((padded[2, 2, 5:] == 0).all() and (padded[2, 2, :, 3:] == 0).all())
+        recreatedImage = data.CreateImageFromBlocks(padded, np.zeros((30, 30), image.dtype), splittingBlock)
+        self.assertTrue(np.array_equal(recreatedImage[:25, :23], image))
+        shifted, origins = data.SplitImageInStridedBlocks(image, splittingBlock, EdgeMode='shift')
+        self.assertEqual(shifted.shape, (3, 3, 10, 10))
+        self.assertEqual(list(origins[:, 0, 0]), [0, 10, 15])
+        self.assertEqual(list(origins[0, :, 1]), [0, 10, 13])
+        self.assertTrue(np.array_equal(shifted[2, 2], image[15:, 13:]))
+        self.assertRaises(ValueError, data.SplitImageInStridedBlocks, image, splittingBlock, 'wrap')
+
+    def test_ImageSizeFromHeaderMatchesLoadedImage(self):
+        for imageName in ['EquallySplitting_Image.png', 'UnequallySplitting_Image.png',
+                          'markedImage.png']:
+            imagePath = os.path.join('test', imageName)
+            self.assertEqual(data.getImageSizeFromHeader(imagePath),
+                             data.loadImageFromFile(imagePath).shape[:2])
+
     @unittest.skip("TODO: Design: group imageBlocks and Block(Width/Height), (Horizontal/Vertical) Shift")
     def test_ImageBlocksStoreWidthHeightAndOverlap(self):
         pass
@@ -77,8 +120,91 @@ class Test_ImageSplitting(unittest.TestCase):
          './myTest/f2': {'./myTest/f2/21.jpg': None, './myTest/f2/22.jpg': None,
                          './myTest/f2/b': {'./myTest/f2/b/b1.jpg': None}}}
         self.assertDictEqual( imgStrucuture_absolutePaths, dict_absolutePaths)
-        
 
+    def test_LazyImageStructureDecodesImagesOnAccessWithinMemoryBudget(self):
+        testPath = os.path.join(os.curdir, 'test')
+        imageNames = ['EquallySplitting_Image.png', 'UnequallySplitting_Image.png', 'ObjectInTopLeft.png']
+        imageIndex = data.ImageStructureIndexFolder(testPath)
+        imagePath = os.path.join(testPath, imageNames[0])
+        self.assertEqual(imageIndex[imagePath].size, os.path.getsize(imagePath))
+        self.assertDictEqual(data.ImageStructureCreateFromFolder(testPath),
+                             dict((key, None) for key in imageIndex))
+
+        images = [data.loadImageFromFile(os.path.join(testPath, name)) for name in imageNames]
+        imageCache = data.LRUImageCache(MaxBytes=images[0].nbytes + images[1].nbytes)
+        lazyStructure = data.LazyImageStructure(testPath, imageCache)
+        self.assertEqual(sorted(lazyStructure), sorted(imageIndex))
+        self.assertEqual(imageCache.misses, 0) # nothing decoded yet
+        for name, image in zip(imageNames, images):
+            self.assertTrue(np.array_equal(lazyStructure[os.path.join(testPath, name)], image))
+        lazyStructure[os.path.join(testPath, imageNames[2])]
+        stats = imageCache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 3))
+        self.assertLessEqual(stats['bytes'], stats['maxBytes'])
+        self.assertGreaterEqual(stats['evictions'], 1)
+
+    def test_LazyImageStructureFlattensAndAppliesFuncWithoutDecodingUpFront(self):
+        testPath = os.path.join(os.curdir, 'myLazyTest')
+        self.addCleanup(shutil.rmtree, testPath, True)
+        imagePaths = [os.path.join(testPath, name) for name in ['a.png', 'f1/b.png', 'f1/c/d.png']]
+        for imagePath, size in zip(imagePaths, [4, 6, 8]):
+            data.touch(imagePath)
+            cv2.imwrite(imagePath, np.zeros((size, size + 1, 3), np.uint8))
+        imageCache = data.LRUImageCache(MaxBytes=2**20)
+        lazyStructure = data.LazyImageStructure(testPath, imageCache)
+        flatStructure = data.getFlattenedStructure(lazyStructure)
+        self.assertEqual(sorted(flatStructure), sorted(imagePaths))
+        self.assertEqual(imageCache.misses, 0)
 
+        data.ImageStructureApplyFunc(lazyStructure, lambda image: image.shape[:2])
+        self.assertEqual(imageCache.misses, 3)
+        expectedShapes = {imagePaths[0]: (4, 5), imagePaths[1]: (6, 7), imagePaths[2]: (8, 9)}
+        self.assertDictEqual(dict(data.getFlattenedStructure(lazyStructure).viewitems()), expectedShapes)
+        self.assertDictEqual(data.getFlattenedStructure(lazyStructure, dict()), expectedShapes)
+        data.ImageStructureApplyFunc(flatStructure, len, UseKey=True)
+        self.assertDictEqual(dict(flatStructure.viewitems()),
+                             dict((imagePath, len(imagePath)) for imagePath in imagePaths))
+        self.assertEqual(imageCache.misses, 3)
 
+    def test_ConcurrentApplyFuncLoadsImagesAndReportsFailures(self):
+        testPath = os.path.join(os.curdir, 'test')
+        imageStructure = data.ImageStructureCreateFromFolder(testPath)
+        missingImage = os.path.join(testPath, 'missing', 'NoSuchImage.png')
+        imageStructure[os.path.join(testPath, 'missing')] = {missingImage: None}
+        imageStructure, failures = data.ImageStructureApplyFuncConcurrently(
+            imageStructure, data.loadImageFromFile, UseKey=True, Workers=3, MaxInFlight=2)
+        self.assertEqual(list(failures), [missingImage])
+        self.assertIsInstance(failures[missingImage], ValueError)
+        flatStructure = data.getFlattenedStructure(imageStructure)
+        self.assertIsNone(flatStructure.pop(missingImage))
+        for imagePath, image in flatStructure.items():
+            self.assertTrue(np.array_equal(image, data.loadImageFromFile(imagePath)))
 
+    def test_CreateImageFromBlockValuesAccumulatesOverlaps(self):
+        splittingBlock = data.SplittingBlock(blockWidth=10, blockHeight=8,
+                                             OverlapHorizontal=4, OverlapVertical=3)
+        imageShape = (29, 33)
+        blocks, origins = data.SplitImageInStridedBlocks(np.zeros(imageShape), splittingBlock, 'shift')
+        randomState = np.random.RandomState(1)
+        blockValues = randomState.randint(0, 3, size=blocks.shape[:2]).astype(np.float32)
+        # expected results from per pixel lists of covering block values
+        covering = [[[] for col in range(imageShape[1])] for row in range(imageShape[0])]
+        for (row, col), value in zip(origins.reshape(-1, 2), blockValues.ravel()):
+            for r in range(row, row + 8):
+                for c in range(col, col + 10):
+                    covering[r][c].append(value)
+        averaged = data.CreateImageFromBlockValues(blockValues, origins, imageShape, splittingBlock)
+        voted = data.CreateImageFromBlockValues(blockValues, origins, imageShape, splittingBlock, 'vote')
+        for r in range(imageShape[0]):
+            for c in range(imageShape[1]):
+                values = covering[r][c]
+                self.assertAlmostEqual(averaged[r, c], np.mean(values))
+                counts = np.bincount(np.int64(values), minlength=3)
+                self.assertEqual(voted[r, c], counts.argmax())
+        # scores are averaged, not voted
+        self.assertRaises(ValueError, data.CreateImageFromBlockValues, blockValues + 0.25,
+                          origins, imageShape, splittingBlock, 'vote')
+        # dropped edge blocks leave uncovered pixels
+        blocks, origins = data.SplitImageInStridedBlocks(np.zeros(imageShape), splittingBlock, 'drop')
+        averaged = data.CreateImageFromBlockValues(np.ones(blocks.shape[:2]), origins, imageShape, splittingBlock)
+        self.assertTrue(np.isnan(averaged[-1, -1]) and (averaged[:8, :10] == 1).all())
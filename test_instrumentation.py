@@ -0,0 +1,67 @@
+import unittest
+import logging as log
+import numpy as np
+
+log.basicConfig() # by default only log messages for error and critical conditions
+log.getLogger().setLevel(log.INFO) # uncomment for more verbose log messages
+#log.getLogger().setLevel(log.DEBUG) # uncomment for even more verbose log messages
+
+import ImageSplitting as Imaging
+import Labelling
+import Instrumentation
+
+class Test_Instrumentation(unittest.TestCase):
+    def setUp(self):
+        Instrumentation.resetStats()
+        self.splittingBlock = Imaging.SplittingBlock(blockWidth=70, blockHeight=70,
+                                                     OverlapHorizontal=20, OverlapVertical=20)
+
+    def tearDown(self):
+        Instrumentation.setProfilingHook(None)
+
+    def test_StageTimersCountersAndProfilingHook(self):
+        hookCalls = []
+        Instrumentation.setProfilingHook(lambda stage, seconds: hookCalls.append((stage, seconds)))
+        for call in range(3):
+            with Instrumentation.stageTimer('decode'):
+                Instrumentation.addCount('images')
+        Instrumentation.addCount('bytesDecoded', 1000)
+        stats = Instrumentation.getStats()
+        self.assertEqual(stats['stages']['decode'].calls, 3)
+        self.assertEqual(stats['counters'], dict(images=3, bytesDecoded=1000))
+        self.assertEqual([stage for stage, seconds in hookCalls], ['decode'] * 3)
+        self.assertAlmostEqual(sum(seconds for stage, seconds in hookCalls),
+                               stats['stages']['decode'].seconds)
+        Instrumentation.resetStats()
+        self.assertEqual(Instrumentation.getStats(), dict(stages={}, counters={}))
+
+    def test_SplittingAndSelectionCountTiles(self):
+        image = np.zeros((190, 260), dtype=np.uint8)
+        mask = np.zeros((190, 260), dtype=bool)
+        mask[:60, :] = True
+        Imaging.SplitImageInStridedBlocks(image, self.splittingBlock)
+        selected, origins = Labelling.getBlockSelectionFromMask(mask, self.splittingBlock)
+        counters = Instrumentation.getStats()['counters']
+        self.assertEqual(counters['tiles'], 3 * 4)
+        self.assertEqual(counters['selectedTiles'], np.count_nonzero(selected))
+
+    def test_DebugMessagesAreNotBuiltWhenDebugIsOff(self):
+        debugCalls = []
+        originalDebug = log.debug
+        log.debug = lambda *args, **kwargs: debugCalls.append(args)
+        try:
+            image = np.zeros((190, 260), dtype=np.uint8)
+            imageBlocks = Imaging.SplitImageinBlocksByShifting(image, self.splittingBlock)
+            blocks = list(Imaging.iterateImageBlocks(imageBlocks))
+            Imaging.CreateImageFromBlocks(imageBlocks, np.zeros_like(image), self.splittingBlock)
+            list(Labelling.iterateImageBlocksBasedOnMask(iter(blocks), iter(blocks)))
+            self.assertEqual(debugCalls, [])
+            log.getLogger().setLevel(log.DEBUG)
+            Imaging.SplitImageinBlocksByShifting(image, self.splittingBlock)
+            self.assertEqual(len(debugCalls), len(blocks))
+        finally:
+            log.debug = originalDebug
+            log.getLogger().setLevel(log.INFO)
+
+if __name__ == '__main__':
+    unittest.main()
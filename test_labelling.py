@@ -110,3 +110,66 @@ class Test_Labelling(unittest.TestCase):
                                                          maskBlocks):
             selectedBlocks.append(iBlock)
         self.assertEqual(len(selectedBlocks), 4)
+
+    def test_PaletteDecodesColorCodedImageIntoLabelMap(self):
+        maskImageGreen10 = Imaging.loadImageFromFile('test/MaskImageGreen10.png')
+        palette = ['#00ff00', '#0000ff', '#ff0000']
+        labelMap, masks = Labelling.getLabelMapFromColorCodedImage(maskImageGreen10, palette,
+                                                                   returnMasks=True)
+        self.assertEqual(labelMap.shape, maskImageGreen10.shape[:2])
+        self.assertEqual(masks.shape, (len(palette),) + labelMap.shape)
+        greenLabel10 = Labelling.getBinaryMaskFromColorCodedImage(maskImageGreen10, '#00ff00')
+        self.assertTrue(np.array_equal(masks[0], greenLabel10))
+        self.assertTrue(np.array_equal(labelMap == 0, greenLabel10))
+        # every pixel either matches a palette colour or is marked -1
+        expected = np.full(labelMap.shape, -1)
+        for index, hexColor in enumerate(palette):
+            expected[(maskImageGreen10 == Labelling.hex_to_rgb(hexColor)).all(axis=2)] = index
+        self.assertTrue(np.array_equal(labelMap, expected))
+
+    def test_IntegralImageBlockSelectionMatchesPerBlockSelection(self):
+        inputImage = Imaging.loadImageFromFile('test/ObjectInTopLeft.png')
+        maskImageTopLeft = Imaging.loadImageFromFile('test/MaskImageGreen10.png')
+        greenLabel = Labelling.getBinaryMaskFromColorCodedImage(maskImageTopLeft)
+        splittingBlock = Imaging.SplittingBlock(blockWidth=10, blockHeight=10,
+                                             OverlapHorizontal=2, OverlapVertical=2)
+        maskBlocksStructure = Imaging.SplitImageinBlocksByShifting(greenLabel, splittingBlock)
+        for invertMask in (False, True):
+            for percentage in (1, 10, 50):
+                expected = [[Labelling.IsImageBlockSatisfyingSelectionPercentage(
+                    mBlock, mBlock, invertMask, percentage) for mBlock in mRow]
+                            for mRow in maskBlocksStructure]
+                selected, origins = Labelling.getBlockSelectionFromMask(
+                    greenLabel, splittingBlock, percentage, invertMask, EdgeMode='pad')
+                self.assertEqual(selected.tolist(), expected)
+
+        # same 4 blocks as test_ImageSplittingWithOverlaps_WithBinaryMaskLabelling
+        selectedBlocks = list(Labelling.iterateImageBlocksSelectedByMask(
+            inputImage, greenLabel, splittingBlock, EdgeMode='pad'))
+        self.assertEqual(len(selectedBlocks), 4)
+
+        # per class thresholds on a stack of class masks
+        classMasks = np.array([greenLabel, ~greenLabel])
+        selected, origins = Labelling.getBlockSelectionFromMask(
+            classMasks, splittingBlock, SelectionPercentage=[10, 100], EdgeMode='pad')
+        self.assertEqual(selected.shape, (2,) + origins.shape[:2])
+        self.assertEqual(np.count_nonzero(selected[0]), 4)
+        self.assertTrue(np.array_equal(selected[1], Labelling.getBlockSelectionFromMask(
+            greenLabel, splittingBlock, 100, InvertMask=True, EdgeMode='pad')[0]))
+
+    def test_IntegralImageCountsNonzeroPixelsOf0To255Mask(self):
+        greenLabel = Labelling.getBinaryMaskFromColorCodedImage(
+            Imaging.loadImageFromFile('test/MaskImageGreen10.png'))
+        mask255 = greenLabel.astype(np.uint8) * 255
+        self.assertTrue(np.array_equal(Labelling.getIntegralImage(mask255),
+                                       Labelling.getIntegralImage(greenLabel)))
+        splittingBlock = Imaging.SplittingBlock(blockWidth=10, blockHeight=10,
+                                             OverlapHorizontal=2, OverlapVertical=2)
+        maskBlocksStructure = Imaging.SplitImageinBlocksByShifting(mask255, splittingBlock)
+        for percentage in (1, 10, 50):
+            expected = [[Labelling.IsImageBlockSatisfyingSelectionPercentage(
+                mBlock, mBlock, False, percentage) for mBlock in mRow]
+                        for mRow in maskBlocksStructure]
+            selected, origins = Labelling.getBlockSelectionFromMask(
+                mask255, splittingBlock, percentage, EdgeMode='pad')
+            self.assertEqual(selected.tolist(), expected)
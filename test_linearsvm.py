@@ -0,0 +1,92 @@
+import unittest
+import logging as log
+import numpy as np
+
+import os
+import shutil
+import tempfile
+
+log.basicConfig() # by default only log messages for error and critical conditions
+log.getLogger().setLevel(log.INFO) # uncomment for more verbose log messages
+#log.getLogger().setLevel(log.DEBUG) # uncomment for even more verbose log messages
+
+import LinearSVM
+
+# layout of a linear C_SVC saved by cv2.SVM.save() (OpenCV 2.4)
+svmXmlTemplate = '''<?xml version="1.0"?>
+<opencv_storage>
+<my_svm type_id="opencv-ml-svm">
+  <svm_type>C_SVC</svm_type>
+  <kernel><type>LINEAR</type></kernel>
+  <C>1.</C>
+  <var_all>3</var_all>
+  <var_count>3</var_count>
+  <class_count>{classCount}</class_count>
+  <class_labels type_id="opencv-matrix">
+    <rows>1</rows><cols>{classCount}</cols><dt>i</dt>
+    <data>{classLabels}</data></class_labels>
+  <sv_total>{svTotal}</sv_total>
+  <support_vectors>{supportVectors}</support_vectors>
+  <decision_functions>{decisionFunctions}</decision_functions>
+</my_svm>
+</opencv_storage>
+'''
+
+def writeSvmXml(FileName, ClassLabels, SupportVectors, DecisionFunctions):
+    ''' DecisionFunctions: list of (rho, alphas, indices) '''
+    with open(FileName, 'w') as svmFile:
+        svmFile.write(svmXmlTemplate.format(
+            classCount=len(ClassLabels), classLabels=' '.join(map(str, ClassLabels)),
+            svTotal=len(SupportVectors),
+            supportVectors=''.join('<_>{}</_>'.format(' '.join(map(repr, vector)))
+                                   for vector in SupportVectors),
+            decisionFunctions=''.join(
+                '<_><sv_count>{}</sv_count><rho>{!r}</rho><alpha>{}</alpha><index>{}</index></_>'
+                .format(len(alphas), rho, ' '.join(map(repr, alphas)), ' '.join(map(str, indices)))
+                for rho, alphas, indices in DecisionFunctions)))
+
+class Test_LinearSVM(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.samples = np.random.RandomState(2).uniform(-1, 1, size=(50, 3)).astype(np.float32)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_ExportedTwoClassModelScoresLikeDecisionFunction(self):
+        svmFileName = os.path.join(self.folder, 'svm_data.dat')
+        supportVectors = [[0.5, -1.0, 2.0], [1.0, 1.0, 0.0]]
+        writeSvmXml(svmFileName, [0, 1], supportVectors, [(0.25, [1.0, -0.5], [0, 1])])
+        npzFileName = os.path.join(self.folder, 'svm_linear.npz')
+        LinearSVM.ExportLinearSVM(svmFileName, npzFileName)
+        model = LinearSVM.LoadLinearSVM(npzFileName)
+        self.assertEqual(model.weights.shape, (1, 3))
+        labels, margins = LinearSVM.ScoreLinearSVM(model, self.samples)
+        expectedMargins = self.samples.dot(np.array([0.0, -1.5, 2.0])) - 0.25
+        self.assertTrue(np.allclose(margins[:, 0], expectedMargins, atol=1e-6))
+        self.assertTrue(np.array_equal(labels, np.where(expectedMargins > 0, 0, 1)))
+        self.assertTrue(np.array_equal(model.predict_all(self.samples), labels.reshape(-1, 1)))
+
+    def test_MultiClassModelVotesOverClassPairs(self):
+        svmFileName = os.path.join(self.folder, 'svm_data.dat')
+        supportVectors = [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]]
+        writeSvmXml(svmFileName, [2, 5, 7], supportVectors,
+                    [(0.0, [1.0], [0]), (0.1, [1.0], [1]), (-0.1, [1.0], [2])])
+        model = LinearSVM.ReadLinearSVM(svmFileName)
+        labels, margins = LinearSVM.ScoreLinearSVM(model, self.samples)
+        self.assertEqual(margins.shape, (len(self.samples), 3))
+        for sample, label in zip(self.samples, labels):
+            votes = [0, 0, 0]
+            for (i, j), margin in zip([(0, 1), (0, 2), (1, 2)],
+                                      [sample[0], sample[1] - 0.1, sample[2] + 0.1]):
+                votes[i if margin > 0 else j] += 1
+            self.assertEqual(label, [2, 5, 7][int(np.argmax(votes))])
+
+    def test_NonLinearModelIsRejected(self):
+        svmFileName = os.path.join(self.folder, 'svm_data.dat')
+        writeSvmXml(svmFileName, [0, 1], [[1.0, 0.0, 0.0]], [(0.0, [1.0], [0])])
+        with open(svmFileName) as svmFile:
+            rbfSvm = svmFile.read().replace('<type>LINEAR</type>', '<type>RBF</type>')
+        with open(svmFileName, 'w') as svmFile:
+            svmFile.write(rbfSvm)
+        self.assertRaises(ValueError, LinearSVM.ReadLinearSVM, svmFileName)
@@ -0,0 +1,86 @@
+import unittest
+import logging as log
+import numpy as np
+import os
+import shutil
+import tempfile
+
+log.basicConfig() # by default only log messages for error and critical conditions
+log.getLogger().setLevel(log.INFO) # uncomment for more verbose log messages
+#log.getLogger().setLevel(log.DEBUG) # uncomment for even more verbose log messages
+
+import ModelSelection
+
+class ThresholdModel(object):
+    ''' stands in for a trained svm: predicts 1 for samples brighter than threshold '''
+    def __init__(self, threshold):
+        self.threshold = threshold
+
+    def predict_all(self, samples):
+        return np.float32(samples.mean(axis=1) > self.threshold).reshape(-1, 1)
+
+    def save(self, fileName):
+        np.save(fileName, self.threshold)
+
+def trainThresholdModel(TrainingData, LabelData, Params):
+    if len(np.unique(LabelData)) < 2: # as cv2.SVM.train() fails
+        raise ValueError('training data of a single class')
+    return ThresholdModel(Params['threshold'] * Params['scale'])
+
+class Test_ModelSelection(unittest.TestCase):
+    def setUp(self):
+        randomState = np.random.RandomState(8)
+        self.labelData = np.float64(randomState.rand(90) > 0.3)
+        brightness = np.where(self.labelData == 1, 160, 90) + randomState.randint(-20, 20, size=90)
+        self.trainingData = np.float32(brightness[:, np.newaxis] + randomState.randint(-5, 5, size=(90, 16)))
+
+    def test_StratifiedFoldsKeepClassBalance(self):
+        folds = ModelSelection.getStratifiedFolds(self.labelData, Folds=3, Seed=1)
+        self.assertTrue(np.array_equal(folds, ModelSelection.getStratifiedFolds(self.labelData, 3, Seed=1)))
+        for fold in range(3):
+            foldLabels = self.labelData[folds == fold]
+            self.assertLessEqual(abs(len(foldLabels) - 30), 1)
+            self.assertLessEqual(abs(np.count_nonzero(foldLabels) * 3 - np.count_nonzero(self.labelData)), 3)
+        self.assertRaises(ValueError, ModelSelection.getStratifiedFolds, self.labelData, Folds=1)
+
+    def test_ParallelGridSearchRanksCombinationsAndSavesBestModel(self):
+        grid = dict(threshold=[50, 125, 200], scale=[1, 1.5])
+        self.assertEqual(len(ModelSelection.getParameterCombinations(grid)), 6)
+        tempFolder = tempfile.mkdtemp()
+        try:
+            bestFileName = os.path.join(tempFolder, 'best.npy')
+            results = ModelSelection.crossValidateSVM(self.trainingData, self.labelData, grid, Folds=3, Seed=2,
+                                                      Workers=2, BestSvmFileName=bestFileName,
+                                                      TrainFunc=trainThresholdModel)
+            self.assertEqual(results[0]['params'], dict(threshold=125, scale=1))
+            self.assertEqual(results[0]['meanAccuracy'], 1.0)
+            self.assertEqual(len(results), 6)
+            self.assertEqual(len(results[0]['foldAccuracies']), 3)
+            self.assertEqual([result['meanAccuracy'] for result in results],
+                             sorted([result['meanAccuracy'] for result in results], reverse=True))
+            self.assertEqual(float(np.load(bestFileName)), 125)
+            serial = ModelSelection.crossValidateSVM(self.trainingData, self.labelData, grid, Folds=3, Seed=2,
+                                                     TrainFunc=trainThresholdModel)
+            self.assertEqual([result['foldAccuracies'] for result in serial],
+                             [result['foldAccuracies'] for result in results])
+            self.assertEqual(len(ModelSelection.formatResultsTable(results).splitlines()), 7)
+            self.assertTrue(all(result['error'] is None for result in results))
+        finally:
+            shutil.rmtree(tempFolder)
+
+    def test_FailedCombinationIsRecordedAndRankedLast(self):
+        grid = dict(threshold=[125, None], scale=[1])
+        results = ModelSelection.crossValidateSVM(self.trainingData, self.labelData, grid, Folds=3, Seed=2,
+                                                  Workers=2, TrainFunc=trainThresholdModel)
+        self.assertEqual([result['params']['threshold'] for result in results], [125, None])
+        self.assertIsNone(results[0]['error'])
+        self.assertTrue(results[1]['error'].startswith('fold 0: TypeError'))
+        self.assertTrue(np.isnan(results[1]['meanAccuracy']))
+        self.assertIn('failed: fold 0', ModelSelection.formatResultsTable(results))
+        # training parts of a single class fail every combination, so no best model
+        self.assertRaises(ValueError, ModelSelection.crossValidateSVM, self.trainingData, np.zeros(90),
+                          dict(threshold=[125], scale=[1]), Folds=2, BestSvmFileName='unused.npy',
+                          TrainFunc=trainThresholdModel)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+import logging as log
+import random
+import sys
+import threading
+import time
+import traceback
+
+log.basicConfig() # by default only log messages for error and critical conditions
+log.getLogger().setLevel(log.INFO) # uncomment for more verbose log messages
+#log.getLogger().setLevel(log.DEBUG) # uncomment for even more verbose log messages
+
+import Pipeline
+
+def sleepRandomly(item):
+    time.sleep(random.random() * 0.002)
+    return item
+
+class Test_Pipeline(unittest.TestCase):
+    def test_ResultsKeepOrderOfItemsWithConcurrentStages(self):
+        pipeline = Pipeline.Pipeline([('read', sleepRandomly, 4),
+                                      ('square', lambda item: sleepRandomly(item * item), 3),
+                                      ('negate', lambda item: -item, 1)], QueueSize=2)
+        self.assertEqual(list(pipeline.run(range(100))), [-item * item for item in range(100)])
+        stats = pipeline.stats()
+        self.assertEqual([stage['name'] for stage in stats], ['read', 'square', 'negate'])
+        self.assertEqual([stage['items'] for stage in stats], [100] * 3)
+        for stage in stats:
+            self.assertLessEqual(stage['maxQueued'], 2)
+            self.assertLessEqual(stage['meanQueued'], stage['maxQueued'])
+        self.assertEqual(list(pipeline.run([])), []) # pipeline can be run again
+
+    def test_StageExceptionIsRaisedInTurnOfItsItem(self):
+        def failOnFive(item):
+            if item == 5: raise KeyError(item)
+            return item
+        results = []
+        pipeline = Pipeline.Pipeline([('read', sleepRandomly, 3), ('check', failOnFive, 2)])
+        try:
+            for result in pipeline.run(range(20)):
+                results.append(result)
+            self.fail('KeyError not raised')
+        except KeyError:
+            # traceback ends where the stage raised
+            self.assertEqual(traceback.extract_tb(sys.exc_info()[2])[-1][2], 'failOnFive')
+        self.assertEqual(results, list(range(5)))
+
+    def test_BackpressureBoundsItemsInFlightAndCloseStopsStages(self):
+        fed = [0]
+        def items():
+            for item in range(1000):
+                fed[0] += 1
+                yield item
+        threadCount = threading.active_count()
+        pipeline = Pipeline.Pipeline([('read', sleepRandomly, 2), ('tile', sleepRandomly, 2)], QueueSize=3)
+        results = pipeline.run(items())
+        self.assertEqual(next(results), 0)
+        time.sleep(0.2) # stages fill their queues while results are not consumed
+        # workers + queues (2 stages and results) + consumed result + one waiting to be fed
+        self.assertLessEqual(fed[0], 2 + 2 + 3 * 3 + 1 + 1)
+        results.close()
+        self.assertEqual(threading.active_count(), threadCount)
+        self.assertRaises(ValueError, Pipeline.Pipeline, [('read', sleepRandomly, 0)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+import logging as log
+import numpy as np
+
+log.basicConfig() # by default only log messages for error and critical conditions
+log.getLogger().setLevel(log.INFO) # uncomment for more verbose log messages
+#log.getLogger().setLevel(log.DEBUG) # uncomment for even more verbose log messages
+
+import Sampling
+
+class Test_Sampling(unittest.TestCase):
+    def test_ClassCapsFromMaxSamplesOrRatios(self):
+        counts = {'0': 100, '1': 400}
+        self.assertEqual(Sampling.getClassCaps(counts), counts)
+        self.assertEqual(Sampling.getClassCaps(counts, 150), {'0': 100, '1': 150})
+        self.assertEqual(Sampling.getClassCaps(counts, {1: 50}), {'0': 100, '1': 50})
+        self.assertEqual(Sampling.getClassCaps(counts, ClassRatios={0: 1, 1: 1}), {'0': 100, '1': 100})
+        # totals keep the ratios, or the class proportions without ratios
+        self.assertEqual(Sampling.getClassCaps(counts, MaxTotalSamples=100, ClassRatios={'0': 1, '1': 3}),
+                         {'0': 25, '1': 75})
+        self.assertEqual(Sampling.getClassCaps(counts, MaxTotalSamples=150), {'0': 30, '1': 120})
+        # classes short of their share leave it to the others
+        self.assertEqual(Sampling.getClassCaps(counts, 100, MaxTotalSamples=400), {'0': 100, '1': 100})
+        self.assertEqual(Sampling.getClassCaps(counts, {'1': 150}, MaxTotalSamples=400), {'0': 100, '1': 150})
+        smallClassCounts = {'0': 10, '1': 400, '2': 400}
+        self.assertEqual(Sampling.getClassCaps(smallClassCounts, MaxTotalSamples=300,
+                                               ClassRatios={0: 1, 1: 1, 2: 1}), {'0': 10, '1': 145, '2': 145})
+        self.assertEqual(Sampling.getClassCaps(smallClassCounts, MaxTotalSamples=2000), smallClassCounts)
+        self.assertEqual(Sampling.getClassCaps(counts, ClassRatios={'1': 1}), {'0': 0, '1': 400})
+        self.assertRaises(ValueError, Sampling.getClassCaps, counts, ClassRatios={'1': 0})
+
+    def test_ReservoirKeepsSeededUniformSampleInOfferOrder(self):
+        def sample(Seed):
+            sampler = Sampling.ReservoirSampler({'0': 10, '1': 1000}, Seed)
+            offered, kept = 0, np.full(sampler.rows, -1)
+            for label, count in [('0', 7), ('1', 30), ('0', 25), ('0', 0), ('0', 18)]:
+                tiles, rows = sampler.offer(label, count)
+                self.assertEqual(len(np.unique(rows)), len(rows))
+                kept[rows] = offered + tiles
+                offered += count
+            return kept[sampler.getSampleRows()]
+        kept = sample(1)
+        self.assertTrue(np.array_equal(kept, sample(1)))
+        self.assertFalse(np.array_equal(kept, sample(2)))
+        self.assertTrue(np.all(np.diff(kept) > 0)) # in offer order
+        self.assertEqual(len(kept), 10 + 30)
+        self.assertTrue(np.array_equal(kept[(kept >= 7) & (kept < 37)], np.arange(7, 37)))
+        # every tile of capped class is about equally likely to be kept
+        keptCounts = np.zeros(80)
+        for seed in range(300):
+            keptCounts[sample(seed)] += 1
+        class0Tiles = np.r_[0:7, 37:80]
+        self.assertLess(np.abs(keptCounts[class0Tiles] / 300.0 - 10 / 50.0).max(), 0.1)
+
+if __name__ == '__main__':
+    unittest.main()
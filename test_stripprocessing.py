@@ -0,0 +1,81 @@
+import unittest
+import logging as log
+import cv2
+import numpy as np
+import os
+import shutil
+import tempfile
+
+log.basicConfig() # by default only log messages for error and critical conditions
+log.getLogger().setLevel(log.INFO) # uncomment for more verbose log messages
+#log.getLogger().setLevel(log.DEBUG) # uncomment for even more verbose log messages
+
+import ImageSplitting as Imaging
+import Labelling
+import StripProcessing
+
+class Test_StripProcessing(unittest.TestCase):
+    def setUp(self):
+        self.splittingBlock = Imaging.SplittingBlock(blockWidth=70, blockHeight=70,
+                                                     OverlapHorizontal=20, OverlapVertical=20)
+        self.image = np.random.RandomState(5).randint(0, 256, size=(530, 310, 3)).astype(np.uint8)
+        self.tempFolder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempFolder)
+
+    def test_StripBlocksOfMemoryMappedImageMatchWholeImageBlocks(self):
+        npyFileName = os.path.join(self.tempFolder, 'image.npy')
+        np.save(npyFileName, self.image)
+        source = StripProcessing.openImageSource(npyFileName)
+        self.assertIsInstance(source.array, np.memmap)
+        for edgeMode in Imaging.BlockEdgeModes:
+            blocks, origins = Imaging.SplitImageInStridedBlocks(self.image, self.splittingBlock, edgeMode)
+            strips = list(StripProcessing.iterateStripBlocks(source, self.splittingBlock,
+                                                             BlockRowsPerStrip=3, EdgeMode=edgeMode))
+            self.assertGreater(len(strips), 1)
+            self.assertTrue(np.array_equal(np.vstack([strip[0] for strip in strips]), blocks))
+            self.assertTrue(np.array_equal(np.vstack([strip[1] for strip in strips]), origins))
+
+    def test_StripsOverlapByVerticalOverlapAndReadOnlyTheirRows(self):
+        rawFileName = os.path.join(self.tempFolder, 'image.raw')
+        self.image.tofile(rawFileName)
+        rowsRead = []
+        def readRows(RowStart, RowStop):
+            rowsRead.append((RowStart, RowStop))
+            return self.image[RowStart:RowStop]
+        for source in (StripProcessing.openImageSource(rawFileName, Shape=self.image.shape),
+                       StripProcessing.RegionImageSource(self.image.shape, readRows)):
+            strips = list(StripProcessing.iterateImageStrips(source, self.splittingBlock, BlockRowsPerStrip=2))
+            # 530 rows -> 10 block rows (drop), 2 per strip of 2 * 70 - 20 rows
+            self.assertEqual([(start, len(strip)) for strip, start, rowOrigins in strips],
+                             [(start, 120) for start in range(0, 500, 100)])
+            for strip, start, rowOrigins in strips:
+                self.assertTrue(np.array_equal(strip, self.image[start:start + len(strip)]))
+        self.assertEqual(rowsRead, [(start, start + 120) for start in range(0, 500, 100)])
+        badSource = StripProcessing.RegionImageSource(self.image.shape, lambda start, stop: self.image[:10])
+        self.assertRaises(ValueError, list, StripProcessing.iterateImageStrips(badSource, self.splittingBlock))
+
+    def test_EncodedImageSourceNeedsDecodeWhole(self):
+        pngFileName = os.path.join(self.tempFolder, 'image.png')
+        cv2.imwrite(pngFileName, self.image)
+        self.assertRaises(ValueError, StripProcessing.openImageSource, pngFileName)
+        source = StripProcessing.openImageSource(pngFileName, DecodeWhole=True)
+        self.assertEqual(source.shape, self.image.shape)
+        self.assertTrue(np.array_equal(source.readRows(10, 20), self.image[10:20]))
+
+    def test_StripSelectionMatchesWholeMaskSelection(self):
+        mask = np.zeros(self.image.shape[:2], dtype=bool)
+        mask[100:300, 50:200] = True
+        maskFileName = os.path.join(self.tempFolder, 'mask.npy')
+        np.save(maskFileName, mask)
+        selected, origins = Labelling.getBlockSelectionFromMask(mask, self.splittingBlock, 30, EdgeMode='pad')
+        strips = list(StripProcessing.iterateStripBlocks(
+            self.image, self.splittingBlock, BlockRowsPerStrip=4, EdgeMode='pad',
+            SelectionMask=np.load(maskFileName, mmap_mode='r'), SelectionPercentage=30))
+        self.assertTrue(np.array_equal(np.vstack([strip[2] for strip in strips]), selected))
+        self.assertRaises(ValueError, list, StripProcessing.iterateStripBlocks(
+            self.image, self.splittingBlock, SelectionMask=mask[:100]))
+
+if __name__ == '__main__':
+    unittest.main()
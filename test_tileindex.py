@@ -0,0 +1,77 @@
+import unittest
+import logging as log
+import numpy as np
+import os
+import shutil
+import tempfile
+
+log.basicConfig() # by default only log messages for error and critical conditions
+log.getLogger().setLevel(log.INFO) # uncomment for more verbose log messages
+#log.getLogger().setLevel(log.DEBUG) # uncomment for even more verbose log messages
+
+import ImageSplitting as Imaging
+import Features
+import TileIndex
+
+class Test_TileIndex(unittest.TestCase):
+    def setUp(self):
+        self.splittingBlock = Imaging.SplittingBlock(blockWidth=70, blockHeight=70,
+                                                     OverlapHorizontal=20, OverlapVertical=20)
+        randomState = np.random.RandomState(6)
+        self.images = dict(('img{}.png'.format(index), randomState.randint(0, 256, size=shape).astype(np.uint8))
+                           for index, shape in enumerate([(190, 260), (120, 180)]))
+        self.tileIndex = TileIndex.TileIndex()
+        samples = []
+        for label, (path, image) in enumerate(sorted(self.images.items())):
+            blocks, origins = Imaging.SplitImageInStridedBlocks(image, self.splittingBlock)
+            self.tileIndex.addImageTiles(path, origins, 70, 70, label)
+            samples.append(Features.extractFeatures(blocks))
+        self.samples = np.vstack(samples)
+
+    def test_QueriesSelectTilesByImageLabelAndRegion(self):
+        self.assertEqual(len(self.tileIndex), len(self.samples)) # 3x4 + 2x3 tiles
+        self.assertTrue(np.array_equal(self.tileIndex.query('img1.png'), np.arange(12, 18)))
+        self.assertTrue(np.array_equal(self.tileIndex.query(Label=0), np.arange(12)))
+        self.assertEqual(len(self.tileIndex.query('missing.png')), 0)
+        rows = self.tileIndex.query(Label=0, Region=(0, 0, 50, 50)) # overlaps top left tile only
+        self.assertTrue(np.array_equal(rows, [0]))
+        rows = self.tileIndex.query('img0.png', Region=(110, 110, 120, 150))
+        self.assertTrue(np.array_equal(self.tileIndex.tiles[rows][['y', 'x']].tolist(),
+                                       [(50, 50), (50, 100), (100, 50), (100, 100)]))
+        self.assertEqual(list(self.tileIndex.imagePaths([0, 12])), ['img0.png', 'img1.png'])
+
+    def test_SavedIndexLoadsAndReconstructsImagesFromSamples(self):
+        tempFolder = tempfile.mkdtemp()
+        try:
+            fileName = os.path.join(tempFolder, 'tiles.npz')
+            self.tileIndex.save(fileName)
+            loaded = TileIndex.LoadTileIndex(fileName)
+        finally:
+            shutil.rmtree(tempFolder)
+        self.assertTrue(np.array_equal(loaded.tiles, self.tileIndex.tiles))
+        self.assertEqual(loaded.paths, ['img0.png', 'img1.png'])
+        self.assertTrue(np.array_equal(loaded.query('img1.png'), np.arange(12, 18)))
+        image = loaded.reconstructImage(self.samples, 'img0.png')
+        self.assertTrue(np.array_equal(image, self.images['img0.png'][:170, :220]))
+        imageBlocks, splitBlock = loaded.getImageBlocks(self.samples, 'img1.png')
+        self.assertEqual(splitBlock, self.splittingBlock)
+        self.assertEqual((len(imageBlocks), len(imageBlocks[0])), (2, 3))
+        self.assertRaises(ValueError, loaded.reconstructImage, self.samples, 'missing.png')
+
+    def test_SavedIndexKeepsNonAsciiPaths(self):
+        byteName, unicodeName = 'gr\xc3\xa4s/img.png', u'gr\xe4s/img2.png' # utf-8 and unicode
+        self.tileIndex.internPath(byteName)
+        self.tileIndex.internPath(unicodeName)
+        tempFolder = tempfile.mkdtemp()
+        try:
+            fileName = os.path.join(tempFolder, 'tiles.npz')
+            self.tileIndex.save(fileName)
+            loaded = TileIndex.LoadTileIndex(fileName)
+        finally:
+            shutil.rmtree(tempFolder)
+        nativeNames = [name if isinstance(name, str) else name.encode('utf-8') for name in (byteName, unicodeName)]
+        self.assertEqual(loaded.paths, ['img0.png', 'img1.png'] + nativeNames)
+        self.assertTrue(all(isinstance(path, str) for path in loaded.paths))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,16 +6,47 @@ import cv2
 import numpy as np
 
 import os
+import shutil
+import tempfile
+import weakref
 
 log.basicConfig() # by default only log messages for error and critical conditions
 log.getLogger().setLevel(log.INFO) # uncomment for more verbose log messages
 #log.getLogger().setLevel(log.DEBUG) # uncomment for even more verbose log messages
 
 import ImageSplitting as Imaging
+import Labelling
 import Training
+import Features
+import Instrumentation
+import TileCache
 
 
+def createLabelledImageFolder(FolderPath, ImageShapes=((150, 200), (120, 260), (60, 60))):
+    ''' writes random grayscale images into label folders 0_NotGrass and 1_Grass '''
+    randomState = np.random.RandomState(0)
+    for labelFolder in ['0_NotGrass', '1_Grass']:
+        if not os.path.isdir(os.path.join(FolderPath, labelFolder)):
+            os.makedirs(os.path.join(FolderPath, labelFolder))
+        for index, shape in enumerate(ImageShapes):
+            img = randomState.randint(0, 256, size=shape).astype(np.uint8)
+            cv2.imwrite(os.path.join(FolderPath, labelFolder, '{}.png'.format(index)), img)
+
+class BrightBlockPredictor(object):
+    ''' stands in for a trained svm: predicts 1 for blocks brighter than mid gray '''
+    def predict_all(self, samples):
+        return np.float32(samples.mean(axis=1) > 127).reshape(-1, 1)
+
 class Test_Training(unittest.TestCase):
+    def setUp(self):
+        # labelled images of createLabelledImageFolder() and an empty cache folder
+        self.trainFolder, self.cacheFolder = tempfile.mkdtemp(), tempfile.mkdtemp()
+        createLabelledImageFolder(self.trainFolder)
+
+    def tearDown(self):
+        shutil.rmtree(self.trainFolder)
+        shutil.rmtree(self.cacheFolder)
+
     def test_CreateImageStructureFromFolders_AndApplyFunctionsOnThem(self):
         inputPath = os.path.join(os.path.abspath(os.curdir), 'input', 'train', 'grass')
         # load file names only without loading actual images
@@ -58,3 +89,265 @@ class Test_Training(unittest.TestCase):
         # increase accuracy include color i.e. R,G,B.
         # 10101010 training grass.Nograss.grass.Nograss.grass
 
+    def test_PreparedTrainingDataHoldsEveryCompleteBlockOfEveryImage(self):
+        trainingData, labelData, labels = Training.prepareTrainingDataFromImageStrucuture(self.trainFolder)
+        self.assertEqual(trainingData.dtype, np.float32)
+        self.assertDictEqual(labels, {'0': 'NotGrass', '1': 'Grass'})
+        # 150x200 -> 2x3 blocks, 120x260 -> 2x4 blocks, 60x60 -> none
+        self.assertEqual(trainingData.shape, (2 * (6 + 8), 70 * 70))
+        self.assertEqual(labelData.shape, (len(trainingData),))
+        self.assertEqual(np.count_nonzero(labelData == 1), 14)
+        expectedRows = []
+        for labelFolder in ['0_NotGrass', '1_Grass']:
+            for imageName in ['0.png', '1.png']:
+                img = cv2.imread(os.path.join(self.trainFolder, labelFolder, imageName), 0)
+                expectedRows.extend(block.flatten() for block in Imaging.iterateImageBlocks(
+                    Imaging.SplitImageinBlocksByShifting(img, Training.DefaultSplittingBlock))
+                                    if block.shape == (70, 70))
+        self.assertEqual(sorted(map(tuple, trainingData)), sorted(map(tuple, np.float32(expectedRows))))
+
+    def test_ParallelPreparationMatchesSerialPreparation(self):
+        serial = Training.prepareTrainingDataFromImageStrucuture(self.trainFolder, Seed=7)
+        threaded = Training.prepareTrainingDataFromImageStrucuture(self.trainFolder, Seed=7, Workers=3)
+        processes = Training.prepareTrainingDataFromImageStrucuture(self.trainFolder, Seed=7, Workers=2,
+                                                                    UseProcesses=True)
+        for parallel in (threaded, processes):
+            self.assertTrue(np.array_equal(serial[0], parallel[0]))
+            self.assertTrue(np.array_equal(serial[1], parallel[1]))
+            self.assertDictEqual(serial[2], parallel[2])
+
+    def test_PreparationRecordsStageTimesAndCounters(self):
+        Instrumentation.resetStats()
+        trainingData, labelData, labels = Training.prepareTrainingDataFromImageStrucuture(self.trainFolder)
+        stats = Instrumentation.getStats()
+        self.assertEqual(stats['counters']['images'], 6)
+        self.assertEqual(stats['counters']['tiles'], len(trainingData))
+        self.assertEqual(stats['counters']['bytesDecoded'], 2 * (150 * 200 + 120 * 260 + 60 * 60))
+        for stage in ['list', 'count', 'decode', 'split', 'prepare']:
+            self.assertGreater(stats['stages'][stage].calls, 0)
+        self.assertEqual(stats['stages']['decode'].calls, 6)
+
+    def test_PipelinedPreparationAndDetectionMatchSerial(self):
+        serial = Training.prepareTrainingDataFromImageStrucuture(self.trainFolder, Seed=3)
+        pipeline = Training.createImageLoadingPipeline(ReadWorkers=3, DecodeWorkers=2, TileWorkers=2,
+                                                       FeatureWorkers=2, QueueSize=1)
+        for pipelined in (True, pipeline):
+            prepared = Training.prepareTrainingDataFromImageStrucuture(self.trainFolder, Seed=3,
+                                                                       Pipelined=pipelined)
+            self.assertTrue(np.array_equal(serial[0], prepared[0]))
+            self.assertTrue(np.array_equal(serial[1], prepared[1]))
+        self.assertEqual([stage['items'] for stage in pipeline.stats()], [6] * 4)
+        serialFeatures = Training.prepareTrainingDataFromImageStrucuture(self.trainFolder, Seed=3,
+                                                                         FeatureExtractor='histogram')
+        pipelinedFeatures = Training.prepareTrainingDataFromImageStrucuture(
+            self.trainFolder, Seed=3, FeatureExtractor='histogram', Pipelined=pipeline)
+        self.assertTrue(np.array_equal(serialFeatures[0], pipelinedFeatures[0]))
+        self.assertRaises(ValueError, Training.prepareTrainingDataFromImageStrucuture, self.trainFolder,
+                          Pipelined=True, Workers=2)
+        detector = Training.SVMDetector(Svm=BrightBlockPredictor())
+        imageFilenames = Training.listTrainingImages(self.trainFolder, Seed=3) + ['missing.png']
+        expected = list(detector.predictImageFiles(imageFilenames))
+        self.assertEqual(len(expected), 6)
+        for pipelined in (True, detector.createPipeline(ReadWorkers=2, QueueSize=1)):
+            predicted = list(detector.predictImageFiles(imageFilenames, Pipelined=pipelined))
+            self.assertEqual([name for name, values, origins in predicted], imageFilenames[:6])
+            for (name, values, origins), (expectedName, expectedValues, expectedOrigins) in zip(predicted, expected):
+                self.assertTrue(np.array_equal(values, expectedValues))
+
+    def test_TileIndexRecordsImageAndPositionOfEveryRow(self):
+        trainingData, labelData, labels, tileIndex = Training.prepareTrainingDataFromImageStrucuture(
+            self.trainFolder, Seed=4, ReturnTileIndex=True)
+        self.assertEqual(len(tileIndex), len(trainingData))
+        self.assertTrue(np.array_equal(tileIndex.tiles['label'], labelData))
+        for imgFileName in tileIndex.paths:
+            img = cv2.imread(imgFileName, 0)
+            blocks, origins = Imaging.SplitImageInStridedBlocks(img, Training.DefaultSplittingBlock)
+            rows = tileIndex.query(imgFileName)
+            self.assertTrue(np.array_equal(trainingData[rows], Features.extractFeatures(blocks)))
+            reconstructed = tileIndex.reconstructImage(trainingData, imgFileName)
+            self.assertTrue(np.array_equal(reconstructed, img[:len(reconstructed), :reconstructed.shape[1]]))
+        hogData, hogLabelData, labels, hogIndex = Training.prepareTrainingDataFromImageStrucuture(
+            self.trainFolder, Seed=4, FeatureExtractor='hog', CacheFolder=self.cacheFolder,
+            ReturnTileIndex=True)
+        self.assertTrue(np.array_equal(hogIndex.tiles, tileIndex.tiles))
+        # origins of cached feature matrices come from their block grid, not from the images
+        def failReading(*args):
+            raise AssertionError('image read')
+        imread, getImageSizeFromHeader = cv2.imread, Imaging.getImageSizeFromHeader
+        cv2.imread = Imaging.getImageSizeFromHeader = failReading
+        try:
+            hogData, hogLabelData, labels, hogIndex = Training.prepareTrainingDataFromImageStrucuture(
+                self.trainFolder, Seed=4, FeatureExtractor='hog', CacheFolder=self.cacheFolder,
+                ReturnTileIndex=True)
+        finally:
+            cv2.imread, Imaging.getImageSizeFromHeader = imread, getImageSizeFromHeader
+        self.assertTrue(np.array_equal(hogIndex.tiles, tileIndex.tiles))
+        self.assertRaises(ValueError, Training.getImageBlockOrigins, hogData)
+
+    def test_SampledPreparationCapsClassesKeepingRowOrder(self):
+        # adds a 190x190 image (3x3 blocks) to each label folder
+        createLabelledImageFolder(self.trainFolder, ImageShapes=((150, 200), (120, 260), (60, 60), (190, 190)))
+        trainingData, labelData, labels = Training.prepareTrainingDataFromImageStrucuture(
+            self.trainFolder, Seed=5)
+        self.assertEqual(np.count_nonzero(labelData == 0), 6 + 8 + 9)
+        sampled = Training.prepareTrainingDataFromImageStrucuture(
+            self.trainFolder, Seed=5, MaxSamplesPerClass={'1': 10}, ReturnTileIndex=True)
+        self.assertEqual(np.count_nonzero(sampled[1] == 0), 23)
+        self.assertEqual(np.count_nonzero(sampled[1] == 1), 10)
+        # sampled rows are rows of the full data in the same order
+        fullRows = dict((row.tobytes(), index) for index, row in enumerate(trainingData))
+        rowNumbers = [fullRows[row.tobytes()] for row in sampled[0]]
+        self.assertEqual(rowNumbers, sorted(rowNumbers))
+        self.assertTrue(np.array_equal(sampled[1], labelData[rowNumbers]))
+        tileIndex = sampled[3]
+        self.assertTrue(np.array_equal(tileIndex.tiles['label'], sampled[1]))
+        for row in [0, len(sampled[0]) - 1]:
+            tile = tileIndex.tiles[row]
+            img = cv2.imread(tileIndex.paths[tile['imageId']], 0)
+            self.assertTrue(np.array_equal(sampled[0][row].reshape(70, 70),
+                                           img[tile['y']:tile['y'] + 70, tile['x']:tile['x'] + 70]))
+        again = Training.prepareTrainingDataFromImageStrucuture(self.trainFolder, Seed=5,
+                                                                MaxSamplesPerClass={'1': 10}, Workers=2)
+        self.assertTrue(np.array_equal(again[0], sampled[0]))
+        balanced = Training.prepareTrainingDataFromImageStrucuture(
+            self.trainFolder, Seed=5, MaxTotalSamples=20, ClassRatios={'0': 1, '1': 1})
+        self.assertEqual([np.count_nonzero(balanced[1] == label) for label in (0, 1)], [10, 10])
+        capped = Training.prepareTrainingDataFromImageStrucuture(self.trainFolder, Seed=5, MaxSamplesPerClass=20)
+        self.assertEqual([np.count_nonzero(capped[1] == label) for label in (0, 1)], [20, 20])
+
+    def test_TileCacheReusesUnchangedImagesAndEvictsDeletedOnes(self):
+        uncached = Training.prepareTrainingDataFromImageStrucuture(self.trainFolder, Seed=3)
+        cached = Training.prepareTrainingDataFromImageStrucuture(self.trainFolder, Seed=3,
+                                                                 CacheFolder=self.cacheFolder)
+        rawCacheFolder = TileCache.getTileCacheFolder(self.cacheFolder, self.trainFolder,
+                                                      Training.DefaultSplittingBlock, np.float32)
+        self.assertEqual(len(os.listdir(rawCacheFolder)), 6) # one per readable image
+        reloaded = Training.prepareTrainingDataFromImageStrucuture(self.trainFolder, Seed=3,
+                                                                   CacheFolder=self.cacheFolder)
+        for result in (cached, reloaded):
+            self.assertTrue(np.array_equal(uncached[0], result[0]))
+            self.assertTrue(np.array_equal(uncached[1], result[1]))
+        # builds of another folder and other features sharing the cache
+        otherFolder = os.path.join(self.trainFolder, '0_NotGrass')
+        Training.prepareTrainingDataFromImageStrucuture(otherFolder, CacheFolder=self.cacheFolder)
+        Training.prepareTrainingDataFromImageStrucuture(self.trainFolder, FeatureExtractor='hog',
+                                                        CacheFolder=self.cacheFolder)
+        self.assertEqual(len(os.listdir(self.cacheFolder)), 3)
+        # change one image, delete another
+        changedImage = os.path.join(self.trainFolder, '1_Grass', '0.png')
+        cv2.imwrite(changedImage, np.zeros((140, 140), np.uint8))
+        os.utime(changedImage, (0, 12345))
+        os.remove(os.path.join(self.trainFolder, '0_NotGrass', '1.png'))
+        uncached = Training.prepareTrainingDataFromImageStrucuture(self.trainFolder, Seed=3)
+        rebuilt = Training.prepareTrainingDataFromImageStrucuture(self.trainFolder, Seed=3,
+                                                                  CacheFolder=self.cacheFolder)
+        self.assertTrue(np.array_equal(uncached[0], rebuilt[0]))
+        self.assertTrue(np.array_equal(uncached[1], rebuilt[1]))
+        self.assertEqual(len(os.listdir(rawCacheFolder)), 5)
+        # other folder's and features' entries are not evicted
+        self.assertEqual(sorted(len(os.listdir(os.path.join(self.cacheFolder, folder)))
+                                for folder in os.listdir(self.cacheFolder)), [3, 5, 6])
+
+    def test_CachedBuildOpensOneCacheFileAtATime(self):
+        uncached = Training.prepareTrainingDataFromImageStrucuture(self.trainFolder, Seed=3)
+        Training.prepareTrainingDataFromImageStrucuture(self.trainFolder, Seed=3, CacheFolder=self.cacheFolder)
+        openedBlocks, maxOpen = [], []
+        loadCachedBlocks = TileCache.loadCachedBlocks
+        def trackedLoad(CacheFolder, Key):
+            maxOpen.append(sum(blocks() is not None for blocks in openedBlocks) + 1)
+            blocks = loadCachedBlocks(CacheFolder, Key)
+            openedBlocks.append(weakref.ref(blocks))
+            return blocks
+        TileCache.loadCachedBlocks = trackedLoad
+        try:
+            cached = Training.prepareTrainingDataFromImageStrucuture(self.trainFolder, Seed=3,
+                                                                     CacheFolder=self.cacheFolder)
+        finally:
+            TileCache.loadCachedBlocks = loadCachedBlocks
+        self.assertEqual(len(maxOpen), 6)
+        self.assertEqual(max(maxOpen), 1)
+        self.assertTrue(np.array_equal(uncached[0], cached[0]))
+
+    def test_StreamedBatchesMatchPreparedTrainingData(self):
+        trainingData, labelData, labels = Training.prepareTrainingDataFromImageStrucuture(
+            self.trainFolder, Seed=5)
+        batches = list(Training.iterateTrainingDataBatches(self.trainFolder, BatchSize=8, Seed=5))
+        self.assertEqual([len(samples) for samples, labelValues in batches], [8, 8, 8, 4])
+        self.assertTrue(np.array_equal(np.vstack([samples for samples, labelValues in batches]),
+                                       trainingData))
+        self.assertTrue(np.array_equal(np.concatenate([labelValues for samples, labelValues
+                                                       in batches]), labelData))
+        # streamed detection does not use the cache
+        self.assertRaises(ValueError, Training.LoadNDetectSVM, 'svm_test.dat', self.trainFolder,
+                          CacheFolder=self.cacheFolder, BatchSize=8)
+        for option in [dict(Pipelined=True), dict(FeatureKey='mean')]:
+            self.assertRaises(ValueError, Training.LoadNDetectSVM, 'svm_test.dat', self.trainFolder,
+                              BatchSize=8, **option)
+
+    def test_DenseBlockPredictionsCreateFullResolutionClassMap(self):
+        image = np.zeros((230, 300, 3), np.uint8)
+        image[:, 150:] = 255 # right half bright
+        detectedValues, origins = Training.predictImageBlocks(BrightBlockPredictor(), image)
+        self.assertEqual(detectedValues.shape, origins.shape[:2])
+        classMap = Imaging.CreateImageFromBlockValues(detectedValues, origins, image.shape,
+                                                      Training.DefaultSplittingBlock, 'vote')
+        self.assertEqual(classMap.shape, image.shape[:2])
+        self.assertFalse(np.isnan(classMap).any()) # shifted edge blocks cover every pixel
+        self.assertTrue((classMap[:, :100] == 0).all() and (classMap[:, 200:] == 1).all())
+
+    def test_DetectorPredictsBlocksStacksAndImagesInBatches(self):
+        detector = Training.SVMDetector(Svm=BrightBlockPredictor(), BatchSize=5)
+        detector.warmUp()
+        self.assertEqual(detector.stats()['calls'], 1)
+        bright = np.full((70, 70), 200, np.uint8)
+        self.assertEqual(detector.predictBlocks(bright), 1)
+        stack = np.array([bright, bright // 4, bright])
+        self.assertEqual(list(detector.predictBlocks(stack)), [1, 0, 1])
+        self.assertRaises(ValueError, detector.predictBlocks, np.zeros((3, 60, 70)))
+        image = np.zeros((230, 300), np.uint8)
+        image[:, 150:] = 255
+        detectedValues, origins = Training.predictImageBlocks(BrightBlockPredictor(), image)
+        self.assertTrue(np.array_equal(detector.predictImage(image)[0], detectedValues))
+        self.assertEqual(detector.detectImage(image).shape, image.shape)
+        stats = detector.stats()
+        self.assertEqual(stats['calls'], 5)
+        self.assertEqual(stats['samples'], 1 + 1 + 3 + 2 * detectedValues.size)
+
+    def test_DetectorPredictsLargeImagesStripByStrip(self):
+        detector = Training.SVMDetector(Svm=BrightBlockPredictor())
+        image = np.zeros((530, 300, 3), np.uint8)
+        image[:, 150:] = 255
+        detectedValues, origins = detector.predictImage(image)
+        stripValues, stripOrigins = detector.predictImageStrips(image, BlockRowsPerStrip=3)
+        self.assertTrue(np.array_equal(stripValues, detectedValues))
+        self.assertTrue(np.array_equal(stripOrigins, origins))
+        mask = np.zeros(image.shape[:2], dtype=bool)
+        mask[:, 200:] = True
+        stripValues, stripOrigins = detector.predictImageStrips(image, BlockRowsPerStrip=3, SelectionMask=mask)
+        selected, origins = Labelling.getBlockSelectionFromMask(mask, Training.DefaultSplittingBlock,
+                                                                EdgeMode='shift')
+        self.assertTrue(np.array_equal(stripValues[selected], detectedValues[selected]))
+        self.assertTrue(np.isnan(stripValues[~selected]).all())
+
+    def test_FeatureExtractorAppliesToPreparedStreamedAndCachedData(self):
+        rawData, labelData, labels = Training.prepareTrainingDataFromImageStrucuture(self.trainFolder, Seed=9)
+        hogData, hogLabelData, labels = Training.prepareTrainingDataFromImageStrucuture(
+            self.trainFolder, Seed=9, FeatureExtractor='hog')
+        self.assertEqual(hogData.shape, (len(rawData), 7 * 7 * 9))
+        self.assertTrue(np.array_equal(labelData, hogLabelData))
+        expected = Features.extractFeatures(rawData.reshape(-1, 70, 70), 'hog')
+        self.assertTrue(np.allclose(hogData, expected, atol=1e-5))
+        streamed = np.vstack([samples for samples, labelValues in Training.iterateTrainingDataBatches(
+            self.trainFolder, BatchSize=6, Seed=9, FeatureExtractor='hog')])
+        self.assertTrue(np.allclose(streamed, hogData, atol=1e-5))
+        for repeat in range(2): # build then reload the cache
+            cached = Training.prepareTrainingDataFromImageStrucuture(
+                self.trainFolder, Seed=9, FeatureExtractor='hog', CacheFolder=self.cacheFolder)
+            self.assertTrue(np.array_equal(cached[0], hogData))
+        # custom extractors are cached under their FeatureKey
+        meanFeatures = lambda blocks: blocks.mean(axis=(1, 2))[:, np.newaxis]
+        self.assertRaises(ValueError, Training.prepareTrainingDataFromImageStrucuture, self.trainFolder,
+                          FeatureExtractor=meanFeatures, CacheFolder=self.cacheFolder)
+        cached = Training.prepareTrainingDataFromImageStrucuture(
+            self.trainFolder, Seed=9, FeatureExtractor=meanFeatures, FeatureKey='mean', CacheFolder=self.cacheFolder)
+        self.assertTrue(np.allclose(cached[0].ravel(), rawData.mean(axis=1)))